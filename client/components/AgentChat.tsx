@@ -15,6 +15,9 @@ import { triggerMealsRefresh } from '@/hooks/mealsRefresh';
 
 const API_GATEWAY_URL = process.env.EXPO_PUBLIC_API_GATEWAY_URL || '';
 
+// Consecutive failed /jobs polls before giving up on a reply
+const MAX_FAILED_POLLS = 3;
+
 interface Message {
   id: string;
   text: string;
@@ -22,12 +25,36 @@ interface Message {
   timestamp: Date;
 }
 
+// Fetch a JSON endpoint, throwing the server's error message on a non-2xx status
+async function fetchJson(url: string, init?: RequestInit) {
+  const response = await fetch(url, init);
+  console.log('Response status:', response.status, response.statusText);
+
+  let data;
+  try {
+    const text = await response.text();
+    data = text ? JSON.parse(text) : {};
+  } catch (parseError) {
+    console.error('Failed to parse response as JSON:', parseError);
+    throw new Error(`Server returned invalid JSON. Status: ${response.status}`);
+  }
+
+  if (!response.ok) {
+    const errorMsg = data.error || `Server error: ${response.status} ${response.statusText}`;
+    console.error('API Error:', errorMsg, data);
+    throw new Error(errorMsg);
+  }
+  return data;
+}
+
 export default function AgentChat() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [inputText, setInputText] = useState('');
   const [loading, setLoading] = useState(false);
   const { session } = useAuth();
   const scrollViewRef = useRef<ScrollView>(null);
+  // The reply being received, so "Thinking..." shows only until its first piece
+  const agentMessageIdRef = useRef<string | null>(null);
 
   useEffect(() => {
     // Scroll to bottom when new messages are added
@@ -64,15 +91,28 @@ export default function AgentChat() {
     setInputText('');
     setLoading(true);
 
+    const agentMessageId = (Date.now() + 1).toString();
+    agentMessageIdRef.current = agentMessageId;
+    // Show the reply as it grows; the first piece replaces the "Thinking..." bubble
+    const showReply = (text: string) => {
+      setMessages(prev => {
+        const others = prev.filter(m => m.id !== agentMessageId);
+        return [...others, { id: agentMessageId, text, isUser: false, timestamp: new Date() }];
+      });
+    };
+
     try {
       // API_GATEWAY_URL from terraform output already includes /agent at the end
       const endpoint = API_GATEWAY_URL;
+      const jobsEndpoint = API_GATEWAY_URL.replace(/\/agent\/?$/, '/jobs');
       const localDate = new Date().toISOString().slice(0, 10);
-      
+
       console.log('Sending request to:', endpoint);
       console.log('Request body:', { message: userMessage.text, hasToken: !!session.access_token });
-      
-      const response = await fetch(endpoint, {
+
+      // The turn runs as a job; polling /jobs returns the reply's pieces as the
+      // agent produces them, so text appears long before the turn finishes
+      const submitted = await fetchJson(endpoint, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -81,40 +121,53 @@ export default function AgentChat() {
           message: userMessage.text,
           access_token: session.access_token,
           local_date: localDate,
+          // Lets the server recognize a retry of this message and reply to it once
+          request_id: userMessage.id,
+          async: true,
         }),
       });
-
-      console.log('Response status:', response.status, response.statusText);
-      console.log('Response headers:', Object.fromEntries(response.headers.entries()));
-
-      let data;
-      try {
-        const text = await response.text();
-        console.log('Response body (raw):', text);
-        data = text ? JSON.parse(text) : {};
-      } catch (parseError) {
-        console.error('Failed to parse response as JSON:', parseError);
-        throw new Error(`Server returned invalid JSON. Status: ${response.status}`);
+      if (!submitted.job_id) {
+        throw new Error('No job_id in server response');
       }
 
-      if (!response.ok) {
-        const errorMsg = data.error || `Server error: ${response.status} ${response.statusText}`;
-        console.error('API Error:', errorMsg, data);
-        throw new Error(errorMsg);
+      let reply = '';
+      let after = 0;
+      let failedPolls = 0;
+      for (;;) {
+        let job;
+        try {
+          job = await fetchJson(
+            `${jobsEndpoint}?job_id=${encodeURIComponent(submitted.job_id)}&after=${after}&wait=20`,
+            { headers: { Authorization: `Bearer ${session.access_token}` } }
+          );
+          failedPolls = 0;
+        } catch (pollError) {
+          // A dropped poll loses nothing: the next one asks for the same pieces again
+          failedPolls += 1;
+          if (failedPolls >= MAX_FAILED_POLLS) {
+            throw pollError;
+          }
+          await new Promise(resolve => setTimeout(resolve, 1000));
+          continue;
+        }
+        if (job.chunks?.length) {
+          reply += job.chunks.join('');
+          showReply(reply);
+        }
+        after = job.next ?? after;
+        if (job.status === 'done') {
+          reply = job.response ?? reply;
+          break;
+        }
+        if (job.status === 'failed') {
+          throw new Error(job.error || 'Agent request failed');
+        }
       }
 
-      if (!data.response) {
+      if (!reply) {
         throw new Error('No response field in server response');
       }
-
-      const agentMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        text: data.response,
-        isUser: false,
-        timestamp: new Date(),
-      };
-
-      setMessages(prev => [...prev, agentMessage]);
+      showReply(reply);
       
       // Trigger refresh for meals list and calorie count after agent responds
       // This ensures the UI updates if meals were added/modified/deleted via the agent
@@ -124,13 +177,7 @@ export default function AgentChat() {
       const errorMsg = error.message || 'Failed to send message';
       Alert.alert('Error', errorMsg);
       
-      const errorMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        text: `Error: ${errorMsg}`,
-        isUser: false,
-        timestamp: new Date(),
-      };
-      setMessages(prev => [...prev, errorMessage]);
+      showReply(`Error: ${errorMsg}`);
     } finally {
       setLoading(false);
     }
@@ -172,7 +219,7 @@ export default function AgentChat() {
             </Text>
           </View>
         ))}
-        {loading && (
+        {loading && !messages.some(m => m.id === agentMessageIdRef.current) && (
           <View style={[styles.messageBubble, styles.agentMessage]}>
             <Text style={[styles.messageText, styles.agentMessageText]}>
               Thinking...
@@ -1,38 +1,73 @@
-import { supabase } from '@/constants/supabase';
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Alert, FlatList, StyleSheet, Text, View } from 'react-native';
 import { useAuth } from '@/context/AuthProvider';
 
+const API_GATEWAY_URL = process.env.EXPO_PUBLIC_API_GATEWAY_URL || '';
+// GET /history sits next to /agent on the same API
+const HISTORY_URL = API_GATEWAY_URL.replace(/\/agent\/?$/, '/history');
+
 interface PastCaloriesProps {
   refreshTrigger: number;
 }
 
+interface HistoryBucket {
+  start: string;
+  calories: number;
+  protein: number;
+  carbs: number;
+  fat: number;
+  days_logged: number;
+}
+
 export default function PastCalories({ refreshTrigger }: PastCaloriesProps) {
-  const [pastRecords, setPastRecords] = useState<any[]>([]);
-  const { user } = useAuth();
+  const [pastRecords, setPastRecords] = useState<HistoryBucket[]>([]);
+  const { user, session } = useAuth();
+  // The last reply's ETag; a refresh sends it back and gets 304, or only the changed days
+  const etagRef = useRef<string | null>(null);
 
   const fetchPastHistory = async () => {
-    if (!user) {
+    if (!user || !session?.access_token || !HISTORY_URL) {
+      etagRef.current = null;
       setPastRecords([]);
       return;
     }
 
-    const { data, error } = await supabase
-      .from('CalTracker')
-      .select('*')
-      .eq('user_id', user.id)
-      .order('created_at', { ascending: false })
-      .limit(30);
-
-    if (error) {
+    const headers: Record<string, string> = { Authorization: `Bearer ${session.access_token}` };
+    if (etagRef.current) {
+      headers['If-None-Match'] = etagRef.current;
+    }
+    try {
+      const response = await fetch(HISTORY_URL, { headers });
+      if (response.status === 304) {
+        return;
+      }
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || `Server error: ${response.status}`);
+      }
+      etagRef.current = response.headers.get('ETag');
+      // Buckets come oldest first; the list shows the newest day on top
+      const buckets: HistoryBucket[] = data.buckets || [];
+      setPastRecords(previous => {
+        const byDay = new Map<string, HistoryBucket>();
+        for (const bucket of data.full ? [] : previous) {
+          byDay.set(bucket.start, bucket);
+        }
+        for (const bucket of buckets) {
+          byDay.set(bucket.start, bucket);
+        }
+        return [...byDay.values()].sort((a, b) => b.start.localeCompare(a.start));
+      });
+    } catch (error) {
+      console.error('Failed to fetch past history:', error);
+      etagRef.current = null;
       Alert.alert('Error', 'Failed to fetch past history');
-    } else {
-      setPastRecords(data || []);
     }
   };
 
-  const formatDate = (dateString: string) => {
-    const date = new Date(dateString);
+  // `day` is a calendar date (YYYY-MM-DD); parsed as local midnight so it isn't shifted a day back west of UTC
+  const formatDate = (day: string) => {
+    const date = new Date(`${day}T00:00:00`);
     return date.toLocaleDateString('en-US', { 
       month: 'short', 
       day: 'numeric',
@@ -40,9 +75,15 @@ export default function PastCalories({ refreshTrigger }: PastCaloriesProps) {
     });
   };
 
+  useEffect(() => {
+    // Another user's ETag would only fetch what changed since, on top of the wrong rows
+    etagRef.current = null;
+    setPastRecords([]);
+  }, [user?.id]);
+
   useEffect(() => {
     fetchPastHistory();
-  }, [refreshTrigger, user]);
+  }, [refreshTrigger, user, session?.access_token]);
 
   return (
     <View style={styles.container}>
@@ -50,10 +91,10 @@ export default function PastCalories({ refreshTrigger }: PastCaloriesProps) {
       
       <FlatList
         data={pastRecords}
-        keyExtractor={(item) => item.id.toString()}
+        keyExtractor={(item) => item.start}
         renderItem={({ item }) => (
           <View style={styles.recordItem}>
-            <Text style={styles.date}>{formatDate(item.created_at)}</Text>
+            <Text style={styles.date}>{formatDate(item.start)}</Text>
             <View style={styles.nutritionRow}>
               <Text style={styles.nutritionText}>{item.calories} cal</Text>
               <Text style={styles.nutritionText}>{item.protein}g protein</Text>
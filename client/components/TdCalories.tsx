@@ -17,11 +17,13 @@ export default function TdCalories({ refreshTrigger }: TdCaloriesProps) {
       return;
     }
 
+    // One CalTracker row per user and UTC day; today's may not exist yet
+    const today = new Date().toISOString().split('T')[0];
     const { data, error } = await supabase
       .from('CalTracker')
       .select('*')
       .eq('user_id', user.id)
-      .order('created_at', { ascending: false })
+      .eq('day', today)
       .limit(1);
 
     if (error) {
@@ -31,8 +33,9 @@ export default function TdCalories({ refreshTrigger }: TdCaloriesProps) {
     }
   };
 
-  const formatDate = (dateString: string) => {
-    const date = new Date(dateString);
+  // `day` is a calendar date (YYYY-MM-DD); parsed as local midnight so it isn't shifted a day back west of UTC
+  const formatDate = (day: string) => {
+    const date = new Date(`${day}T00:00:00`);
     return date.toLocaleDateString('en-US', { 
       month: 'short', 
       day: 'numeric',
@@ -50,7 +53,7 @@ export default function TdCalories({ refreshTrigger }: TdCaloriesProps) {
       
       {dailyRecords.length > 0 ? (
         <View style={styles.recordItem}>
-          <Text style={styles.date}>{formatDate(dailyRecords[0].created_at)}</Text>
+          <Text style={styles.date}>{formatDate(dailyRecords[0].day)}</Text>
           <View style={styles.nutritionRow}>
             <Text style={styles.nutritionText}>{dailyRecords[0].calories} cal</Text>
             <Text style={styles.nutritionText}>{dailyRecords[0].protein}g protein</Text>
@@ -59,7 +62,7 @@ export default function TdCalories({ refreshTrigger }: TdCaloriesProps) {
           </View>
         </View>
       ) : (
-        <Text style={styles.emptyText}>No daily records yet. Save some totals from the Meals tab!</Text>
+        <Text style={styles.emptyText}>No meals logged today yet.</Text>
       )}
     </View>
   );
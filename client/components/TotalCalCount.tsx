@@ -1,5 +1,5 @@
 import { supabase } from '@/constants/supabase';
-import { useEffect, useState, useRef } from 'react';
+import { useEffect, useState } from 'react';
 import { Alert, StyleSheet, Text, View } from 'react-native';
 import { useAuth } from '@/context/AuthProvider';
 import { triggerDailyRefresh } from '@/hooks/dailyCountRefresh';
@@ -16,7 +16,6 @@ export default function TotalCalCount({ refreshTrigger }: TotalCalCountProps) {
     fat: 0
   });
   const { user } = useAuth();
-  const isSavingRef = useRef(false);
 
   const fetchTodaysTotals = async () => {
     console.log('[TotalCalCount] fetchTodaysTotals called, refreshTrigger:', refreshTrigger, 'user:', user?.id ?? null);
@@ -26,96 +25,26 @@ export default function TotalCalCount({ refreshTrigger }: TotalCalCountProps) {
       return;
     }
 
+    // The database keeps one CalTracker row per user and UTC day current as
+    // meals are added, edited or deleted, so today's totals are a one-row read
     const { data, error } = await supabase
-      .from('Meals')
+      .from('CalTracker')
       .select('calories, protein, carbs, fat')
       .eq('user_id', user.id)
-      .gte('created_at', `${today}T00:00:00`)
-      .lt('created_at', `${today}T23:59:59`);
+      .eq('day', today)
+      .maybeSingle();
 
     if (error) {
       Alert.alert('Error', 'Failed to fetch daily totals');
     } else {
-      const dailyTotals = data?.reduce(
-        (acc, meal) => ({
-          calories: acc.calories + (meal.calories || 0),
-          protein: acc.protein + (meal.protein || 0),
-          carbs: acc.carbs + (meal.carbs || 0),
-          fat: acc.fat + (meal.fat || 0)
-        }),
-        { calories: 0, protein: 0, carbs: 0, fat: 0 }
-      ) || { calories: 0, protein: 0, carbs: 0, fat: 0 };
-
-      setTotals(dailyTotals);
-      saveDailyTotals(dailyTotals);
-    }
-  };
-
-  const saveDailyTotals = async (dailyTotals: typeof totals) => {
-    // Prevent concurrent saves to avoid race condition
-    if (isSavingRef.current) {
-      console.log('[TotalCalCount] Save already in progress, skipping...');
-      return;
-    }
-
-    const today = new Date().toISOString().split('T')[0];
-    
-    // Check if there's already a record for today
-    if (!user) return;
-
-    isSavingRef.current = true;
-
-    try {
-      const { data: existingRecords, error: fetchError } = await supabase
-        .from('CalTracker')
-        .select('id')
-        .eq('user_id', user.id)
-        .gte('created_at', `${today}T00:00:00`)
-        .lt('created_at', `${today}T23:59:59`);
-
-      if (fetchError) {
-        console.log('Error fetching CalTracker record:', fetchError);
-        return;
-      }
-
-      const existingRecord = existingRecords && existingRecords.length > 0 ? existingRecords[0] : null;
-
-      let data, error;
-      
-      if (existingRecord) {
-        ({ data, error } = await supabase
-          .from('CalTracker')
-          .update({
-            calories: dailyTotals.calories,
-            protein: dailyTotals.protein,
-            carbs: dailyTotals.carbs,
-            fat: dailyTotals.fat
-          })
-          .eq('id', existingRecord.id)
-          .eq('user_id', user.id));
-      } else {
-        ({ data, error } = await supabase
-          .from('CalTracker')
-          .insert({
-            calories: dailyTotals.calories,
-            protein: dailyTotals.protein,
-            carbs: dailyTotals.carbs,
-            fat: dailyTotals.fat,
-            user_id: user.id
-          }));
-        if (error){
-          console.error('Error inserting new record:', error);
-        }
-        console.log(`Inserting new record: ${data}`);
-      }
-
-      if (!error) {
-        triggerDailyRefresh();
-      }
-    } catch (error) {
-      console.error('Unexpected error in saveDailyTotals:', error);
-    } finally {
-      isSavingRef.current = false;
+      setTotals({
+        calories: Number(data?.calories ?? 0),
+        protein: Number(data?.protein ?? 0),
+        carbs: Number(data?.carbs ?? 0),
+        fat: Number(data?.fat ?? 0)
+      });
+      // The daily tracker reads the same rows; refresh it after meal changes too
+      triggerDailyRefresh();
     }
   };
 
@@ -0,0 +1,21 @@
+-- The original tables. Supabase provides auth.users.
+CREATE TABLE IF NOT EXISTS Meals (
+  id SERIAL PRIMARY KEY,
+  user_id UUID NOT NULL REFERENCES auth.users(id),
+  meal_name TEXT NOT NULL,
+  calories NUMERIC NOT NULL,
+  protein NUMERIC,
+  carbs NUMERIC,
+  fat NUMERIC,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS CalTracker (
+  id SERIAL PRIMARY KEY,
+  user_id UUID NOT NULL REFERENCES auth.users(id),
+  calories NUMERIC NOT NULL,
+  protein NUMERIC,
+  carbs NUMERIC,
+  fat NUMERIC,
+  created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
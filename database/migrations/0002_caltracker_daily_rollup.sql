@@ -0,0 +1,40 @@
+-- One CalTracker row per user and UTC day. The Tools Lambda kept it current
+-- through apply_daily_totals_delta until 0007 moved the rollup into triggers
+-- on Meals; 0008 drops the function.
+ALTER TABLE CalTracker ADD COLUMN IF NOT EXISTS day DATE;
+UPDATE CalTracker SET day = (created_at AT TIME ZONE 'utc')::date WHERE day IS NULL;
+ALTER TABLE CalTracker
+  ALTER COLUMN day SET DEFAULT (NOW() AT TIME ZONE 'utc')::date,
+  ALTER COLUMN day SET NOT NULL;
+
+-- The rollup upserts ON CONFLICT (user_id, day), and /history and
+-- /getDailyTotals read user_id + day ranges through the same key. Tables from
+-- before it can hold several rows for one day (the app used to insert a row per
+-- save); the latest is kept.
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_index i
+    WHERE i.indrelid = 'caltracker'::regclass AND i.indisunique
+      AND i.indkey::int2[] = ARRAY[
+        (SELECT attnum FROM pg_attribute WHERE attrelid = 'caltracker'::regclass AND attname = 'user_id'),
+        (SELECT attnum FROM pg_attribute WHERE attrelid = 'caltracker'::regclass AND attname = 'day')]
+  ) THEN
+    DELETE FROM CalTracker older USING CalTracker newer
+      WHERE older.user_id = newer.user_id AND older.day = newer.day AND older.id < newer.id;
+    CREATE UNIQUE INDEX caltracker_user_day ON CalTracker (user_id, day);
+  END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION apply_daily_totals_delta(
+  p_user_id UUID, p_day DATE,
+  p_calories NUMERIC, p_protein NUMERIC, p_carbs NUMERIC, p_fat NUMERIC
+) RETURNS VOID AS $$
+  INSERT INTO CalTracker (user_id, day, calories, protein, carbs, fat)
+  VALUES (p_user_id, p_day, p_calories, p_protein, p_carbs, p_fat)
+  ON CONFLICT (user_id, day) DO UPDATE SET
+    calories = CalTracker.calories + EXCLUDED.calories,
+    protein = COALESCE(CalTracker.protein, 0) + EXCLUDED.protein,
+    carbs = COALESCE(CalTracker.carbs, 0) + EXCLUDED.carbs,
+    fat = COALESCE(CalTracker.fat, 0) + EXCLUDED.fat;
+$$ LANGUAGE sql;
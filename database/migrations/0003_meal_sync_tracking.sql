@@ -0,0 +1,39 @@
+-- Offline sync change tracking (/sync): every write to Meals gets a change
+-- sequence number, and deletes leave a tombstone, whichever client made them.
+CREATE SEQUENCE IF NOT EXISTS meal_change_seq;
+
+ALTER TABLE Meals
+  ADD COLUMN IF NOT EXISTS client_id UUID,
+  ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+  ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('meal_change_seq');
+CREATE UNIQUE INDEX IF NOT EXISTS meals_user_client_id ON Meals (user_id, client_id);
+CREATE INDEX IF NOT EXISTS meals_user_change_seq ON Meals (user_id, change_seq);
+
+CREATE TABLE IF NOT EXISTS MealTombstones (
+  change_seq BIGINT PRIMARY KEY DEFAULT nextval('meal_change_seq'),
+  user_id UUID NOT NULL REFERENCES auth.users(id),
+  meal_id INTEGER NOT NULL,
+  client_id UUID,
+  deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS meal_tombstones_user_change_seq ON MealTombstones (user_id, change_seq);
+
+CREATE OR REPLACE FUNCTION meals_track_change() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    INSERT INTO MealTombstones (user_id, meal_id, client_id) VALUES (OLD.user_id, OLD.id, OLD.client_id);
+    RETURN OLD;
+  END IF;
+  NEW.change_seq := nextval('meal_change_seq');
+  -- Synced edits carry the client's edit time; any other update is stamped now
+  IF TG_OP = 'UPDATE' AND NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at THEN
+    NEW.updated_at := NOW();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER meals_track_write BEFORE INSERT OR UPDATE ON Meals
+  FOR EACH ROW EXECUTE FUNCTION meals_track_change();
+CREATE OR REPLACE TRIGGER meals_track_delete AFTER DELETE ON Meals
+  FOR EACH ROW EXECUTE FUNCTION meals_track_change();
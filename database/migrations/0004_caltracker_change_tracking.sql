@@ -0,0 +1,16 @@
+-- History change tracking (/history returns only the days that changed since
+-- the app's last refresh).
+CREATE SEQUENCE IF NOT EXISTS caltracker_change_seq;
+
+ALTER TABLE CalTracker ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('caltracker_change_seq');
+CREATE INDEX IF NOT EXISTS caltracker_user_change_seq ON CalTracker (user_id, change_seq);
+
+CREATE OR REPLACE FUNCTION caltracker_track_change() RETURNS trigger AS $$
+BEGIN
+  NEW.change_seq := nextval('caltracker_change_seq');
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER caltracker_track_write BEFORE INSERT OR UPDATE ON CalTracker
+  FOR EACH ROW EXECUTE FUNCTION caltracker_track_change();
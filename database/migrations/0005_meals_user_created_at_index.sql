@@ -0,0 +1,7 @@
+-- migrate: no-transaction
+-- Every Meals read filters on user_id and bounds or orders by created_at:
+-- getMeals' keyset pages (ordered by created_at, id), the stats and export
+-- scans, the name index build (newest first) and the app's today/list queries.
+-- Built concurrently so the app and the tools keep writing meanwhile. If the
+-- build fails it leaves an invalid index behind: drop it before rerunning.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS meals_user_created_at ON Meals (user_id, created_at, id);
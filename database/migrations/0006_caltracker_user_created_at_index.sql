@@ -0,0 +1,3 @@
+-- migrate: no-transaction
+-- The app's PastCalories and TdCalories read a user's latest CalTracker rows by created_at.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS caltracker_user_created_at ON CalTracker (user_id, created_at);
@@ -0,0 +1,82 @@
+-- CalTracker is maintained by the database: triggers on Meals fold every
+-- insert, edit and delete into the (user_id, day) rollup row, whichever client
+-- made it (the app writes Meals directly, the Tools Lambda through PostgREST),
+-- so there is one writer and no absolute-total upserts racing the deltas.
+-- The triggers are per statement and read the transition tables, so a bulk
+-- insert costs one upsert per day it touches rather than one per row.
+-- Deploy the Tools Lambda and app that no longer write CalTracker with it.
+
+-- No meal writes between the triggers starting and the backfill below
+LOCK TABLE Meals IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE OR REPLACE FUNCTION caltracker_rollup_meals() RETURNS trigger AS $$
+DECLARE
+  changes TEXT;
+BEGIN
+  changes := CASE TG_OP
+    WHEN 'INSERT' THEN 'SELECT 1 AS sign, * FROM new_meals'
+    WHEN 'DELETE' THEN 'SELECT -1 AS sign, * FROM old_meals'
+    ELSE 'SELECT 1 AS sign, * FROM new_meals UNION ALL SELECT -1 AS sign, * FROM old_meals'
+  END;
+  -- Edits that don't change a day's totals (renames) leave its row alone. A
+  -- new day's row is dated by its first meal, so created_at falls on `day`
+  -- even for meals imported or synced long after they were eaten.
+  EXECUTE format($sql$
+    INSERT INTO CalTracker AS t (user_id, day, created_at, calories, protein, carbs, fat)
+    SELECT user_id, (created_at AT TIME ZONE 'utc')::date, MIN(created_at),
+           SUM(sign * calories), SUM(sign * COALESCE(protein, 0)),
+           SUM(sign * COALESCE(carbs, 0)), SUM(sign * COALESCE(fat, 0))
+    FROM (%s) changes
+    WHERE created_at IS NOT NULL
+    GROUP BY 1, 2
+    HAVING SUM(sign * calories) <> 0 OR SUM(sign * COALESCE(protein, 0)) <> 0
+        OR SUM(sign * COALESCE(carbs, 0)) <> 0 OR SUM(sign * COALESCE(fat, 0)) <> 0
+    ON CONFLICT (user_id, day) DO UPDATE SET
+      calories = t.calories + EXCLUDED.calories,
+      protein = COALESCE(t.protein, 0) + EXCLUDED.protein,
+      carbs = COALESCE(t.carbs, 0) + EXCLUDED.carbs,
+      fat = COALESCE(t.fat, 0) + EXCLUDED.fat
+  $sql$, changes);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+-- A trigger with transition tables can only have one event
+CREATE OR REPLACE TRIGGER meals_rollup_insert AFTER INSERT ON Meals
+  REFERENCING NEW TABLE AS new_meals
+  FOR EACH STATEMENT EXECUTE FUNCTION caltracker_rollup_meals();
+CREATE OR REPLACE TRIGGER meals_rollup_update AFTER UPDATE ON Meals
+  REFERENCING OLD TABLE AS old_meals NEW TABLE AS new_meals
+  FOR EACH STATEMENT EXECUTE FUNCTION caltracker_rollup_meals();
+CREATE OR REPLACE TRIGGER meals_rollup_delete AFTER DELETE ON Meals
+  REFERENCING OLD TABLE AS old_meals
+  FOR EACH STATEMENT EXECUTE FUNCTION caltracker_rollup_meals();
+
+-- Backfill: set every day's totals from its meals, which covers meals logged
+-- before the rollup existed and days the old client and Lambda writes left off.
+-- Rows the Lambda created were stamped with the time of the write, not the
+-- day, so any created_at outside its day is moved to the day's first meal.
+INSERT INTO CalTracker AS t (user_id, day, created_at, calories, protein, carbs, fat)
+SELECT user_id, (created_at AT TIME ZONE 'utc')::date, MIN(created_at),
+       SUM(calories), SUM(COALESCE(protein, 0)), SUM(COALESCE(carbs, 0)), SUM(COALESCE(fat, 0))
+FROM Meals
+WHERE created_at IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (user_id, day) DO UPDATE SET
+  calories = EXCLUDED.calories, protein = EXCLUDED.protein, carbs = EXCLUDED.carbs, fat = EXCLUDED.fat,
+  created_at = CASE WHEN (t.created_at AT TIME ZONE 'utc')::date = t.day THEN t.created_at
+                    ELSE EXCLUDED.created_at END
+WHERE (t.calories, t.protein, t.carbs, t.fat)
+    IS DISTINCT FROM (EXCLUDED.calories, EXCLUDED.protein, EXCLUDED.carbs, EXCLUDED.fat)
+  OR (t.created_at AT TIME ZONE 'utc')::date IS DISTINCT FROM t.day;
+
+-- Days whose meals are all gone
+UPDATE CalTracker t SET calories = 0, protein = 0, carbs = 0, fat = 0,
+                        created_at = t.day::timestamp AT TIME ZONE 'utc'
+WHERE ((t.calories, t.protein, t.carbs, t.fat) IS DISTINCT FROM (0, 0, 0, 0)
+       OR (t.created_at AT TIME ZONE 'utc')::date IS DISTINCT FROM t.day)
+  AND NOT EXISTS (
+    SELECT 1 FROM Meals m
+    WHERE m.user_id = t.user_id
+      AND m.created_at >= t.day::timestamp AT TIME ZONE 'utc'
+      AND m.created_at < (t.day + 1)::timestamp AT TIME ZONE 'utc');
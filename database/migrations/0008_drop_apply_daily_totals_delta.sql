@@ -0,0 +1,3 @@
+-- The Meals rollup triggers (0007) maintain CalTracker; nothing calls the
+-- Tools Lambda's old delta function any more.
+DROP FUNCTION IF EXISTS apply_daily_totals_delta(UUID, DATE, NUMERIC, NUMERIC, NUMERIC, NUMERIC);
@@ -2,37 +2,44 @@
 set -e
 set -o pipefail
 
+# Cold-start import budgets (ms); the build fails if a handler imports slower than this
+TOOLS_IMPORT_BUDGET_MS=${TOOLS_IMPORT_BUDGET_MS:-1500}
+AGENT_IMPORT_BUDGET_MS=${AGENT_IMPORT_BUDGET_MS:-1000}
+
+# build_lambda <source dir> <handler module> <zip name> <import budget ms>
+build_lambda() {
+    local src=$1 module=$2 zip_name=$3 budget_ms=$4
+    local build=$src/build_lambda
+
+    rm -rf "$build"
+    mkdir -p "$build"
+    cp "$src"/*.py "$build"/
+    cp ./lambda-functions/shared/*.py "$build"/
+
+    # Build dependencies inside Amazon Linux 2 Docker, then slim the package:
+    # drop bundled test suites and stale caches, precompile bytecode with the runtime's
+    # Python (the Lambda filesystem is read-only, so it can't cache .pyc itself)
+    # and check the handler's cold import time against the budget.
+    docker run --rm -v $(pwd):/var/task --platform linux/amd64 --entrypoint bash public.ecr.aws/lambda/python:3.11 -c "
+        python3 -m pip install --upgrade pip && \
+        python3 -m pip install --no-compile --target /var/task/$build -r /var/task/$src/requirements.txt && \
+        find /var/task/$build -depth -type d \( -name tests -o -name __pycache__ \) -exec rm -rf {} + && \
+        rm -rf /var/task/$build/bin && \
+        python3 -m compileall -q -j 0 --invalidation-mode unchecked-hash /var/task/$build && \
+        python3 /var/task/lambda-functions/scripts/import_budget.py --path /var/task/$build --module $module --budget-ms $budget_ms
+    "
+
+    rm -f "$src/$zip_name"
+    (cd "$build" && zip -qr "../$zip_name" .)
+}
+
 # Build Tools Lambda
 echo "Building Tools Lambda..."
-rm -rf ./lambda-functions/tools/build_lambda
-mkdir -p ./lambda-functions/tools/build_lambda
-cp ./lambda-functions/tools/meal_tools.py ./lambda-functions/tools/build_lambda/
-
-# Build dependencies inside Amazon Linux 2 Docker
-docker run --rm -v $(pwd):/var/task --platform linux/amd64 --entrypoint bash public.ecr.aws/lambda/python:3.11 -c "
-    python3 -m pip install --upgrade pip && \
-    python3 -m pip install --target /var/task/lambda-functions/tools/build_lambda -r /var/task/lambda-functions/tools/requirements.txt
-"
-
-cd ./lambda-functions/tools/build_lambda
-zip -r ../tools_lambda.zip ./*
-cd -
+build_lambda ./lambda-functions/tools meal_tools tools_lambda.zip "$TOOLS_IMPORT_BUDGET_MS"
 
 # Build Agent Lambda
 echo "Building Agent Lambda..."
-rm -rf ./lambda-functions/agent-lambda/build_lambda
-mkdir -p ./lambda-functions/agent-lambda/build_lambda
-cp ./lambda-functions/agent-lambda/agent.py ./lambda-functions/agent-lambda/build_lambda/
-
-# Build dependencies inside Amazon Linux 2 Docker
-docker run --rm -v $(pwd):/var/task --platform linux/amd64 --entrypoint bash public.ecr.aws/lambda/python:3.11 -c "
-    python3 -m pip install --upgrade pip && \
-    python3 -m pip install --target /var/task/lambda-functions/agent-lambda/build_lambda -r /var/task/lambda-functions/agent-lambda/requirements.txt
-"
-
-cd ./lambda-functions/agent-lambda/build_lambda
-zip -r ../agent_lambda.zip ./*
-cd -
+build_lambda ./lambda-functions/agent-lambda agent agent_lambda.zip "$AGENT_IMPORT_BUDGET_MS"
 
 # Deploy with Terraform
 echo "Deploying with Terraform..."
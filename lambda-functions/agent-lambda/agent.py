@@ -1,10 +1,20 @@
 import os
-import boto3
+import codecs
+import hashlib
 import json
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
 from datetime import datetime, timezone
 #from dotenv import load_dotenv
 import jwt
 from jwt.exceptions import InvalidTokenError, ExpiredSignatureError, DecodeError, InvalidAudienceError
+import tracing
+import intent_router
+import request_guard
+import job_store
 
 # Load environment variables
 # load_dotenv()
@@ -12,34 +22,233 @@ from jwt.exceptions import InvalidTokenError, ExpiredSignatureError, DecodeError
 # Get region from environment variable, default to us-east-2
 # Note: In Lambda, AWS_REGION is automatically set by AWS
 AWS_REGION = os.environ.get('AWS_REGION', 'us-east-2')
-bedrock_agent = boto3.client('bedrock-agent-runtime', region_name=AWS_REGION)
+
+# Bedrock client, created on first use and reused across warm invocations
+_bedrock_agent = None
+
+
+def get_bedrock_agent():
+    global _bedrock_agent
+    if _bedrock_agent is None:
+        import boto3
+        _bedrock_agent = boto3.client('bedrock-agent-runtime', region_name=AWS_REGION)
+    return _bedrock_agent
+
+
+# Today's meals, prefetched from the tools Lambda and passed to the agent as a
+# prompt session attribute, so a turn doesn't start with a /getMeals tool call.
+# Cached per session_id (one per user per day) until a turn calls a tool that
+# changes meals; the TTL bounds staleness from edits made in the app directly
+# or in turns served by other containers. The read skips the tools Lambda's
+# response cache (refresh_cache), so the two TTLs don't stack.
+PREFETCH_MEALS = os.environ.get('PREFETCH_MEALS', 'false').lower() == 'true'
+TOOLS_FUNCTION_NAME = os.environ.get('TOOLS_FUNCTION_NAME', 'meal-tools')
+PREFETCH_TTL_SECONDS = int(os.environ.get('PREFETCH_TTL_SECONDS', '60'))
+PREFETCH_CACHE_SIZE = 1024
+# Prompt space for the summary; longer days are cut short with a cursor
+PREFETCH_MAX_BYTES = 2000
+MUTATING_TOOL_PATHS = frozenset(('/addMeal', '/deleteMeal', '/modifyMeal', '/batchMeals'))
+_meals_context = OrderedDict()  # session_id -> (fetched_at, summary)
+_lambda_client = None
+
+# Answer simple add/delete commands without the agent (see intent_router.py)
+FAST_PATH_ROUTER = os.environ.get('FAST_PATH_ROUTER', 'false').lower() == 'true'
+
+
+def get_lambda_client():
+    global _lambda_client
+    if _lambda_client is None:
+        import boto3
+        _lambda_client = boto3.client('lambda', region_name=AWS_REGION)
+    return _lambda_client
+
+
+def invoke_tool(api_path: str, parameters: dict, session_attributes: dict):
+    """Call the tools Lambda directly, with the event shape the agent's action group sends; returns the body."""
+    event = {
+        'actionGroup': 'direct',
+        'apiPath': api_path,
+        'httpMethod': 'POST',
+        'parameters': parameters,
+        'sessionAttributes': session_attributes,
+    }
+    response = get_lambda_client().invoke(FunctionName=TOOLS_FUNCTION_NAME, Payload=json.dumps(event))
+    result = json.loads(response['Payload'].read())
+    if response.get('FunctionError'):
+        raise RuntimeError(f"tools Lambda failed: {str(result)[:200]}")
+    body = result['response']
+    if body.get('httpStatusCode') != 200:
+        raise RuntimeError(f"tools Lambda returned {body.get('httpStatusCode')}")
+    return body['responseBody']['application/json']['body']
+
+
+def fetch_meals_context(user_id: str, local_date: str):
+    """Compact /getMeals result for the user's day, read through the tools Lambda."""
+    summary = invoke_tool('/getMeals', {'format': 'compact', 'max_bytes': PREFETCH_MAX_BYTES},
+                          {'user_id': user_id, 'local_date': local_date, 'refresh_cache': 'true'})
+    if not isinstance(summary, str) or summary.startswith(('Exception', 'Invalid')):
+        raise RuntimeError(f"unexpected /getMeals result: {str(summary)[:200]}")
+    return summary
+
+
+def get_meals_context(session_id: str, user_id: str, local_date: str):
+    """Cached summary of today's meals for this session; None if it can't be fetched."""
+    entry = _meals_context.get(session_id)
+    if entry is not None and time.monotonic() - entry[0] < PREFETCH_TTL_SECONDS:
+        _meals_context.move_to_end(session_id)
+        tracing.set_property('meals_prefetch', 'hit')
+        return entry[1]
+
+    try:
+        with tracing.span('prefetch_meals'):
+            summary = fetch_meals_context(user_id, local_date)
+    except Exception as e:
+        # Best effort: without the summary the agent calls /getMeals itself
+        print(f"Meals prefetch failed: {str(e)}")
+        tracing.set_property('meals_prefetch', 'error')
+        return None
+    tracing.set_property('meals_prefetch', 'miss')
+    _meals_context[session_id] = (time.monotonic(), summary)
+    _meals_context.move_to_end(session_id)
+    while len(_meals_context) > PREFETCH_CACHE_SIZE:
+        _meals_context.popitem(last=False)
+    return summary
+
+
+def _trace_mutates_meals(trace: dict) -> bool:
+    """True if an invoke_agent trace event is a tool call that changes meals."""
+    invocation = (trace.get('trace') or {}).get('orchestrationTrace', {}).get('invocationInput', {})
+    call = invocation.get('actionGroupInvocationInput')
+    if not call:
+        return False
+    api_path = call.get('apiPath')
+    if api_path in MUTATING_TOOL_PATHS:
+        return True
+    if api_path == '/findMealByName':
+        # find-then-act: only a call carrying an action modifies or deletes
+        body = (call.get('requestBody') or {}).get('content', {}).get('application/json', [])
+        params = list(call.get('parameters') or []) + (body if isinstance(body, list) else [])
+        return any(isinstance(p, dict) and p.get('name') == 'action' and p.get('value') for p in params)
+    return False
+
+
+def drop_meals_context(user_id: str):
+    """Forget every prefetched day for a user, e.g. after the app synced changes to their meals."""
+    prefix = f"{user_id}-"
+    for session_id in [key for key in _meals_context if key.startswith(prefix)]:
+        del _meals_context[session_id]
+
+
+def meals_context_invalidator(invoke_kwargs: dict):
+    """on_trace callback dropping the session's cached meals once a tool changes them."""
+    if not invoke_kwargs.get('enableTrace'):
+        return None
+    session_id = invoke_kwargs['sessionId']
+
+    def on_trace(trace):
+        if _trace_mutates_meals(trace):
+            _meals_context.pop(session_id, None)
+    return on_trace
+
+
+# Verified tokens, keyed by SHA-256 of the token and kept until the token's exp.
+# The app sends the same access token with every chat message, so repeat
+# requests skip signature verification while exp/nbf are still enforced.
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', '1024'))
+_token_cache = OrderedDict()
+
+# JWT settings, read once per container (see _jwt_config)
+_jwt_settings = None
+_jwks_client = None
+
+ASYMMETRIC_ALGORITHMS = ['RS256', 'ES256']
+
+
+def _jwt_config() -> dict:
+    global _jwt_settings
+    if _jwt_settings is None:
+        _jwt_settings = {
+            'secret': os.environ.get('JWT_SECRET'),
+            # Expected audience - Supabase access tokens use "authenticated"
+            # Can be overridden via environment variable if needed
+            'audience': os.environ.get('JWT_AUDIENCE', 'authenticated'),
+            # Supabase projects using asymmetric signing keys publish them at
+            # <project url>/auth/v1/.well-known/jwks.json
+            'jwks_url': os.environ.get('JWT_JWKS_URL'),
+        }
+    return _jwt_settings
+
+
+def _get_jwks_client():
+    """JWKS client with an in-memory key set cache; it refetches the set once on an unknown kid."""
+    global _jwks_client
+    if _jwks_client is None:
+        _jwks_client = jwt.PyJWKClient(_jwt_config()['jwks_url'], cache_jwk_set=True, lifespan=3600)
+    return _jwks_client
+
+
+def _cached_token(token_key: str):
+    entry = _token_cache.get(token_key)
+    if entry is None:
+        return None
+    now = time.time()
+    payload = entry['payload']
+    if payload['exp'] <= now or payload.get('nbf', 0) > now:
+        del _token_cache[token_key]
+        return None
+    _token_cache.move_to_end(token_key)
+    return entry
+
+
+def _cache_token(token_key: str, result: dict):
+    # Only tokens with an expiry are cached; the cache never outlives a token
+    if not isinstance(result['payload'].get('exp'), (int, float)):
+        return
+    _token_cache[token_key] = result
+    _token_cache.move_to_end(token_key)
+    while len(_token_cache) > JWT_CACHE_SIZE:
+        _token_cache.popitem(last=False)
 
 
 def verify_access_token(access_token: str) -> dict:
     """
-    Verify Supabase JWT access token locally using JWT_SECRET.
+    Verify Supabase JWT access token locally using JWT_SECRET (HS256) or the
+    project's JWKS (RS256/ES256, when JWT_JWKS_URL is set).
     Returns dict with 'user_id' if valid, raises exception if invalid.
-    Uses local JWT verification (no API call to Supabase) for better performance.
+    Uses local JWT verification (no API call to Supabase) for better performance,
+    and caches verified tokens until they expire.
     Validates audience claim for security.
     """
     if not access_token:
         raise ValueError("Access token is required")
-    
-    jwt_secret = os.environ.get('JWT_SECRET')
-    if not jwt_secret:
-        raise ValueError("JWT_SECRET not configured")
-    
-    # Expected audience - Supabase access tokens use "authenticated"
-    # Can be overridden via environment variable if needed
-    expected_audience = os.environ.get('JWT_AUDIENCE', 'authenticated')
-    
+
+    token_key = hashlib.sha256(access_token.encode()).hexdigest()
+    cached = _cached_token(token_key)
+    if cached is not None:
+        return cached
+
+    config = _jwt_config()
+    expected_audience = config['audience']
+
     try:
+        # Pick the key from the algorithm family the token claims, but only ever
+        # accept that family's algorithms for that key (no HS/RS confusion)
+        alg = jwt.get_unverified_header(access_token).get('alg')
+        if alg in ASYMMETRIC_ALGORITHMS and config['jwks_url']:
+            key = _get_jwks_client().get_signing_key_from_jwt(access_token).key
+            algorithms = ASYMMETRIC_ALGORITHMS
+        else:
+            if not config['secret']:
+                raise ValueError("JWT_SECRET not configured")
+            # Supabase uses HS256 algorithm by default
+            key = config['secret']
+            algorithms = ['HS256']
+
         # Verify and decode the JWT token
-        # Supabase uses HS256 algorithm by default
         payload = jwt.decode(
             access_token,
-            jwt_secret,
-            algorithms=['HS256'],
+            key,
+            algorithms=algorithms,
             audience=expected_audience,  # Validate audience claim
             options={
                 'verify_signature': True,
@@ -55,10 +264,12 @@ def verify_access_token(access_token: str) -> dict:
         if not user_id:
             raise ValueError("User ID not found in token")
         
-        return {
+        result = {
             'user_id': user_id,
             'payload': payload
         }
+        _cache_token(token_key, result)
+        return result
         
     except ExpiredSignatureError:
         print("Token has expired")
@@ -79,168 +290,560 @@ def verify_access_token(access_token: str) -> dict:
 def get_session_id(user_id: str, local_date: str) -> str:
     return f"{user_id}-{local_date}"
 
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+
+
+def json_response(status_code: int, payload: dict) -> dict:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', **CORS_HEADERS},
+        'body': json.dumps(payload)
+    }
+
+
+def iter_completion_text(completion, on_trace=None):
+    """
+    Yield decoded text from an invoke_agent completion stream as chunks arrive.
+    Decodes UTF-8 incrementally so a multibyte character split across two
+    chunks is reassembled rather than dropped. Trace events (sent when the
+    request enables them) are passed to `on_trace`.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    started = time.perf_counter()
+    first = True
+    for event in completion:
+        if on_trace is not None and isinstance(event, dict) and 'trace' in event:
+            on_trace(event['trace'])
+        chunk = event.get('chunk') if isinstance(event, dict) else None
+        if chunk and 'bytes' in chunk:
+            text = decoder.decode(chunk['bytes'])
+            if text:
+                if first:
+                    tracing.record('bedrock_first_chunk', (time.perf_counter() - started) * 1000)
+                    first = False
+                yield text
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+    tracing.record('bedrock_stream', (time.perf_counter() - started) * 1000)
+
+
+def parse_request_body(event):
+    """Return (error_response, body) for an API Gateway or direct-invocation event."""
+    if isinstance(event.get('body'), str):
+        try:
+            return None, json.loads(event['body'])
+        except json.JSONDecodeError:
+            return json_response(400, {'error': 'Invalid JSON in request body'}), None
+    return None, event.get('body') or {}
+
+
+def prepare_agent_request(body):
+    """
+    Validate the request body, verify the access token and build the
+    invoke_agent arguments. Returns (error_response, invoke_kwargs).
+    """
+    message = body.get('message', '')
+    access_token = body.get('access_token')
+    local_date = body.get('local_date')
+
+    # Validate message length to prevent DoS attacks
+    MAX_MESSAGE_LENGTH = 10000  # 10KB max message length
+    if len(message) > MAX_MESSAGE_LENGTH:
+        return json_response(400, {'error': f'Message too long (max {MAX_MESSAGE_LENGTH} characters)'}), None
+
+    if not access_token:
+        return json_response(401, {'error': 'access_token is required'}), None
+
+    # SECURITY: Verify the access token and extract user_id
+    try:
+        with tracing.span('verify_token'):
+            token_data = verify_access_token(access_token)
+        user_id = token_data['user_id']
+    except Exception as e:
+        return json_response(401, {'error': 'Invalid or expired access token'}), None
+
+    agent_id = os.environ.get('BEDROCK_AGENT_ID')
+    agent_alias_id = os.environ.get('BEDROCK_AGENT_ALIAS_ID', 'TSTALIASID')
+
+    if not agent_id:
+        return json_response(500, {'error': 'Agent ID not configured'}), None
+
+    # Generate deterministic session ID (same per user per day for conversation continuity)
+    if not local_date:
+        return json_response(400, {'error': 'local_date is required'}), None
+    session_id = get_session_id(user_id, local_date)
+
+    # Pass verified user_id via session attributes so it's available to tools
+    # Since we've already verified the token, user_id is trusted at this point
+    # local_date lets tools default date-bounded queries to the caller's day
+    session_attributes = {
+        'user_id': user_id,
+        'local_date': local_date
+    }
+
+    session_state = {
+        'sessionAttributes': session_attributes
+    }
+
+    tracing.set_property('session_id', session_id)
+    tracing.log_payload('session_state', session_state)
+
+    invoke_kwargs = {
+        'agentId': agent_id,
+        'agentAliasId': agent_alias_id,
+        'sessionId': session_id,
+        'inputText': message,
+        'sessionState': session_state
+    }
+    # Traces show which tools the turn called, to invalidate the prefetched meals
+    if PREFETCH_MEALS:
+        invoke_kwargs['enableTrace'] = True
+    return None, invoke_kwargs
+
+
+def attach_meals_context(invoke_kwargs):
+    """Add the prefetched summary of today's meals to the agent's prompt session attributes."""
+    if not PREFETCH_MEALS:
+        return
+    attributes = invoke_kwargs['sessionState']['sessionAttributes']
+    meals = get_meals_context(invoke_kwargs['sessionId'], attributes['user_id'], attributes['local_date'])
+    if meals is not None:
+        invoke_kwargs['sessionState']['promptSessionAttributes'] = {'today_meals': meals}
+
+
+def try_fast_path(invoke_kwargs):
+    """
+    Answer a simple command ("add oatmeal 300 cal", "delete the burrito") by
+    calling the meal tools directly instead of the agent. Returns the reply,
+    or None if the message isn't one (or the tool declined) and the agent
+    should handle it. fast_path_hit is 1 or 0 per turn, so its average is the
+    router's hit rate.
+    """
+    if not FAST_PATH_ROUTER:
+        return None
+    attributes = invoke_kwargs['sessionState']['sessionAttributes']
+    intent = intent_router.route(invoke_kwargs['inputText'], attributes.get('local_date'))
+    if intent is None:
+        tracing.count('fast_path_hit', 0)
+        tracing.set_property('fast_path', 'miss')
+        return None
+
+    try:
+        with tracing.span('fast_path_tool'):
+            result = invoke_tool(intent['api_path'], intent['parameters'], attributes)
+    except Exception as e:
+        print(f"Fast path {intent['intent']} failed: {str(e)}")
+        result = None
+    reply = intent_router.reply(intent, result) if result is not None else None
+    if intent['mutates'] and result is not None:
+        drop_meals_context(attributes['user_id'])
+    if reply is None:
+        tracing.count('fast_path_hit', 0)
+        tracing.set_property('fast_path', f"fallback:{intent['intent']}")
+        return None
+    tracing.count('fast_path_hit', 1)
+    tracing.set_property('fast_path', intent['intent'])
+    tracing.set_operation('fast_path')
+    with tracing.span('remember_turn'):
+        request_guard.remember_turn(invoke_kwargs['sessionId'], attributes['user_id'], invoke_kwargs['inputText'], reply)
+    return reply
+
+
+def attach_fast_path_turns(invoke_kwargs):
+    """Hand the agent the turns the fast path answered in this session since its last agent turn."""
+    if not FAST_PATH_ROUTER:
+        return
+    turns = request_guard.take_turns(invoke_kwargs['sessionId'])
+    if turns:
+        invoke_kwargs['sessionState']['conversationHistory'] = {'messages': [
+            {'role': role, 'content': [{'text': text}]}
+            for message, reply in turns
+            for role, text in (('user', message), ('assistant', reply))
+        ]}
+
+
+def handle_sync_request(body):
+    """
+    Sync the app's queued offline meal writes for the verified user via the
+    tools Lambda's /syncMeals: body carries access_token, operations and the
+    cursor from the previous sync; the reply is the sync result.
+    """
+    access_token = body.get('access_token')
+    if not access_token:
+        return json_response(401, {'error': 'access_token is required'})
+    try:
+        with tracing.span('verify_token'):
+            user_id = verify_access_token(access_token)['user_id']
+    except Exception:
+        return json_response(401, {'error': 'Invalid or expired access token'})
+
+    parameters = {key: body[key] for key in ('operations', 'cursor', 'limit') if key in body}
+    with tracing.span('sync_meals'):
+        result = invoke_tool('/syncMeals', parameters, {'user_id': user_id})
+    if not isinstance(result, dict):
+        return json_response(500, {'error': str(result)})
+    if any(r.get('status') == 'applied' for r in result.get('results', [])):
+        drop_meals_context(user_id)
+    if 'cursor' not in result:
+        # Invalid parameters, or the sync failed part way; report what was applied
+        status = 500 if result['message'].startswith('Exception') else 400
+        return json_response(status, {'error': result['message'], 'results': result.get('results', [])})
+    return json_response(200, result)
+
+
+def authenticate_get_request(event, body):
+    """
+    Verify the access token of a GET request: an `Authorization: Bearer` header,
+    or access_token in the query string or a JSON body. Returns
+    (error_response, params, user_id), params merging query string and body.
+    """
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    params = {**(event.get('queryStringParameters') or {}), **(body or {})}
+    access_token = params.get('access_token')
+    if not access_token and headers.get('authorization', '').lower().startswith('bearer '):
+        access_token = headers['authorization'][7:].strip()
+    if not access_token:
+        return json_response(401, {'error': 'access_token is required'}), params, None
+    try:
+        with tracing.span('verify_token'):
+            user_id = verify_access_token(access_token)['user_id']
+    except Exception:
+        return json_response(401, {'error': 'Invalid or expired access token'}), params, None
+    return None, params, user_id
+
+
+HISTORY_PARAMS = ('start_date', 'end_date', 'granularity', 'cursor')
+
+
+def handle_history_request(event, body):
+    """
+    CalTracker history for the app via the tools Lambda's /getHistory: GET with
+    query parameters and an `Authorization: Bearer <access token>` header (or a
+    JSON body with access_token). The reply's cursor doubles as its ETag, so a
+    refresh sending it back as If-None-Match gets 304 and no body when nothing
+    changed, or only the changed buckets when something did.
+    """
+    error, params, user_id = authenticate_get_request(event, body)
+    if error:
+        return error
+
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    parameters = {key: params[key] for key in HISTORY_PARAMS if params.get(key)}
+    if_none_match = headers.get('if-none-match')
+    if if_none_match and 'cursor' not in parameters:
+        parameters['cursor'] = if_none_match.strip().removeprefix('W/').strip('"')
+    with tracing.span('get_history'):
+        result = invoke_tool('/getHistory', parameters, {'user_id': user_id, 'local_date': params.get('local_date')})
+    if not isinstance(result, dict) or 'cursor' not in result:
+        message = result.get('message') if isinstance(result, dict) else str(result)
+        return json_response(500 if str(message).startswith('Exception') else 400, {'error': message})
+
+    etag = f'"{result["cursor"]}"'
+    if if_none_match and not result['changed']:
+        return {'statusCode': 304, 'headers': {'ETag': etag, **CORS_HEADERS}, 'body': ''}
+    response = json_response(200, result)
+    response['headers']['ETag'] = etag
+    return response
+
+
+IMPORT_PARAMS = ('file', 'data', 'format', 'file_name', 'start_line')
+EXPORT_PARAMS = ('format', 'start_date', 'end_date', 'continuation')
+
+
+def handle_bulk_request(event, body):
+    """
+    Bulk meal history files via the tools Lambda: POST /import runs
+    /importMeals (with neither file nor data it returns an upload URL; a
+    long file is continued by sending next_line back as start_line) and
+    GET /export runs /exportMeals, replying with a download URL (a long
+    export is continued by sending its continuation back). The access token
+    is checked as for /history.
+    """
+    error, params, user_id = authenticate_get_request(event, body)
+    if error:
+        return error
+
+    exporting = event.get('resource') == '/export'
+    api_path, names = ('/exportMeals', EXPORT_PARAMS) if exporting else ('/importMeals', IMPORT_PARAMS)
+    parameters = {key: params[key] for key in names if params.get(key) is not None}
+    with tracing.span(api_path.lstrip('/')):
+        result = invoke_tool(api_path, parameters, {'user_id': user_id, 'local_date': params.get('local_date')})
+    if not isinstance(result, dict):
+        return json_response(500, {'error': str(result)})
+    if result.get('imported'):
+        drop_meals_context(user_id)
+    if result['message'].startswith('Exception'):
+        # An import may have got part way; its counts and next_line say where to continue
+        return json_response(500, {**result, 'error': result['message']})
+    if not any(key in result for key in ('url', 'upload_url', 'next_line', 'continuation')):
+        # Invalid parameters, or bulk files aren't configured
+        return json_response(400, {'error': result['message']})
+    return json_response(200, result)
+
+
+def admit_chat_turn(body, invoke_kwargs):
+    """
+    Check a chat turn against duplicates and the user's rate limit. Returns
+    (error_response, reply, key): an error (429, or 409 while an identical
+    request is still running) to send instead, or the reply an identical
+    earlier request got, or neither, and the turn is claimed under `key`
+    for run_chat_turn.
+    """
+    user_id = invoke_kwargs['sessionState']['sessionAttributes']['user_id']
+    key = request_guard.request_key(invoke_kwargs['sessionId'], invoke_kwargs['inputText'], body.get('request_id'))
+    with tracing.span('idempotency'):
+        state, reply = request_guard.claim(key, user_id)
+    tracing.set_property('idempotency', state)
+    if state == 'done':
+        return None, reply, key
+    if state == 'busy':
+        return json_response(409, {'error': 'This message is still being processed'}), None, key
+
+    retry_after = request_guard.admit(user_id)
+    if retry_after:
+        request_guard.release(key)
+        return rate_limited_response(retry_after), None, key
+    return None, None, key
+
+
+def rate_limited_response(retry_after: float) -> dict:
+    tracing.set_property('rate_limited', True)
+    response = json_response(429, {'error': 'Too many messages, please wait a moment',
+                                   'retry_after': round(retry_after, 1)})
+    response['headers']['Retry-After'] = str(max(1, round(retry_after)))
+    return response
+
+
+def answer_chat(invoke_kwargs, on_delta=None):
+    """
+    Reply to a chat turn, through the fast path when it applies and the agent
+    otherwise. Each piece of the reply is passed to `on_delta` as soon as it
+    is decoded. Returns the reply text, or None if the agent returned nothing.
+    """
+    reply = try_fast_path(invoke_kwargs)
+    if reply is not None:
+        if on_delta is not None:
+            on_delta(reply)
+        return reply
+
+    attach_meals_context(invoke_kwargs)
+    attach_fast_path_turns(invoke_kwargs)
+    with tracing.span('invoke_agent'):
+        response = get_bedrock_agent().invoke_agent(**invoke_kwargs)
+    completion = response.get('completion', [])
+    if not completion:
+        return None
+    parts = []
+    for text in iter_completion_text(completion, meals_context_invalidator(invoke_kwargs)):
+        parts.append(text)
+        if on_delta is not None:
+            on_delta(text)
+    return ''.join(parts)
+
+
+def run_chat_turn(body, invoke_kwargs, key, on_delta=None):
+    """answer_chat for a claimed turn: the reply is kept for duplicates, a failure releases the claim."""
+    try:
+        reply = answer_chat(invoke_kwargs, on_delta)
+    except Exception:
+        request_guard.release(key)
+        raise
+    if reply is None:
+        request_guard.release(key)
+    else:
+        user_id = invoke_kwargs['sessionState']['sessionAttributes']['user_id']
+        request_guard.complete(key, user_id, reply, request_guard.record_ttl(body.get('request_id')))
+    return reply
+
+
+# Asynchronous turns: a chat request with "async": true is submitted as a job
+# and answered at once (202, with the job id). The turn runs in a separate
+# asynchronous invocation of this Lambda, or a thread when jobs are kept in
+# a local SQLite file, and GET /jobs returns its progress. Turns that call
+# several tools can outlast API Gateway's 29 second limit; polling for them
+# beats timing out and retrying the whole turn.
+JOB_RUNNER = os.environ.get('JOB_RUNNER') or ('lambda' if job_store.JOBS_TABLE else 'thread')
+JOB_POLL_MAX_WAIT_SECONDS = 20
+JOB_POLL_INTERVAL_SECONDS = 0.25
+# A job still pending or running this long after its last write lost its worker (Lambda timeout is 300s)
+JOB_STALE_SECONDS = 330
+
+
+def submit_agent_job(body, invoke_kwargs):
+    """Start a turn as a job; a retry with the same request_id gets the job already started."""
+    user_id = invoke_kwargs['sessionState']['sessionAttributes']['user_id']
+    request_id = body.get('request_id')
+    if request_id:
+        job_id = request_guard.request_key(invoke_kwargs['sessionId'], invoke_kwargs['inputText'], request_id)[:32]
+    else:
+        job_id = uuid.uuid4().hex
+    tracing.set_property('job_id', job_id)
+    store = job_store.get_store()
+
+    job = store.get(job_id) if request_id else None
+    if job is None:
+        retry_after = request_guard.admit(user_id)
+        if retry_after:
+            return rate_limited_response(retry_after)
+        if store.create(job_id, user_id):
+            # Have Bedrock send the answer incrementally so polls see it grow
+            invoke_kwargs['streamingConfigurations'] = {'streamFinalResponse': True}
+            start_agent_job(job_id, invoke_kwargs)
+        job = store.get(job_id) or {'status': 'pending'}
+    return json_response(202, {'job_id': job_id, 'status': job['status']})
+
+
+def start_agent_job(job_id, invoke_kwargs):
+    """Run a job out of band: an asynchronous invocation of this Lambda, or a thread."""
+    try:
+        if JOB_RUNNER == 'lambda':
+            payload = {'agent_job': {'job_id': job_id, 'invoke_kwargs': invoke_kwargs}}
+            get_lambda_client().invoke(FunctionName=os.environ['AWS_LAMBDA_FUNCTION_NAME'],
+                                       InvocationType='Event', Payload=json.dumps(payload))
+        else:
+            threading.Thread(target=run_agent_job, args=(job_id, invoke_kwargs), daemon=True).start()
+    except Exception:
+        job_store.get_store().finish(job_id, 'failed', error='Could not start the agent request')
+        raise
+
+
+def run_agent_job(job_id, invoke_kwargs):
+    """Run a submitted turn, writing the reply to the job as the agent produces it. Returns the final status."""
+    store = job_store.get_store()
+    store.set_status(job_id, 'running')
+    chunks = job_store.ChunkBuffer(store, job_id)
+    try:
+        reply = answer_chat(invoke_kwargs, chunks.add)
+        chunks.flush()
+    except Exception as e:
+        print(f"Agent job {job_id} failed: {str(e)}")
+        traceback.print_exc()
+        store.finish(job_id, 'failed', error='Agent request failed')
+        return 'failed'
+    if reply is None:
+        store.finish(job_id, 'failed', error='Empty response from agent')
+        return 'failed'
+    store.finish(job_id, 'done', response=reply)
+    return 'done'
+
+
+def handle_job_request(event, body):
+    """
+    Progress of an asynchronous turn: GET /jobs?job_id=...&after=N&wait=S with
+    the access token as for /history. Returns the status (pending, running,
+    done or failed), the reply chunks after the first `after` and `next` (the
+    `after` for the next poll), plus the full response once done or the error
+    once failed. With `wait`, holds the request up to that many seconds (max
+    20) until there is a new chunk or the job ends.
+    """
+    error, params, user_id = authenticate_get_request(event, body)
+    if error:
+        return error
+    job_id = params.get('job_id')
+    if not job_id:
+        return json_response(400, {'error': 'job_id is required'})
+    try:
+        after = max(0, int(params.get('after') or 0))
+        wait = min(max(0.0, float(params.get('wait') or 0)), JOB_POLL_MAX_WAIT_SECONDS)
+    except (TypeError, ValueError):
+        return json_response(400, {'error': 'after and wait must be numbers'})
+
+    store = job_store.get_store()
+    deadline = time.monotonic() + wait
+    with tracing.span('poll_job'):
+        while True:
+            job = store.get(job_id, after)
+            if job is None or job['user_id'] != user_id:
+                return json_response(404, {'error': 'Job not found'})
+            if (job['status'] in job_store.TERMINAL_STATUSES or job['chunk_count'] > after
+                    or time.monotonic() >= deadline):
+                break
+            time.sleep(JOB_POLL_INTERVAL_SECONDS)
+
+    status, error = job['status'], job['error']
+    if status not in job_store.TERMINAL_STATUSES and time.time() - job['updated_at'] > JOB_STALE_SECONDS:
+        status, error = 'failed', 'Agent request timed out'
+    result = {'job_id': job_id, 'status': status, 'chunks': job['chunks'], 'next': job['chunk_count']}
+    if status == 'done':
+        result['response'] = job['response']
+    elif status == 'failed':
+        result['error'] = error
+    return json_response(200, result)
+
+
 def lambda_handler(event, context):
     """
     Lambda handler for API Gateway or direct invocation.
     Verifies the access token, extracts user_id, and passes it securely to Bedrock Agent.
+    A repeated message with the same request_id gets the first one's reply,
+    and "async": true submits the turn as a job to poll on /jobs.
+    Requests to the /sync resource sync the app's offline meal writes instead,
+    /history serves its calorie history, and /import and /export move bulk
+    meal history files.
     """
+    if 'agent_job' in event:
+        # Asynchronous invocation running a submitted turn (see submit_agent_job)
+        tracing.start('agent', 'job')
+        status = None
+        try:
+            status = run_agent_job(**event['agent_job'])
+            return {'status': status}
+        finally:
+            tracing.finish(status)
+
+    tracing.start('agent', 'chat')
+    resp = None
     try:
-        # Parse request body
-        if isinstance(event.get('body'), str):
+        resp = _handle_request(event)
+        return resp
+    finally:
+        tracing.finish(resp['statusCode'] if resp else 500)
+
+
+def _handle_request(event):
+    try:
+        error, body = parse_request_body(event)
+        if error:
+            return error
+
+        if event.get('resource') == '/sync':
+            tracing.set_operation('sync')
+            return handle_sync_request(body)
+        if event.get('resource') == '/history':
+            tracing.set_operation('history')
+            return handle_history_request(event, body)
+        if event.get('resource') in ('/import', '/export'):
+            tracing.set_operation(event['resource'].lstrip('/'))
+            return handle_bulk_request(event, body)
+        if event.get('resource') == '/jobs':
+            tracing.set_operation('job_poll')
+            return handle_job_request(event, body)
+
+        error, invoke_kwargs = prepare_agent_request(body)
+        if error:
+            return error
+        if body.get('async'):
+            tracing.set_operation('job_submit')
+            return submit_agent_job(body, invoke_kwargs)
+
+        error, reply, key = admit_chat_turn(body, invoke_kwargs)
+        if error:
+            return error
+        # reply is set when an identical request already ran this turn
+        if reply is None:
             try:
-                body = json.loads(event['body'])
-            except json.JSONDecodeError:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Invalid JSON in request body'})
-                }
-        else:
-            body = event.get('body', {})
-        
-        message = body.get('message', '')
-        access_token = body.get('access_token')
-        local_date = body.get('local_date')
-        
-        # Validate message length to prevent DoS attacks
-        MAX_MESSAGE_LENGTH = 10000  # 10KB max message length
-        if len(message) > MAX_MESSAGE_LENGTH:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': f'Message too long (max {MAX_MESSAGE_LENGTH} characters)'})
-            }
-        
-        if not access_token:
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'access_token is required'})
-            }
-        
-        # SECURITY: Verify the access token and extract user_id
-        try:
-            token_data = verify_access_token(access_token)
-            user_id = token_data['user_id']
-            print(f"Verified token for user_id: {user_id}")
-        except Exception as e:
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Invalid or expired access token'})
-            }
-        
-        agent_id = os.environ.get('BEDROCK_AGENT_ID')
-        agent_alias_id = os.environ.get('BEDROCK_AGENT_ALIAS_ID', 'TSTALIASID')
-        
-        if not agent_id:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Agent ID not configured'})
-            }
-        
-        # Generate deterministic session ID (same per user per day for conversation continuity)
-        if not local_date:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'local_date is required'})
-            }
-        session_id = get_session_id(user_id, local_date)
-        
-        # Pass verified user_id via session attributes so it's available to tools
-        # Since we've already verified the token, user_id is trusted at this point
-        session_attributes = {
-            'user_id': user_id
-        }
-        
-        session_state = {
-            'sessionAttributes': session_attributes
-        }
-        
-        print(f"Invoking Bedrock Agent with session_id: {session_id}, user_id: {user_id}")
-        print(f"Session state being passed: {json.dumps(session_state)}")
-        
-        response = bedrock_agent.invoke_agent(
-            agentId=agent_id,
-            agentAliasId=agent_alias_id,
-            sessionId=session_id,
-            inputText=message,
-            sessionState=session_state
-        )
-        
-        # Extract response from stream with error handling
-        result = ""
-        try:
-            completion = response.get('completion', [])
-            if not completion:
-                return {
-                    'statusCode': 500,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Empty response from agent'})
-                }
-            
-            for event in completion:
-                if 'chunk' in event:
-                    chunk = event['chunk']
-                    if 'bytes' in chunk:
-                        try:
-                            result += chunk['bytes'].decode('utf-8')
-                        except UnicodeDecodeError as e:
-                            print(f"Unicode decode error: {e}")
-                            # Continue processing other chunks
-                            continue
-        except KeyError as e:
-            print(f"Missing key in response: {e}")
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Invalid response format from agent'})
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'response': result})
-        }
-        
+                reply = run_chat_turn(body, invoke_kwargs, key)
+            except KeyError as e:
+                print(f"Missing key in response: {e}")
+                return json_response(500, {'error': 'Invalid response format from agent'})
+            if reply is None:
+                return json_response(500, {'error': 'Empty response from agent'})
+
+        return json_response(200, {'response': reply})
+
     except Exception as e:
         print(f"Error in lambda_handler: {str(e)}")
-        import traceback
         traceback.print_exc()
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Internal server error'})
-        }
\ No newline at end of file
+        return json_response(500, {'error': 'Internal server error'})
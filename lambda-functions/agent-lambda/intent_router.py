@@ -0,0 +1,124 @@
+"""Deterministic routing of simple chat commands straight to the meal tools.
+
+Messages like "add oatmeal 300 cal 10g protein" or "delete the burrito" need
+no planning, yet sending them through the Bedrock agent costs seconds of
+orchestration. `route` recognizes a few such commands with high confidence
+and turns them into one tools-Lambda call; everything else (questions,
+several foods, dates, anything ambiguous) returns None and goes to the agent.
+
+Only the command shape is parsed here. Values are passed on in the key=value
+string the agent itself sends, so the tools Lambda's own parameter parsing
+converts them, and deletes by name go through /findMealByName so its fuzzy
+matching picks the meal, among the caller's meals of the day only (the
+router turns down messages that name another day). `reply` turns the tool's result into the chat
+answer, or None when the tool declined without changing anything (a name it
+can't fill in, no confident match) and the agent should take over.
+"""
+import re
+
+# Matches below this score are left to the agent, which can ask which meal was meant
+DELETE_CONFIRM_THRESHOLD = 0.9
+MAX_NAME_LENGTH = 60
+
+_COMMAND_RE = re.compile(r'^(?:please\s+)?(add|log|delete|remove)\s+(.+?)[.!]?$', re.IGNORECASE)
+# "300 cal", "300kcal", "10g protein", "10 g of carbs", "5 fat"
+_AMOUNT_RE = re.compile(
+    r'(\d+(?:\.\d+)?)\s*(?:(k?cals?|calories)|(?:g(?:rams?)?\s*)?(?:of\s+)?(protein|carbs?|carbohydrates|fat))\b',
+    re.IGNORECASE)
+_FIELDS = {'protein': 'protein', 'carb': 'carbs', 'carbs': 'carbs', 'carbohydrates': 'carbs', 'fat': 'fat'}
+# What may sit between the name and the amounts, or between amounts
+_FILLER_RE = re.compile(r'^(?:[\s,:;()\-]|\bwith\b|\band\b)*$', re.IGNORECASE)
+_ARTICLE_RE = re.compile(r'^(?:the|my|a|an|some)\s+', re.IGNORECASE)
+# Words that mean the message is about more than one plain meal right now
+_AMBIGUOUS_RE = re.compile(
+    r'[?=,;]|\b(?:and|or|but|not|for|to|from|at|on|in|of|instead|also|then|'
+    r'yesterday|today|tonight|tomorrow|ago|last|all|everything|every|it|that|this|these|those|them)\b',
+    re.IGNORECASE)
+# Letters only: a number in the name is a quantity or an amount without a unit
+_NAME_RE = re.compile(r"^[^\W\d_]+(?:[ '&\-]+[^\W\d_]+)*$")
+_MEAL_ID_RE = re.compile(r'^(?:meal\s+(?:id\s*)?|id\s*|#)#?(\d+)$', re.IGNORECASE)
+
+
+def _meal_name(text):
+    name = _ARTICLE_RE.sub('', text.strip(' ,:;-'))
+    if not name or len(name) > MAX_NAME_LENGTH or not _NAME_RE.match(name) or _AMBIGUOUS_RE.search(name):
+        return None
+    return name
+
+
+def _route_add(rest):
+    amounts = list(_AMOUNT_RE.finditer(rest))
+    name_end = amounts[0].start() if amounts else len(rest)
+    name = _meal_name(re.sub(r'\s+with\s*$', '', rest[:name_end], flags=re.IGNORECASE))
+    if name is None:
+        return None
+
+    values = {}
+    last_end = name_end
+    for m in amounts:
+        if not _FILLER_RE.match(rest[last_end:m.start()]):
+            return None
+        field = 'calories' if m.group(2) else _FIELDS[m.group(3).lower()]
+        if field in values:
+            return None
+        values[field] = m.group(1)
+        last_end = m.end()
+    if not _FILLER_RE.match(rest[last_end:]):
+        return None
+
+    # Without calories the tools fill in the user's usual macros for a known food
+    if values and 'calories' not in values:
+        return None
+    pairs = [f"meal_name={name}"] + [f"{field}={value}" for field, value in values.items()]
+    return {'intent': 'add', 'api_path': '/addMeal', 'mutates': True,
+            'parameters': [{'name': 'parameters', 'value': ', '.join(pairs)}]}
+
+
+def _route_delete(rest, local_date):
+    rest = rest.strip()
+    m = _MEAL_ID_RE.match(rest)
+    if m:
+        return {'intent': 'delete_id', 'api_path': '/deleteMeal', 'mutates': True,
+                'parameters': [{'name': 'parameters', 'value': f"meal_id={m.group(1)}"}]}
+    name = _meal_name(re.sub(r'\s+meal$', '', rest, flags=re.IGNORECASE))
+    if name is None:
+        return None
+    value = f"name={name}, action=delete, auto_confirm_threshold={DELETE_CONFIRM_THRESHOLD}"
+    if local_date:
+        value += f", date={local_date}"
+    return {'intent': 'delete', 'api_path': '/findMealByName', 'mutates': True,
+            'parameters': [{'name': 'parameters', 'value': value}]}
+
+
+def route(message, local_date=None):
+    """The tool call for a simple command, as {'intent', 'api_path', 'parameters', 'mutates'}; else None.
+
+    `local_date` (YYYY-MM-DD) is the caller's day, which deletes by name are limited to.
+    """
+    m = _COMMAND_RE.match((message or '').strip())
+    if not m:
+        return None
+    verb, rest = m.group(1).lower(), m.group(2)
+    if verb in ('add', 'log'):
+        return _route_add(rest)
+    return _route_delete(rest, local_date)
+
+
+def reply(intent, result):
+    """Chat answer for a routed command's tool result, or None to fall back to the agent."""
+    if intent['intent'] == 'delete':
+        if not isinstance(result, dict) or not result.get('auto_act_performed'):
+            return None
+        best = result.get('best_match') or {}
+        message = result.get('message') or ''
+        if message.startswith('Deleted') and best.get('name'):
+            return f"Deleted {best['name']} ({best.get('calories')} calories)."
+        return message
+    if not isinstance(result, str):
+        return None
+    if intent['intent'] == 'add' and result.startswith('Missing required'):
+        return None  # an unknown food on its own; the agent can estimate its nutrition
+    if intent['intent'] == 'delete_id' and 'not found' in result:
+        return None
+    # Errors are reported as they are: the write may have happened, so retrying through the agent could repeat it
+    return result if result.endswith(('.', '?', ')')) else f"{result}."
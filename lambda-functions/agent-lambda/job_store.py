@@ -0,0 +1,174 @@
+"""Records of asynchronous agent turns ("jobs").
+
+A submitted turn gets a job; the worker running it appends the reply's
+chunks as the agent produces them and finally marks it done (with the full
+reply) or failed (with an error). Pollers read the status and the chunks
+after the ones they already have.
+
+With JOBS_TABLE set, jobs are items in that DynamoDB table (partition key
+`pk`, TTL attribute `expires_at`), shared by the submitting, running and
+polling containers. Otherwise they are kept in a SQLite file
+(JOB_STORE_PATH), which lets the async mode run and be tested locally
+without AWS.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+JOBS_TABLE = os.environ.get('JOBS_TABLE', '')
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', '/tmp/agent-jobs.sqlite3')
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', '86400'))
+# Chunks are written at most this often, so a long reply isn't one write per token
+JOB_FLUSH_SECONDS = 0.25
+TERMINAL_STATUSES = ('done', 'failed')
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = DynamoJobStore(JOBS_TABLE) if JOBS_TABLE else SqliteJobStore(JOB_STORE_PATH)
+    return _store
+
+
+class SqliteJobStore:
+    """Jobs in a local SQLite file; one connection per call, so any thread may use it."""
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, status TEXT NOT NULL,
+                response TEXT, error TEXT, updated_at REAL NOT NULL, expires_at REAL NOT NULL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS job_chunks (
+                job_id TEXT NOT NULL, seq INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (job_id, seq))""")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def create(self, job_id, user_id):
+        """Add a pending job; False if a live job with this id already exists."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("DELETE FROM job_chunks WHERE job_id IN (SELECT job_id FROM jobs WHERE expires_at < ?)", (now,))
+            db.execute("DELETE FROM jobs WHERE expires_at < ?", (now,))
+            cursor = db.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?, 'pending', NULL, NULL, ?, ?)",
+                                (job_id, user_id, now, now + JOB_TTL_SECONDS))
+            return cursor.rowcount == 1
+
+    def get(self, job_id, after=0):
+        """The job with its chunks from index `after` on, or None."""
+        with self._connect() as db:
+            row = db.execute("SELECT user_id, status, response, error, updated_at FROM jobs "
+                             "WHERE job_id = ? AND expires_at >= ?", (job_id, time.time())).fetchone()
+            if row is None:
+                return None
+            chunks = [text for (text,) in db.execute(
+                "SELECT text FROM job_chunks WHERE job_id = ? AND seq >= ? ORDER BY seq", (job_id, after))]
+            (count,) = db.execute("SELECT COUNT(*) FROM job_chunks WHERE job_id = ?", (job_id,)).fetchone()
+        return {'job_id': job_id, 'user_id': row[0], 'status': row[1], 'response': row[2], 'error': row[3],
+                'updated_at': row[4], 'chunks': chunks, 'chunk_count': count}
+
+    def set_status(self, job_id, status):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?", (status, time.time(), job_id))
+
+    def append_chunks(self, job_id, texts):
+        with self._connect() as db:
+            (count,) = db.execute("SELECT COUNT(*) FROM job_chunks WHERE job_id = ?", (job_id,)).fetchone()
+            db.executemany("INSERT INTO job_chunks VALUES (?, ?, ?)",
+                           [(job_id, count + i, text) for i, text in enumerate(texts)])
+            db.execute("UPDATE jobs SET updated_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def finish(self, job_id, status, response=None, error=None):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, response = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                       (status, response, error, time.time(), job_id))
+
+
+class DynamoJobStore:
+    """Jobs as DynamoDB items; the chunks are a list attribute appended to in place."""
+
+    def __init__(self, table):
+        import boto3
+        self.table = table
+        self.client = boto3.client('dynamodb', region_name=os.environ.get('AWS_REGION', 'us-east-2'))
+
+    def _key(self, job_id):
+        return {'pk': {'S': f"job#{job_id}"}}
+
+    def _update(self, job_id, expression, values, names=None):
+        request = {'TableName': self.table, 'Key': self._key(job_id), 'UpdateExpression': expression,
+                   'ExpressionAttributeValues': {':now': {'N': repr(time.time())}, **values}}
+        if names:
+            request['ExpressionAttributeNames'] = names
+        self.client.update_item(**request)
+
+    def create(self, job_id, user_id):
+        now = time.time()
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item={**self._key(job_id), 'user_id': {'S': user_id}, 'status': {'S': 'pending'},
+                      'chunks': {'L': []}, 'updated_at': {'N': repr(now)},
+                      'expires_at': {'N': str(int(now) + JOB_TTL_SECONDS)}},
+                ConditionExpression='attribute_not_exists(pk) OR expires_at < :now',
+                ExpressionAttributeValues={':now': {'N': str(int(now))}},
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def get(self, job_id, after=0):
+        item = self.client.get_item(TableName=self.table, Key=self._key(job_id), ConsistentRead=True).get('Item')
+        if item is None or float(item['expires_at']['N']) < time.time():
+            return None
+        chunks = [c['S'] for c in item.get('chunks', {}).get('L', [])]
+        return {'job_id': job_id, 'user_id': item['user_id']['S'], 'status': item['status']['S'],
+                'response': item.get('response', {}).get('S'), 'error': item.get('error', {}).get('S'),
+                'updated_at': float(item['updated_at']['N']), 'chunks': chunks[after:], 'chunk_count': len(chunks)}
+
+    def set_status(self, job_id, status):
+        self._update(job_id, 'SET #status = :status, updated_at = :now', {':status': {'S': status}},
+                     {'#status': 'status'})
+
+    def append_chunks(self, job_id, texts):
+        self._update(job_id, 'SET chunks = list_append(chunks, :texts), updated_at = :now',
+                     {':texts': {'L': [{'S': text} for text in texts]}})
+
+    def finish(self, job_id, status, response=None, error=None):
+        values = {':status': {'S': status}}
+        expression = 'SET #status = :status, updated_at = :now'
+        for name, value in (('response', response), ('error', error)):
+            if value is not None:
+                values[f":{name}"] = {'S': value}
+                expression += f", {name} = :{name}"
+        self._update(job_id, expression, values, {'#status': 'status'})
+
+
+class ChunkBuffer:
+    """Collects a job's reply deltas and appends them to the store at most every JOB_FLUSH_SECONDS."""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.pending = []
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, text):
+        with self._lock:
+            self.pending.append(text)
+            if time.monotonic() - self.flushed_at < JOB_FLUSH_SECONDS:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            texts, self.pending = self.pending, []
+            self.flushed_at = time.monotonic()
+        if texts:
+            self.store.append_chunks(self.job_id, [''.join(texts)])
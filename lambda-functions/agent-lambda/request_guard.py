@@ -0,0 +1,275 @@
+"""Duplicate suppression and per-user admission control for chat turns.
+
+A double tap or a retry from the app sends the same message twice, usually
+while the first is still running on the same agent session; run twice, the
+turn costs a second agent invocation and can log the meal twice. Each turn
+first claims an idempotency record keyed on its session, message and the
+app's request_id. The first request runs the turn and stores the reply; a
+duplicate waits for it and answers with that reply instead. Finished records
+are kept for IDEMPOTENCY_TTL_SECONDS when the app sends a request_id, and for
+DOUBLE_SUBMIT_SECONDS otherwise, so repeating a message on purpose later is
+still a new turn.
+
+A new turn then takes a token from the user's bucket (RATE_LIMIT_PER_MINUTE
+refill, RATE_LIMIT_BURST capacity; 0 turns it off). An empty bucket is
+refused with the time until the next token.
+
+Turns the fast path answers without the agent are kept here too, per
+session, until the session's next agent turn hands them to Bedrock as
+conversation history (`remember_turn` / `take_turns`), so a follow-up like
+"actually make it 400" knows what was just logged.
+
+With IDEMPOTENCY_TABLE set, records, buckets and turns live in that DynamoDB table
+(partition key `pk`, TTL attribute `expires_at`) and are shared by every
+container. Without it they are kept per container, which only catches
+duplicates that reach the same warm container. DynamoDB errors fail open:
+the turn runs as if it were new and admitted.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE', '')
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '600'))
+DOUBLE_SUBMIT_SECONDS = int(os.environ.get('DOUBLE_SUBMIT_SECONDS', '10'))
+# A claimed turn that never finishes (the container died) is reclaimable after this
+IN_PROGRESS_LEASE_SECONDS = 300
+# How long a duplicate waits for the first request's reply; must stay under
+# API Gateway's 29 second integration timeout so the 409 reaches the client
+DUPLICATE_WAIT_SECONDS = float(os.environ.get('DUPLICATE_WAIT_SECONDS', '20'))
+DUPLICATE_POLL_SECONDS = 0.25
+RATE_LIMIT_PER_MINUTE = float(os.environ.get('RATE_LIMIT_PER_MINUTE', '20'))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', '5'))
+LOCAL_STATE_SIZE = 4096
+# Fast-path turns kept for the agent: the most recent ones, for Bedrock's default
+# idle session timeout (an agent session idle longer has forgotten the rest too)
+TURN_HISTORY_SIZE = 10
+TURN_HISTORY_TTL_SECONDS = 600
+# Optimistic bucket updates retried on contention before admitting anyway
+BUCKET_UPDATE_ATTEMPTS = 3
+
+_lock = threading.Lock()
+_records = OrderedDict()  # key -> {'status', 'expires_at', 'response'}
+_buckets = OrderedDict()  # user_id -> (tokens, refilled_at)
+_turns = OrderedDict()  # session_id -> (expires_at, [(message, reply), ...])
+_dynamodb = None
+
+
+def get_dynamodb():
+    global _dynamodb
+    if _dynamodb is None:
+        import boto3
+        _dynamodb = boto3.client('dynamodb', region_name=os.environ.get('AWS_REGION', 'us-east-2'))
+    return _dynamodb
+
+
+def request_key(session_id: str, message: str, request_id=None) -> str:
+    return hashlib.sha256(f"{session_id}\0{request_id or ''}\0{message}".encode()).hexdigest()
+
+
+def record_ttl(request_id) -> int:
+    return IDEMPOTENCY_TTL_SECONDS if request_id else DOUBLE_SUBMIT_SECONDS
+
+
+def _remember(store, key, value):
+    store[key] = value
+    store.move_to_end(key)
+    while len(store) > LOCAL_STATE_SIZE:
+        store.popitem(last=False)
+
+
+# -- idempotency records --------------------------------------------------------
+
+def _try_claim(key: str, user_id: str) -> bool:
+    now = time.time()
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            record = _records.get(key)
+            if record is not None and record['expires_at'] > now:
+                return False
+            _remember(_records, key, {'status': 'in_progress', 'expires_at': now + IN_PROGRESS_LEASE_SECONDS,
+                                      'response': None})
+            return True
+    client = get_dynamodb()
+    try:
+        client.put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item={'pk': {'S': f"req#{key}"}, 'user_id': {'S': user_id}, 'status': {'S': 'in_progress'},
+                  'expires_at': {'N': str(int(now) + IN_PROGRESS_LEASE_SECONDS)}},
+            ConditionExpression='attribute_not_exists(pk) OR expires_at < :now',
+            ExpressionAttributeValues={':now': {'N': str(int(now))}},
+        )
+        return True
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def _get_record(key: str):
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            record = _records.get(key)
+            return dict(record) if record is not None and record['expires_at'] > time.time() else None
+    item = get_dynamodb().get_item(TableName=IDEMPOTENCY_TABLE, Key={'pk': {'S': f"req#{key}"}},
+                                   ConsistentRead=True).get('Item')
+    if item is None or float(item['expires_at']['N']) <= time.time():
+        return None
+    return {'status': item['status']['S'], 'response': item.get('response', {}).get('S')}
+
+
+def claim(key: str, user_id: str):
+    """
+    Claim a turn. Returns ('new', None) if this request should run it,
+    ('done', reply) if an identical request already answered it, or
+    ('busy', None) if one is still running after DUPLICATE_WAIT_SECONDS.
+    """
+    deadline = time.monotonic() + DUPLICATE_WAIT_SECONDS
+    try:
+        while True:
+            if _try_claim(key, user_id):
+                return 'new', None
+            record = _get_record(key)
+            if record is not None and record['status'] == 'complete':
+                return 'done', record['response']
+            # A released record (the first request failed) is claimed on the next pass
+            if time.monotonic() >= deadline:
+                return 'busy', None
+            time.sleep(DUPLICATE_POLL_SECONDS)
+    except Exception as e:
+        print(f"Idempotency claim failed: {str(e)}")
+        return 'new', None
+
+
+def complete(key: str, user_id: str, reply: str, ttl: int):
+    """Store a turn's reply for duplicates of it to reuse for `ttl` seconds."""
+    expires_at = time.time() + ttl
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            _remember(_records, key, {'status': 'complete', 'expires_at': expires_at, 'response': reply})
+        return
+    try:
+        get_dynamodb().put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item={'pk': {'S': f"req#{key}"}, 'user_id': {'S': user_id}, 'status': {'S': 'complete'},
+                  'response': {'S': reply}, 'expires_at': {'N': str(int(expires_at))}},
+        )
+    except Exception as e:
+        print(f"Idempotency record write failed: {str(e)}")
+
+
+def release(key: str):
+    """Drop the claim on a turn that failed, so a retry runs it again."""
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            _records.pop(key, None)
+        return
+    try:
+        get_dynamodb().delete_item(TableName=IDEMPOTENCY_TABLE, Key={'pk': {'S': f"req#{key}"}})
+    except Exception as e:
+        print(f"Idempotency release failed: {str(e)}")
+
+
+# -- fast-path turns --------------------------------------------------------------
+
+def remember_turn(session_id: str, user_id: str, message: str, reply: str):
+    """Keep a turn answered without the agent for the session's next agent turn."""
+    expires_at = time.time() + TURN_HISTORY_TTL_SECONDS
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            entry = _turns.get(session_id)
+            turns = entry[1] if entry is not None and entry[0] > time.time() else []
+            _remember(_turns, session_id, (expires_at, (turns + [(message, reply)])[-TURN_HISTORY_SIZE:]))
+        return
+    try:
+        get_dynamodb().update_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Key={'pk': {'S': f"turns#{session_id}"}},
+            UpdateExpression='SET turns = list_append(if_not_exists(turns, :none), :turn), '
+                             'user_id = :user, expires_at = :expires',
+            ExpressionAttributeValues={
+                ':none': {'L': []},
+                ':turn': {'L': [{'L': [{'S': message}, {'S': reply}]}]},
+                ':user': {'S': user_id},
+                ':expires': {'N': str(int(expires_at))},
+            },
+        )
+    except Exception as e:
+        print(f"Fast-path turn write failed: {str(e)}")
+
+
+def take_turns(session_id: str):
+    """Remove and return the session's remembered turns as [(message, reply)], oldest first."""
+    if not IDEMPOTENCY_TABLE:
+        with _lock:
+            entry = _turns.pop(session_id, None)
+        return entry[1] if entry is not None and entry[0] > time.time() else []
+    try:
+        item = get_dynamodb().delete_item(TableName=IDEMPOTENCY_TABLE, Key={'pk': {'S': f"turns#{session_id}"}},
+                                          ReturnValues='ALL_OLD').get('Attributes')
+    except Exception as e:
+        print(f"Fast-path turn read failed: {str(e)}")
+        return []
+    if item is None or float(item['expires_at']['N']) <= time.time():
+        return []
+    turns = [(turn['L'][0]['S'], turn['L'][1]['S']) for turn in item['turns']['L']]
+    return turns[-TURN_HISTORY_SIZE:]
+
+
+# -- admission --------------------------------------------------------------------
+
+def _refill(tokens: float, refilled_at: float, now: float) -> float:
+    return min(float(RATE_LIMIT_BURST), tokens + (now - refilled_at) * RATE_LIMIT_PER_MINUTE / 60)
+
+
+def _wait_for_token(tokens: float) -> float:
+    return (1 - tokens) * 60 / RATE_LIMIT_PER_MINUTE
+
+
+def _admit_dynamodb(user_id: str) -> float:
+    client = get_dynamodb()
+    key = {'pk': {'S': f"rate#{user_id}"}}
+    for _ in range(BUCKET_UPDATE_ATTEMPTS):
+        now = time.time()
+        item = client.get_item(TableName=IDEMPOTENCY_TABLE, Key=key, ConsistentRead=True).get('Item')
+        if item is None:
+            tokens, condition, values = float(RATE_LIMIT_BURST), 'attribute_not_exists(pk)', {}
+        else:
+            previous = item['refilled_at']['N']
+            tokens = _refill(float(item['tokens']['N']), float(previous), now)
+            condition, values = 'refilled_at = :previous', {':previous': {'N': previous}}
+        if tokens < 1:
+            return _wait_for_token(tokens)
+        # Idle buckets are full again after a minute or so; let TTL remove them
+        idle_expiry = int(now + 60 * RATE_LIMIT_BURST / RATE_LIMIT_PER_MINUTE) + 60
+        request = {'TableName': IDEMPOTENCY_TABLE, 'ConditionExpression': condition,
+                   'Item': {**key, 'tokens': {'N': repr(tokens - 1)}, 'refilled_at': {'N': repr(now)},
+                            'expires_at': {'N': str(idle_expiry)}}}
+        if values:
+            request['ExpressionAttributeValues'] = values
+        try:
+            client.put_item(**request)
+            return 0.0
+        except client.exceptions.ConditionalCheckFailedException:
+            pass
+    return 0.0
+
+
+def admit(user_id: str) -> float:
+    """Take a token for a new turn. Returns 0 if admitted, else seconds until a token is available."""
+    if RATE_LIMIT_PER_MINUTE <= 0:
+        return 0.0
+    if IDEMPOTENCY_TABLE:
+        try:
+            return _admit_dynamodb(user_id)
+        except Exception as e:
+            print(f"Rate limit check failed: {str(e)}")
+            return 0.0
+    now = time.time()
+    with _lock:
+        tokens, refilled_at = _buckets.get(user_id, (float(RATE_LIMIT_BURST), now))
+        tokens = _refill(tokens, refilled_at, now)
+        if tokens < 1:
+            return _wait_for_token(tokens)
+        _remember(_buckets, user_id, (tokens - 1, now))
+    return 0.0
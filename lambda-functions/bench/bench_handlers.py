@@ -0,0 +1,222 @@
+"""Throughput and latency benchmark for both Lambda handlers.
+
+Drives meal_tools.lambda_handler with every event shape in event_corpus.json
+(plus the read and batch tools) and agent.lambda_handler with chat requests.
+The tools Lambda talks to a local fake PostgREST server (fake_postgrest.py)
+and the agent Lambda to a fake bedrock-agent-runtime client (fake_bedrock.py),
+each with configurable latency. Reports p50/p95/p99 latency, invocations/sec
+and peak traced allocations per invocation, and compares them with a stored
+baseline, exiting non-zero on a regression.
+
+Usage:
+    python lambda-functions/bench/bench_handlers.py [--iterations 1000] [--db-latency-ms 0]
+        [--first-chunk-ms 0] [--chunk-ms 0] [--baseline bench/baseline.json] [--write-baseline]
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+sys.path.insert(0, os.path.join(HERE, '..', 'agent-lambda'))
+sys.path.insert(0, os.path.join(HERE, '..', 'shared'))
+
+from fake_bedrock import FakeBedrockAgentRuntime  # noqa: E402
+from fake_postgrest import FakePostgrest  # noqa: E402
+
+BENCH_USER = 'bench-user-0'
+JWT_SECRET = 'bench-secret'
+FOODS = [
+    ('Chicken Salad', 350, 30, 20, 10), ('Chipotle Burrito', 950, 45, 110, 35),
+    ('Greek Yogurt', 150, 15, 8, 4), ('Oatmeal with berries', 300, 10, 54, 6),
+    ('Protein Shake', 220, 40, 8, 3), ('Banana', 105, 1, 27, 0),
+    ('Turkey Sandwich', 420, 28, 45, 12), ('Salmon and rice', 640, 42, 60, 22),
+]
+# Gated against the baseline: (metric, True if higher is worse)
+GATED_METRICS = [('p50_ms', True), ('p95_ms', True), ('invocations_per_sec', False), ('alloc_peak_kib', True)]
+
+
+def seed_meals(fake, today, days, per_day):
+    rows = []
+    for d in range(days):
+        day = today - timedelta(days=d)
+        for n in range(per_day):
+            name, cal, protein, carbs, fat = FOODS[(d + n) % len(FOODS)]
+            created_at = datetime(day.year, day.month, day.day, 7 + 3 * n, tzinfo=timezone.utc)
+            rows.append({'user_id': BENCH_USER, 'meal_name': name, 'calories': cal, 'protein': protein,
+                         'carbs': carbs, 'fat': fat, 'created_at': created_at.isoformat()})
+    fake.seed('Meals', rows)
+
+
+def tool_events(today):
+    with open(os.path.join(HERE, 'event_corpus.json')) as f:
+        events = [case['event'] for case in json.load(f)]
+    events += [
+        {'apiPath': '/getMeals', 'parameters': {'start_date': (today - timedelta(days=6)).isoformat(), 'limit': 50}},
+        {'apiPath': '/getDailyTotals', 'parameters': {'start_date': (today - timedelta(days=6)).isoformat()}},
+        {'apiPath': '/getNutritionStats', 'parameters': {'calorie_goal': 2000}},
+        {'apiPath': '/suggestMeals', 'parameters': {'query': 'chick'}},
+        {'apiPath': '/addMeal', 'parameters': {'meal_name': 'Greek Yogurt'}},
+        {'apiPath': '/batchMeals', 'parameters': {'operations': [
+            {'op': 'add', 'meal_name': 'Banana', 'calories': 105},
+            {'op': 'add', 'meal_name': 'Protein Shake'},
+        ]}},
+    ]
+    session = {'user_id': BENCH_USER, 'local_date': today.isoformat()}
+    return [dict(event, actionGroup='meal_tools', sessionAttributes=session) for event in events]
+
+
+def agent_events(today, users=4):
+    import jwt
+    exp = int(time.time()) + 3600
+    events = []
+    for n in range(users):
+        token = jwt.encode({'sub': f'bench-user-{n}', 'aud': 'authenticated', 'exp': exp}, JWT_SECRET, algorithm='HS256')
+        body = {'message': 'I had a chicken salad for lunch', 'access_token': token,
+                'local_date': today.isoformat()}
+        events.append({'body': json.dumps(body), 'headers': {'Content-Type': 'application/json'}})
+    return events
+
+
+def percentiles(latencies_ms):
+    cuts = statistics.quantiles(latencies_ms, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def run_handler(handler, events, iterations, alloc_iterations):
+    """Time `iterations` invocations, then measure allocations over `alloc_iterations` more."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for event in events:  # warm: connections, JWT cache, per-user indexes
+            handler(event, None)
+
+        statuses = {}
+        latencies = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            event = events[i % len(events)]
+            t0 = time.perf_counter()
+            resp = handler(event, None)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            status = resp.get('statusCode') or resp['response']['httpStatusCode']
+            statuses[status] = statuses.get(status, 0) + 1
+        wall = time.perf_counter() - started
+
+        tracemalloc.start()
+        peaks = []
+        try:
+            for i in range(alloc_iterations):
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                handler(events[i % len(events)], None)
+                peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        finally:
+            tracemalloc.stop()
+
+    p50, p95, p99 = percentiles(latencies)
+    return {
+        'iterations': iterations,
+        'p50_ms': round(p50, 3),
+        'p95_ms': round(p95, 3),
+        'p99_ms': round(p99, 3),
+        'max_ms': round(max(latencies), 3),
+        'invocations_per_sec': round(iterations / wall, 1),
+        'alloc_peak_kib': round(statistics.mean(peaks) / 1024, 1) if peaks else None,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Return a list of regression messages against `baseline`.
+
+    Latency changes smaller than `min_delta_ms` are ignored; for sub-millisecond
+    handlers scheduler noise alone exceeds any useful relative tolerance.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('handlers', {}).get(name)
+        if not base:
+            continue
+        for metric, higher_is_worse in GATED_METRICS:
+            new, old = result.get(metric), base.get(metric)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            if metric.endswith('_ms') and new - old < min_delta_ms:
+                continue
+            if (change > tolerance) if higher_is_worse else (change < -tolerance):
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=1000, help='timed invocations per handler')
+    parser.add_argument('--alloc-iterations', type=int, default=100, help='invocations traced with tracemalloc')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='delay added to every fake PostgREST request')
+    parser.add_argument('--first-chunk-ms', type=float, default=0.0, help='fake Bedrock delay before the first chunk')
+    parser.add_argument('--chunk-ms', type=float, default=0.0, help='fake Bedrock delay between chunks')
+    parser.add_argument('--seed-days', type=int, default=90, help='days of meal history for the benchmark user')
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'))
+    parser.add_argument('--tolerance', type=float, default=0.3, help='allowed relative regression per gated metric')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5, help='ignore latency regressions smaller than this')
+    parser.add_argument('--write-baseline', action='store_true', help='store these results as the new baseline')
+    args = parser.parse_args(argv)
+
+    fake_db = FakePostgrest(latency_ms=args.db_latency_ms).start()
+    today = datetime.now(timezone.utc).date()
+    seed_meals(fake_db, today, args.seed_days, per_day=4)
+    os.environ.update({'DB_API_URL': fake_db.url, 'DB_API_KEY': 'bench', 'JWT_SECRET': JWT_SECRET,
+                       'BEDROCK_AGENT_ID': 'BENCHAGENT', 'AWS_REGION': 'us-east-2',
+                       # the agent events repeat one message per user; time every turn rather
+                       # than replaying it as a double submit or rate limiting it
+                       'DOUBLE_SUBMIT_SECONDS': '0', 'RATE_LIMIT_PER_MINUTE': '0'})
+
+    import agent
+    import meal_tools
+    agent._bedrock_agent = FakeBedrockAgentRuntime(first_chunk_ms=args.first_chunk_ms, chunk_ms=args.chunk_ms)
+
+    results = {}
+    try:
+        results['meal_tools'] = run_handler(meal_tools.lambda_handler, tool_events(today),
+                                            args.iterations, args.alloc_iterations)
+        results['agent'] = run_handler(agent.lambda_handler, agent_events(today),
+                                       args.iterations, args.alloc_iterations)
+    finally:
+        fake_db.stop()
+
+    print(f"{'handler':12s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'inv/s':>9s} {'peak KiB':>9s}  statuses")
+    for name, r in results.items():
+        print(f"{name:12s} {r['p50_ms']:9.3f} {r['p95_ms']:9.3f} {r['p99_ms']:9.3f} "
+              f"{r['invocations_per_sec']:9.1f} {r['alloc_peak_kib']:9.1f}  {r['statuses']}")
+
+    config = {k: getattr(args, k) for k in ('iterations', 'db_latency_ms', 'first_chunk_ms', 'chunk_ms', 'seed_days')}
+    if args.write_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'config': config, 'handlers': results}, f, indent=2)
+            f.write('\n')
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline to compare against (run with --write-baseline)")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('config') != config:
+        print(f"baseline was recorded with {baseline.get('config')}; not comparing")
+        return 0
+    regressions = compare(results, baseline, args.tolerance, args.min_delta_ms)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print(f"tolerance {args.tolerance:.0%}: {'FAIL' if regressions else 'pass'}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
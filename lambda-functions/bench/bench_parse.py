@@ -0,0 +1,57 @@
+"""Micro-benchmark for meal_tools.normalize_parameters.
+
+Runs every event shape in event_corpus.json (the shapes Bedrock sends to the
+tools Lambda), checks the parsed parameters against the expected output and
+reports the best-of-N time per call. Exits non-zero if any shape parses
+incorrectly or slower than the budget.
+
+Usage:
+    python lambda-functions/bench/bench_parse.py [--budget-us 10] [--number 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+sys.path.insert(0, os.path.join(HERE, '..', 'shared'))
+
+import meal_tools  # noqa: E402
+
+
+def load_corpus(path=os.path.join(HERE, 'event_corpus.json')):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-us', type=float, default=10.0, help='maximum time per call for any shape')
+    parser.add_argument('--number', type=int, default=20000, help='calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per shape (best is reported)')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for case in load_corpus():
+        event = case['event']
+        got = meal_tools.normalize_parameters(event)
+        runs = timeit.repeat(lambda: meal_tools.normalize_parameters(event), number=args.number, repeat=args.repeat)
+        per_call_us = min(runs) / args.number * 1e6
+
+        status = 'ok'
+        if got != case['expect']:
+            status = f'WRONG: {got!r}'
+            failures += 1
+        elif per_call_us > args.budget_us:
+            status = 'OVER BUDGET'
+            failures += 1
+        print(f"{case['name']:32s} {per_call_us:8.2f} us  {status}")
+
+    print(f"budget {args.budget_us:.1f} us/call: {'FAIL' if failures else 'pass'}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""Stand-in for the boto3 `bedrock-agent-runtime` client.
+
+`invoke_agent` returns a completion stream shaped like Bedrock's: an iterable
+of {'chunk': {'bytes': ...}} events. The reply is split at byte offsets, so
+multibyte characters can straddle chunks just as they do in real streams.
+Latency is configurable: `first_chunk_ms` before the first chunk and
+`chunk_ms` between chunks. Without streamingConfigurations Bedrock sends the
+final answer in one chunk once it is complete, so the whole delay is paid up front.
+"""
+import time
+
+DEFAULT_REPLY = (
+    "I've logged your Chicken Salad (350 cal, 30g protein, 20g carbs, 10g fat). "
+    "You're at 1,450 of 2,000 calories today — about 550 left for dinner. 🥗"
+)
+
+
+class FakeBedrockAgentRuntime:
+    def __init__(self, reply=DEFAULT_REPLY, chunks=8, first_chunk_ms=0.0, chunk_ms=0.0):
+        self.reply = reply.encode("utf-8")
+        self.chunks = max(1, chunks)
+        self.first_chunk_ms = first_chunk_ms
+        self.chunk_ms = chunk_ms
+        self.calls = 0
+
+    def _pieces(self, streaming):
+        if not streaming:
+            return [self.reply]
+        size = -(-len(self.reply) // self.chunks)
+        return [self.reply[i:i + size] for i in range(0, len(self.reply), size)]
+
+    def _completion(self, pieces, streaming):
+        if streaming:
+            delays = [self.first_chunk_ms] + [self.chunk_ms] * (len(pieces) - 1)
+        else:
+            delays = [self.first_chunk_ms + self.chunk_ms * (self.chunks - 1)]
+        for delay, piece in zip(delays, pieces):
+            if delay:
+                time.sleep(delay / 1000)
+            yield {"chunk": {"bytes": piece}}
+
+    def invoke_agent(self, agentId, agentAliasId, sessionId, inputText, sessionState=None,
+                     streamingConfigurations=None, **kwargs):
+        self.calls += 1
+        streaming = bool((streamingConfigurations or {}).get("streamFinalResponse"))
+        return {
+            "completion": self._completion(self._pieces(streaming), streaming),
+            "contentType": "application/json",
+            "sessionId": sessionId,
+        }
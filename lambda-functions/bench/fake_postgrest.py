@@ -0,0 +1,342 @@
+"""In-memory stand-in for the Supabase PostgREST API.
+
+Implements the subset postgrest_client sends: select with eq/gt/gte/lt/lte/in
+and or(...)/and(...) filters, multi-column order and limit; insert, upsert
+(on_conflict, merge or ignore duplicates), update and delete with
+return=representation. The triggers from database/migrations are emulated
+too: Meals and CalTracker writes stamp change_seq (and Meals updated_at), Meals
+deletes leave a MealTombstones row, and every Meals write is folded into its
+day's CalTracker row. Every request can be delayed by a fixed latency to
+approximate the network round trip to Supabase.
+
+Used by bench_handlers.py, or run it on its own to point a local tools Lambda at:
+    python lambda-functions/bench/fake_postgrest.py --port 54321 --latency-ms 20
+    DB_API_URL=http://127.0.0.1:54321 DB_API_KEY=local python ...
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+RESERVED_PARAMS = {"select", "order", "limit", "on_conflict", "or"}
+MACRO_FIELDS = ("calories", "protein", "carbs", "fat")
+
+
+def _coerce(value):
+    """Comparable form of a stored or filter value: numbers, timestamps, else text."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    s = str(value)
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    if len(s) >= 10 and s[4:5] == "-" and s[7:8] == "-":
+        try:
+            ts = datetime.fromisoformat(s)
+            return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return s
+
+
+def _compare(row_value, op, raw):
+    if op == "is":
+        return row_value is None if raw == "null" else str(row_value).lower() == raw
+    if row_value is None:
+        return False
+    left, right = _coerce(row_value), _coerce(raw)
+    if type(left) is not type(right):
+        left, right = str(row_value), raw
+    if op == "eq":
+        return left == right
+    if op == "neq":
+        return left != right
+    if op == "gt":
+        return left > right
+    if op == "gte":
+        return left >= right
+    if op == "lt":
+        return left < right
+    if op == "lte":
+        return left <= right
+    raise ValueError(f"unsupported operator {op!r}")
+
+
+def _split_top_level(s):
+    """Split on commas that are not inside parentheses or double quotes."""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, c in enumerate(s):
+        if c == '"':
+            quoted = not quoted
+        elif not quoted and c == "(":
+            depth += 1
+        elif not quoted and c == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and c == ",":
+            parts.append(s[start:i])
+            start = i + 1
+    parts.append(s[start:])
+    return [p for p in parts if p]
+
+
+def _unquote(s):
+    if len(s) >= 2 and s[0] == '"' and s[-1] == '"':
+        return s[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return s
+
+
+def _compile_condition(column, expr):
+    """Predicate for one `column=op.value` filter."""
+    op, _, raw = expr.partition(".")
+    if op == "in":
+        values = {_unquote(v) for v in _split_top_level(raw[1:-1])}
+        return lambda row: row.get(column) is not None and str(row.get(column)) in values
+    raw = _unquote(raw)
+    return lambda row: _compare(row.get(column), op, raw)
+
+
+def _compile_logic(kind, body):
+    """Predicate for `or(...)`/`and(...)` bodies such as `a.gt.1,and(b.eq.2,c.lt.3)`."""
+    preds = []
+    for term in _split_top_level(body):
+        if term.startswith(("or(", "and(")):
+            inner_kind, _, rest = term.partition("(")
+            preds.append(_compile_logic(inner_kind, rest[:-1]))
+        else:
+            column, _, expr = term.partition(".")
+            preds.append(_compile_condition(column, expr))
+    if kind == "or":
+        return lambda row: any(p(row) for p in preds)
+    return lambda row: all(p(row) for p in preds)
+
+
+class FakePostgrest:
+    """A threaded PostgREST stand-in holding its tables in memory."""
+
+    def __init__(self, latency_ms=0.0, host="127.0.0.1", port=0):
+        self.latency_ms = latency_ms
+        self.tables = {"Meals": [], "CalTracker": [], "MealTombstones": []}
+        self.request_count = 0
+        self._next_id = {}
+        self._change_seq = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # -- data -----------------------------------------------------------------
+
+    def seed(self, table, rows):
+        with self._lock:
+            for row in rows:
+                self._insert_row(table, dict(row))
+
+    def _insert_row(self, table, row):
+        rows = self.tables.setdefault(table, [])
+        next_id = self._next_id.get(table, 1)
+        if row.get("id") is None:
+            row["id"] = next_id
+        self._next_id[table] = max(next_id, int(row["id"]) + 1)
+        row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+        rows.append(row)
+        self._track_change(table, row)
+        if table == "Meals":
+            self._rollup((row, 1))
+        return row
+
+    def _rollup(self, *changes):
+        """What the meals_rollup triggers do for meals added (sign 1) and removed (-1) by one write."""
+        deltas = {}
+        for meal, sign in changes:
+            if not meal.get("created_at"):
+                continue
+            created_at = _coerce(meal["created_at"])
+            key = (meal.get("user_id"), str(created_at.astimezone(timezone.utc).date()))
+            first, acc = deltas.get(key) or (created_at, [0.0] * len(MACRO_FIELDS))
+            for i, field in enumerate(MACRO_FIELDS):
+                acc[i] += sign * float(meal.get(field) or 0)
+            deltas[key] = (min(first, created_at), acc)
+        for (user_id, day), (first, acc) in deltas.items():
+            if not any(acc):
+                continue
+            for row in self.tables["CalTracker"]:
+                if (row.get("user_id"), row.get("day")) == (user_id, day):
+                    break
+            else:
+                # A new day's row is dated by its first meal
+                row = self._insert_row("CalTracker", {"user_id": user_id, "day": day, "created_at": first.isoformat(),
+                                                      "calories": 0, "protein": 0, "carbs": 0, "fat": 0})
+            for field, delta in zip(MACRO_FIELDS, acc):
+                row[field] = (row.get(field) or 0) + delta
+            self._track_change("CalTracker", row)
+
+    def _track_change(self, table, row, updated_at=None):
+        """What the meals/caltracker_track_change triggers do on insert and update."""
+        if table not in ("Meals", "CalTracker"):
+            return
+        self._change_seq += 1
+        row["change_seq"] = self._change_seq
+        if table == "Meals":
+            row["updated_at"] = updated_at or row.get("updated_at") or datetime.now(timezone.utc).isoformat()
+
+    def _tombstone(self, row):
+        self._change_seq += 1
+        self.tables["MealTombstones"].append({
+            "user_id": row.get("user_id"), "meal_id": row["id"], "client_id": row.get("client_id"),
+            "change_seq": self._change_seq, "deleted_at": datetime.now(timezone.utc).isoformat(),
+        })
+
+    def _select(self, table, params):
+        preds = []
+        for key, value in params:
+            if key == "or":
+                preds.append(_compile_logic("or", value[1:-1]))
+            elif key not in RESERVED_PARAMS:
+                preds.append(_compile_condition(key, value))
+        return [r for r in self.tables.setdefault(table, []) if all(p(r) for p in preds)]
+
+    @staticmethod
+    def _order(rows, order):
+        for term in reversed(order.split(",")):
+            column, _, direction = term.partition(".")
+            present = [r for r in rows if r.get(column) is not None]
+            missing = [r for r in rows if r.get(column) is None]
+            present.sort(key=lambda r: _coerce(r[column]), reverse=direction.startswith("desc"))
+            rows = present + missing
+        return rows
+
+    @staticmethod
+    def _project(rows, select):
+        if not select or select == "*":
+            return [dict(r) for r in rows]
+        columns = select.split(",")
+        return [{c: r.get(c) for c in columns} for r in rows]
+
+    def handle(self, method, path, params, body, prefer=""):
+        """Apply one request; returns (status, json-serializable body or None)."""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.request_count += 1
+            if not path.startswith("/rest/v1/"):
+                return 404, {"message": f"unknown path {path}"}
+            table = path[len("/rest/v1/"):]
+            query = dict(params)
+
+            if method == "GET":
+                rows = self._select(table, params)
+                if "order" in query:
+                    rows = self._order(rows, query["order"])
+                if "limit" in query:
+                    rows = rows[:int(query["limit"])]
+                return 200, self._project(rows, query.get("select"))
+
+            if method == "POST":
+                items = body if isinstance(body, list) else [body]
+                conflict = query.get("on_conflict")
+                out = []
+                for item in items:
+                    existing = None
+                    if conflict:
+                        keys = conflict.split(",")
+                        existing = next((r for r in self.tables.setdefault(table, [])
+                                         if all(str(r.get(k)) == str(item.get(k)) for k in keys)), None)
+                    if existing is not None:
+                        if "resolution=ignore-duplicates" in prefer:
+                            continue
+                        if table == "Meals":
+                            self._rollup((existing, -1), ({**existing, **item}, 1))
+                        existing.update(item)
+                        self._track_change(table, existing, item.get("updated_at") or datetime.now(timezone.utc).isoformat())
+                        out.append(dict(existing))
+                    else:
+                        out.append(dict(self._insert_row(table, dict(item))))
+                return 201, out
+
+            rows = self._select(table, params)
+            if method == "PATCH":
+                for row in rows:
+                    if table == "Meals":
+                        self._rollup((row, -1), ({**row, **(body or {})}, 1))
+                    row.update(body or {})
+                    self._track_change(table, row, (body or {}).get("updated_at") or datetime.now(timezone.utc).isoformat())
+                return 200, [dict(r) for r in rows]
+            if method == "DELETE":
+                remaining = self.tables[table]
+                doomed = {id(r) for r in rows}
+                self.tables[table] = [r for r in remaining if id(r) not in doomed]
+                if table == "Meals":
+                    for row in rows:
+                        self._tombstone(row)
+                        self._rollup((row, -1))
+                return 200, [dict(r) for r in rows]
+            return 405, {"message": f"unsupported method {method}"}
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Send headers and body in one segment; separate small writes on a
+            # keep-alive connection stall on delayed ACKs (~40 ms per request)
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                split = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                try:
+                    status, payload = fake.handle(self.command, split.path,
+                                                  parse_qsl(split.query, keep_blank_values=True), body,
+                                                  self.headers.get("Prefer") or "")
+                except Exception as e:
+                    status, payload = 400, {"message": str(e)}
+                data = json.dumps(payload, default=str).encode() if payload is not None else b""
+                self.send_response(status if data or status >= 400 else 204)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = do_DELETE = _dispatch
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every request")
+    args = parser.parse_args(argv)
+    fake = FakePostgrest(latency_ms=args.latency_ms, port=args.port)
+    print(f"fake PostgREST listening on {fake.url}")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Recompute every user's CalTracker daily totals from their Meals.
+
+Triggers on Meals keep CalTracker current (migration 0007, which also
+recomputed every day once), but days can still drift, e.g. after Meals was
+changed with the triggers disabled. This job rebuilds them all: users are
+found with a loose index scan over Meals and CalTracker, and a process pool
+recomputes them in parallel.
+Each worker streams one user's meals through the tools Lambda's keyset
+pagination (_iter_meals), sums them per calendar day in --timezone, and
+upserts only the days whose stored totals differ. Days with a CalTracker row
+but no meals left are set to zero.
+
+Users are processed in user_id order and the checkpoint file records the
+last one finished (plus any that failed), so an interrupted run picks up
+where it stopped. Progress lines report users, meal rows/sec and days
+written. Point it at any PostgREST endpoint: Supabase, PostgREST over a
+local Postgres, or bench/fake_postgrest.py.
+
+A meal changed while its user is being recomputed can leave that day off by
+that change until the next run.
+
+Usage:
+    python backfill_caltracker.py --db-url http://localhost:3000 --db-key KEY [--workers 4]
+        [--timezone UTC] [--since 2024-01-01] [--checkpoint backfill.json] [--dry-run]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'tools'))
+sys.path.insert(0, os.path.join(HERE, '..', 'shared'))
+
+import bulk_io  # noqa: E402
+import meal_tools  # noqa: E402
+
+MEAL_COLUMNS = "id, calories, protein, carbs, fat, created_at"
+TOTAL_COLUMNS = "day, calories, protein, carbs, fat"
+UPSERT_CHUNK_ROWS = 500
+LATEST = date(9999, 12, 30)
+# Totals that differ by less than this are left alone (NUMERIC vs float rounding)
+TOLERANCE = 1e-6
+
+# Set in each worker process by _init_worker
+_options = {}
+
+
+def _iter_user_ids(db, table, after=None):
+    """Yield the distinct user_ids in `table` in order, one indexed lookup each (a loose index scan)."""
+    while True:
+        query = db.table(table).select("user_id")
+        if after is not None:
+            query = query.gt("user_id", after)
+        rows = query.order("user_id").limit(1).execute().data or []
+        if not rows:
+            return
+        after = rows[0]["user_id"]
+        yield after
+
+
+def iter_users(db, after=None):
+    """Every user with meals or daily totals, in user_id order."""
+    meals = _iter_user_ids(db, "Meals", after)
+    totals = _iter_user_ids(db, "CalTracker", after)
+    next_meal, next_total = next(meals, None), next(totals, None)
+    while next_meal is not None or next_total is not None:
+        if next_total is None or (next_meal is not None and str(next_meal) < str(next_total)):
+            yield next_meal
+            next_meal = next(meals, None)
+        elif next_meal is None or str(next_total) < str(next_meal):
+            yield next_total
+            next_total = next(totals, None)
+        else:
+            yield next_meal
+            next_meal, next_total = next(meals, None), next(totals, None)
+
+
+def _init_worker(options):
+    _options.update(options)
+    _options["zone"] = ZoneInfo(options["timezone"])
+
+
+def _stored_totals(db, user_id, since):
+    """The user's CalTracker rows from `since` on, by day, read in keyset pages."""
+    stored = {}
+    after = None
+    while True:
+        # SECURITY: Filter by user_id; the job only ever touches one user's rows at a time
+        query = db.table("CalTracker").select(TOTAL_COLUMNS).eq("user_id", user_id).gte("day", since)
+        if after is not None:
+            query = query.gt("day", after)
+        page = query.order("day").limit(_options["page_size"]).execute().data or []
+        for row in page:
+            stored[str(row["day"])[:10]] = [meal_tools._as_number(row.get(f)) for f in meal_tools.MACRO_FIELDS]
+        if len(page) < _options["page_size"]:
+            return stored
+        after = page[-1]["day"]
+
+
+def recompute_user(user_id):
+    """Rebuild one user's daily totals; returns counts for the progress report."""
+    try:
+        zone, since = _options["zone"], date.fromisoformat(_options["since"])
+        start_ts = datetime(since.year, since.month, since.day, tzinfo=zone).isoformat()
+        _, end_ts = meal_tools._day_bounds(LATEST, LATEST)
+
+        totals = {}
+        first_meal_at = {}
+        meals = 0
+        for row in meal_tools._iter_meals(user_id, start_ts, end_ts, MEAL_COLUMNS, _options["page_size"]):
+            day = meal_tools._parse_timestamp(row["created_at"], "created_at").astimezone(zone).date().isoformat()
+            # Meals arrive oldest first; a day's row is dated by its first meal, like the triggers do
+            first_meal_at.setdefault(day, row["created_at"])
+            acc = totals.setdefault(day, [0.0] * len(meal_tools.MACRO_FIELDS))
+            for i, field in enumerate(meal_tools.MACRO_FIELDS):
+                acc[i] += meal_tools._as_number(row.get(field))
+            meals += 1
+
+        db = meal_tools.get_supabase()
+        stored = _stored_totals(db, user_id, since.isoformat())
+        zero = [0.0] * len(meal_tools.MACRO_FIELDS)
+        changed = []
+        for day in sorted(totals.keys() | stored.keys()):
+            new, old = totals.get(day, zero), stored.get(day)
+            if old is not None and all(abs(a - b) < TOLERANCE for a, b in zip(new, old)):
+                continue
+            created_at = first_meal_at.get(day)
+            if created_at is None:
+                d = date.fromisoformat(day)
+                created_at = datetime(d.year, d.month, d.day, tzinfo=zone).isoformat()
+            changed.append({"user_id": user_id, "day": day, "created_at": created_at,
+                            **{f: round(v, 6) for f, v in zip(meal_tools.MACRO_FIELDS, new)}})
+        if not _options["dry_run"]:
+            for chunk in bulk_io.chunked(changed, UPSERT_CHUNK_ROWS):
+                db.table("CalTracker").upsert(chunk, on_conflict="user_id,day").execute()
+        return {"user_id": user_id, "meals": meals, "days": len(totals), "written": len(changed)}
+    except Exception as e:
+        return {"user_id": user_id, "error": f"{type(e).__name__}: {str(e)}"}
+
+
+def _load_checkpoint(path, options):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    for key in ("timezone", "since", "dry_run"):
+        if checkpoint["options"].get(key) != options[key]:
+            raise SystemExit(f"{path} was written with {key}={checkpoint['options'].get(key)!r}; "
+                             f"rerun with the same {key} or another --checkpoint")
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db-url', default=os.environ.get('DB_API_URL'), help='PostgREST URL (default: $DB_API_URL)')
+    parser.add_argument('--db-key', default=os.environ.get('DB_API_KEY'), help='service role key (default: $DB_API_KEY)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--timezone', default='UTC', help="zone whose calendar days bucket meals; match the rollup triggers' (UTC)")
+    parser.add_argument('--since', default='1970-01-01', help='first day to recompute (YYYY-MM-DD)')
+    parser.add_argument('--page-size', type=int, default=1000, help='rows per keyset page')
+    parser.add_argument('--checkpoint', help='JSON file recording progress, resumed from if it exists')
+    parser.add_argument('--report-seconds', type=float, default=10.0, help='interval between progress lines')
+    parser.add_argument('--dry-run', action='store_true', help="count the days that would change but don't write")
+    args = parser.parse_args(argv)
+    if not args.db_url:
+        parser.error('--db-url or DB_API_URL is required')
+    ZoneInfo(args.timezone)
+    date.fromisoformat(args.since)
+
+    # Workers create their own client from these on first use
+    os.environ['DB_API_URL'], os.environ['DB_API_KEY'] = args.db_url, args.db_key or ''
+    options = {"timezone": args.timezone, "since": args.since, "page_size": args.page_size,
+               "dry_run": args.dry_run}
+    checkpoint = _load_checkpoint(args.checkpoint, options) or {
+        "options": options, "after_user": None, "failed": [],
+        "users": 0, "meals": 0, "days_written": 0, "seconds": 0.0,
+    }
+    retry = checkpoint["failed"]
+    checkpoint["failed"] = []
+    if checkpoint["after_user"] is not None or retry:
+        print(f"Resuming after user {checkpoint['after_user']} ({len(retry)} failed users to retry)")
+
+    db = meal_tools.get_supabase()
+
+    def users():
+        yield from retry
+        yield from iter_users(db, checkpoint["after_user"])
+
+    started = time.monotonic()
+    reported = started
+    earlier_seconds = checkpoint["seconds"]
+    run_meals = 0
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers, initializer=_init_worker, initargs=(options,)) as pool:
+        # imap keeps results in user order, so the checkpoint only moves past users that finished
+        for result in pool.imap(recompute_user, users()):
+            if "error" in result:
+                print(f"User {result['user_id']} failed: {result['error']}")
+                checkpoint["failed"].append(result["user_id"])
+            else:
+                checkpoint["users"] += 1
+                checkpoint["meals"] += result["meals"]
+                checkpoint["days_written"] += result["written"]
+                run_meals += result["meals"]
+            if result["user_id"] not in retry:
+                checkpoint["after_user"] = result["user_id"]
+
+            now = time.monotonic()
+            if now - reported >= args.report_seconds:
+                reported = now
+                checkpoint["seconds"] = earlier_seconds + now - started
+                _save_checkpoint(args.checkpoint, checkpoint)
+                print(f"{checkpoint['users']} users, {checkpoint['meals']} meals, "
+                      f"{run_meals / (now - started):.0f} rows/s, {checkpoint['days_written']} days written")
+
+    elapsed = time.monotonic() - started
+    checkpoint["seconds"] = earlier_seconds + elapsed
+    _save_checkpoint(args.checkpoint, checkpoint)
+    verb = "would change" if args.dry_run else "written"
+    print(f"Done: {checkpoint['users']} users, {checkpoint['meals']} meals in {checkpoint['seconds']:.1f} s "
+          f"({run_meals / elapsed if elapsed else 0:.0f} rows/s this run), {checkpoint['days_written']} days {verb}, "
+          f"{len(checkpoint['failed'])} users failed")
+    return 1 if checkpoint["failed"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Cold-start import profiler for the Lambda packages.
+
+Imports a handler module in a fresh interpreter with `-X importtime`, reports
+the most expensive top-level imports and exits non-zero when the total import
+time exceeds the budget, so deploy.sh can fail the build.
+
+Usage:
+    python import_budget.py --path build_lambda --module meal_tools --budget-ms 1500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+
+def _import_times(path: str, code: str):
+    """Run `code` with -X importtime and return [(depth, module, cumulative_us)]."""
+    env = dict(os.environ, PYTHONPATH=path)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=path, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{proc.stderr}")
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        # import time:       self [us] |  cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|', 2)
+        # nested imports are indented two spaces per level under their importer
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, name.strip(), int(cumulative)))
+    return entries
+
+
+def profile_import(path: str, module: str):
+    """Return (total_us, {module: cumulative_us}) for one cold import.
+
+    The breakdown lists the handler's direct imports, which is where the
+    cold-start cost of each dependency shows up.
+    """
+    # modules the interpreter loads at startup aren't part of the handler's cost
+    startup = {name for depth, name, _ in _import_times(path, 'pass') if depth == 0}
+    total = 0
+    breakdown = {}
+    children = {}
+    # importtime lists children before the package that imported them
+    for depth, name, us in _import_times(path, f'import {module}'):
+        if depth == 1:
+            children[name] = us
+        elif depth == 0:
+            if name == module:
+                breakdown.update(children)
+            elif name not in startup:
+                breakdown[name] = us
+            if name not in startup:
+                total += us
+            children = {}
+    return total, breakdown
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', required=True, help='directory containing the handler and its dependencies')
+    parser.add_argument('--module', required=True, help='handler module to import, e.g. meal_tools')
+    parser.add_argument('--budget-ms', type=float, required=True, help='maximum median import time')
+    parser.add_argument('--runs', type=int, default=3, help='cold imports to take the median of')
+    parser.add_argument('--top', type=int, default=10, help='number of top-level imports to report')
+    args = parser.parse_args(argv)
+
+    runs = [profile_import(args.path, args.module) for _ in range(args.runs)]
+    totals = [total for total, _ in runs]
+    median_ms = statistics.median(totals) / 1000
+    # report the breakdown from the run closest to the median
+    _, breakdown = min(runs, key=lambda r: abs(r[0] / 1000 - median_ms))
+
+    print(f"{args.module}: median cold import {median_ms:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    for name, us in sorted(breakdown.items(), key=lambda kv: kv[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    if median_ms > args.budget_ms:
+        print(f"FAIL: {args.module} import time exceeds budget by {median_ms - args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
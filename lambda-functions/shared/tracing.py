@@ -0,0 +1,142 @@
+"""Per-invocation latency tracing for the Lambdas.
+
+A handler starts a trace, code anywhere below it wraps work in
+`with tracing.span("name"):`, and the handler finishes the trace, which prints
+one compact CloudWatch Embedded Metric Format (EMF) record. CloudWatch turns
+each span's total into a metric (dimensions: Service, Operation) so p50/p99
+per stage can be graphed without log queries. Spans with the same name are
+summed, with a count, e.g. several database calls in one invocation; for
+calls made concurrently that sum can exceed the wall time.
+
+Whole request/response payloads are only logged for a sampled fraction of
+invocations (LOG_PAYLOAD_SAMPLE_RATE, default 0 = never).
+
+`count(name, value)` adds a Count metric alongside the timings, e.g. a 0/1
+outcome per invocation whose CloudWatch average is a hit rate.
+
+deploy.sh copies this module into both Lambda packages.
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('TRACE_NAMESPACE', 'CalTracker')
+PAYLOAD_SAMPLE_RATE = float(os.environ.get('LOG_PAYLOAD_SAMPLE_RATE', '0') or 0)
+
+_current = None
+_cold_start = True
+
+
+class Trace:
+    def __init__(self, service, operation):
+        global _cold_start
+        self.service = service
+        self.operation = operation or 'unknown'
+        self.started = time.perf_counter()
+        self.spans = {}  # name -> [count, total_ms]
+        # Spans can be recorded from worker threads, e.g. concurrent database calls
+        self._lock = threading.Lock()
+        self.counts = {}  # name -> summed value
+        self.properties = {'cold_start': _cold_start}
+        _cold_start = False
+
+    def record(self, name, ms):
+        with self._lock:
+            entry = self.spans.get(name)
+            if entry is None:
+                self.spans[name] = [1, ms]
+            else:
+                entry[0] += 1
+                entry[1] += ms
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def set(self, key, value):
+        self.properties[key] = value
+
+    def to_emf(self, status):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        metrics = {f'{name}_ms': round(ms, 3) for name, (_, ms) in self.spans.items()}
+        metrics['total_ms'] = round(total_ms, 3)
+        record = {
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': NAMESPACE,
+                    'Dimensions': [['Service', 'Operation']],
+                    'Metrics': [{'Name': name, 'Unit': 'Milliseconds'} for name in metrics]
+                    + [{'Name': name, 'Unit': 'Count'} for name in self.counts],
+                }],
+            },
+            'Service': self.service,
+            'Operation': self.operation,
+            'status': status,
+            'span_counts': {name: count for name, (count, _) in self.spans.items()},
+        }
+        record.update(metrics)
+        record.update(self.counts)
+        record.update(self.properties)
+        return record
+
+
+def start(service, operation=None):
+    """Begin the trace for this invocation (replacing any unfinished one)."""
+    global _current
+    _current = Trace(service, operation)
+    return _current
+
+
+def current():
+    return _current
+
+
+def set_operation(operation):
+    if _current is not None:
+        _current.operation = operation or 'unknown'
+
+
+def set_property(key, value):
+    if _current is not None:
+        _current.set(key, value)
+
+
+def record(name, ms):
+    if _current is not None:
+        _current.record(name, ms)
+
+
+def count(name, value=1):
+    if _current is not None:
+        _current.count(name, value)
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block into the current trace; a no-op outside a trace."""
+    if _current is None:
+        yield
+        return
+    trace = _current
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.record(name, (time.perf_counter() - started) * 1000)
+
+
+def finish(status=None):
+    """Emit the current trace as one EMF log line and clear it."""
+    global _current
+    trace, _current = _current, None
+    if trace is not None:
+        print(json.dumps(trace.to_emf(status), separators=(',', ':'), default=str))
+
+
+def log_payload(label, payload):
+    """Log a payload for a sampled fraction of invocations (never by default)."""
+    if PAYLOAD_SAMPLE_RATE > 0 and random.random() < PAYLOAD_SAMPLE_RATE:
+        print(json.dumps({'payload': label, 'data': payload}, separators=(',', ':'), default=str))
@@ -0,0 +1,38 @@
+"""Shared fixtures for the Lambda unit tests.
+
+The tools and agent Lambda modules are imported from their source folders, as
+bench/ does, and database calls go to bench/fake_postgrest.py, so the tests
+need the tools Lambda's requirements but no network or AWS account.
+"""
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+for folder in ("tools", "shared", "bench", "agent-lambda"):
+    sys.path.insert(0, os.path.join(HERE, "..", folder))
+
+from fake_postgrest import FakePostgrest  # noqa: E402
+
+USER = "test-user"
+OTHER_USER = "other-user"
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """A fresh fake PostgREST, with meal_tools pointed at it and its warm caches emptied."""
+    import meal_tools
+
+    fake = FakePostgrest().start()
+    monkeypatch.setenv("DB_API_URL", fake.url)
+    monkeypatch.setenv("DB_API_KEY", "test")
+    monkeypatch.setattr(meal_tools, "_supabase", None)
+    for cache in (meal_tools._response_cache, meal_tools._meal_indexes, meal_tools._food_catalogs,
+                  meal_tools._state_versions):
+        cache.clear()
+    yield fake
+    if meal_tools._supabase is not None:
+        meal_tools._supabase.close()
+        meal_tools._supabase = None
+    fake.stop()
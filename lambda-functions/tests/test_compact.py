@@ -0,0 +1,100 @@
+"""Compact encoding and the byte budget list tools page within."""
+import json
+
+import pytest
+
+import compact
+import meal_tools
+from conftest import USER
+
+DAY = "2024-05-01"
+
+
+def _render_items(items):
+    return lambda k: compact.dumps({"rows": items[:k], **({"next": k} if k < len(items) else {})})
+
+
+@pytest.mark.parametrize("budget", [40, 100, 333, 1000, 10_000])
+def test_fit_returns_the_largest_prefix_within_budget(budget):
+    items = ["x" * (i % 7 + 1) for i in range(200)]
+    render = _render_items(items)
+    k, text = compact.fit(len(items), render, budget)
+    assert text == render(k)
+    assert len(text.encode()) <= budget or k == 1
+    if k < len(items):
+        assert len(render(k + 1).encode()) > budget
+
+
+def test_fit_counts_bytes_not_characters():
+    items = ["é" * 10] * 20
+    k, text = compact.fit(len(items), _render_items(items), 120)
+    assert len(text.encode()) <= 120 < len(_render_items(items)(k + 1).encode())
+    assert len(text) < len(text.encode())
+
+
+def test_fit_always_returns_one_record():
+    items = ["x" * 500] * 3
+    k, text = compact.fit(len(items), _render_items(items), 100)
+    assert k == 1 and text == _render_items(items)(1)
+    assert compact.fit(1, _render_items(items), 10) == (1, _render_items(items)(1))
+
+
+def test_fit_keeps_everything_when_it_fits():
+    items = ["a", "b"]
+    assert compact.fit(2, _render_items(items), 1000) == (2, _render_items(items)(2))
+
+
+@pytest.mark.parametrize("requested, expected", [
+    (None, compact.RESPONSE_MAX_BYTES), ("", compact.RESPONSE_MAX_BYTES), ("abc", compact.RESPONSE_MAX_BYTES),
+    (1, compact.MIN_MAX_BYTES), ("500", 500), (10 ** 9, compact.RESPONSE_MAX_BYTES),
+])
+def test_max_bytes_is_clamped(requested, expected):
+    assert compact.max_bytes({"max_bytes": requested}) == expected
+
+
+def _seed(fake_db, count):
+    fake_db.seed("Meals", [
+        {"user_id": USER, "meal_name": f"Meal with a fairly long name {i}", "calories": 100 + i,
+         "protein": 1.5, "carbs": 2, "fat": 3, "created_at": f"{DAY}T{8 + i // 10:02d}:{i % 60:02d}:00+00:00"}
+        for i in range(count)
+    ])
+    return [row["id"] for row in fake_db.tables["Meals"]]
+
+
+@pytest.mark.parametrize("fmt", ["text", "compact"])
+def test_get_meals_pages_within_the_budget(fake_db, fmt):
+    ids = _seed(fake_db, 60)
+    budget = 600
+    seen, cursor, calls = [], None, 0
+    while True:
+        calls += 1
+        params = {"start_date": DAY, "limit": 50, "format": fmt, "max_bytes": budget,
+                  **({"cursor": cursor} if cursor else {})}
+        text = meal_tools.get_meals(params, USER)
+        assert len(text.encode()) <= budget
+        if fmt == "compact":
+            body = json.loads(text)
+            seen += [row[body["cols"].index("id")] for row in body["rows"]]
+            cursor = body.get("next", {}).get("cursor")
+        else:
+            lines = [line for line in text.splitlines() if line.startswith("ID: ")]
+            seen += [int(line.split()[1].rstrip(",")) for line in lines]
+            cursor = text.rsplit("cursor=", 1)[1].strip() if "cursor=" in text else None
+        if cursor is None:
+            break
+    assert seen == ids
+    assert calls > 1
+
+
+def test_get_daily_totals_pages_within_the_budget(fake_db):
+    fake_db.seed("Meals", [{"user_id": USER, "meal_name": "Oats", "calories": 300 + i,
+                            "created_at": f"2024-05-{i + 1:02d}T08:00:00+00:00"} for i in range(31)])
+    days, start = [], "2024-05-01"
+    while start:
+        text = meal_tools.get_daily_totals({"start_date": start, "end_date": "2024-05-31", "format": "compact",
+                                            "max_bytes": 300}, USER)
+        assert len(text.encode()) <= 300
+        body = json.loads(text)
+        days += [row[0] for row in body["rows"]]
+        start = body.get("next", {}).get("start_date")
+    assert days == [f"2024-05-{i + 1:02d}" for i in range(31)]
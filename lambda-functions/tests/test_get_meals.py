@@ -0,0 +1,71 @@
+"""Keyset pagination of getMeals: the `created_at|id` cursor and walking pages with it."""
+import json
+import re
+
+import pytest
+
+import meal_tools
+from conftest import OTHER_USER, USER
+
+DAY = "2024-05-01"
+
+
+def _seed(fake_db, count, user_id=USER):
+    # Three meals per timestamp, so pages break inside runs of equal created_at
+    fake_db.seed("Meals", [
+        {"user_id": user_id, "meal_name": f"Meal {i}", "calories": 100 + i, "protein": 1, "carbs": 2, "fat": 3,
+         "created_at": f"{DAY}T{8 + i // 3:02d}:00:00+00:00"}
+        for i in range(count)
+    ])
+    return [row["id"] for row in fake_db.tables["Meals"] if row["user_id"] == user_id]
+
+
+def test_cursor_round_trip():
+    row = {"created_at": "2024-05-01T08:30:00.123456+00:00", "id": 42}
+    assert meal_tools._decode_cursor(meal_tools._encode_cursor(row)) == (row["created_at"], 42)
+
+
+def test_cursor_timestamp_is_normalized_to_utc():
+    assert meal_tools._decode_cursor("2024-05-01T10:30:00+02:00|7") == ("2024-05-01T08:30:00+00:00", 7)
+    assert meal_tools._decode_cursor("2024-05-01T08:30:00Z|7") == ("2024-05-01T08:30:00+00:00", 7)
+
+
+@pytest.mark.parametrize("cursor", [
+    "42", "2024-05-01T08:30:00+00:00|", "2024-05-01T08:30:00+00:00|abc", "2024-05-01T08:30:00+00:00|٤٢",
+    'x",id.gt.0|1', "not-a-time|1",
+])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        meal_tools._decode_cursor(cursor)
+
+
+def test_text_pages_walk_every_meal_once(fake_db):
+    ids = _seed(fake_db, 10)
+    _seed(fake_db, 3, OTHER_USER)
+    seen, cursor = [], None
+    for _ in range(10):
+        params = {"start_date": DAY, "limit": 4, **({"cursor": cursor} if cursor else {})}
+        text = meal_tools.get_meals(params, USER)
+        seen += [int(i) for i in re.findall(r"^ID: (\d+)", text, re.MULTILINE)]
+        match = re.search(r"cursor=(\S+)", text)
+        if match is None:
+            break
+        cursor = match.group(1)
+    assert seen == ids
+
+
+def test_compact_pages_walk_every_meal_once(fake_db):
+    ids = _seed(fake_db, 7)
+    seen, cursor = [], None
+    for _ in range(10):
+        params = {"start_date": DAY, "limit": 3, "format": "compact", **({"cursor": cursor} if cursor else {})}
+        body = json.loads(meal_tools.get_meals(params, USER))
+        seen += [row[body["cols"].index("id")] for row in body["rows"]]
+        if "next" not in body:
+            break
+        cursor = body["next"]["cursor"]
+    assert seen == ids
+
+
+def test_invalid_cursor_is_reported(fake_db):
+    assert meal_tools.get_meals({"start_date": DAY, "cursor": "nope"}, USER).startswith("Invalid parameters")
@@ -0,0 +1,145 @@
+"""Idempotency replay in request_guard, per container and through DynamoDB."""
+import threading
+import time
+
+import pytest
+
+import agent
+import request_guard
+
+SESSION = "session-1"
+
+
+class FakeDynamoDB:
+    """The put/get/delete subset request_guard uses, with its one condition expression."""
+
+    class exceptions:
+        class ConditionalCheckFailedException(Exception):
+            pass
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        existing = self.items.get(Item['pk']['S'])
+        if ConditionExpression is not None and existing is not None:
+            assert ConditionExpression == 'attribute_not_exists(pk) OR expires_at < :now'
+            if not int(existing['expires_at']['N']) < int(ExpressionAttributeValues[':now']['N']):
+                raise self.exceptions.ConditionalCheckFailedException()
+        self.items[Item['pk']['S']] = dict(Item)
+
+    def get_item(self, TableName, Key, ConsistentRead=False):
+        item = self.items.get(Key['pk']['S'])
+        return {'Item': dict(item)} if item is not None else {}
+
+    def delete_item(self, TableName, Key):
+        self.items.pop(Key['pk']['S'], None)
+
+
+@pytest.fixture(params=["local", "dynamodb"])
+def guard(request, monkeypatch):
+    monkeypatch.setattr(request_guard, 'DUPLICATE_WAIT_SECONDS', 0.5)
+    monkeypatch.setattr(request_guard, 'DUPLICATE_POLL_SECONDS', 0.01)
+    monkeypatch.setattr(request_guard, 'RATE_LIMIT_PER_MINUTE', 0)
+    monkeypatch.setattr(request_guard, '_records', request_guard.OrderedDict())
+    if request.param == "dynamodb":
+        monkeypatch.setattr(request_guard, 'IDEMPOTENCY_TABLE', 'idempotency')
+        monkeypatch.setattr(request_guard, '_dynamodb', FakeDynamoDB())
+    else:
+        monkeypatch.setattr(request_guard, 'IDEMPOTENCY_TABLE', '')
+    return request_guard
+
+
+def test_request_key_depends_on_session_message_and_request_id():
+    key = request_guard.request_key(SESSION, "log oats", "r1")
+    assert key == request_guard.request_key(SESSION, "log oats", "r1")
+    assert len({key, request_guard.request_key("session-2", "log oats", "r1"),
+                request_guard.request_key(SESSION, "log rice", "r1"),
+                request_guard.request_key(SESSION, "log oats", "r2"),
+                request_guard.request_key(SESSION, "log oats")}) == 5
+
+
+def test_completed_turn_is_replayed(guard):
+    key = guard.request_key(SESSION, "log oats", "r1")
+    assert guard.claim(key, "u1") == ('new', None)
+    guard.complete(key, "u1", "Logged oats", ttl=60)
+    assert guard.claim(key, "u1") == ('done', "Logged oats")
+    assert guard.claim(key, "u1") == ('done', "Logged oats")
+
+
+def test_duplicate_waits_for_the_running_turn(guard):
+    key = guard.request_key(SESSION, "log oats", "r1")
+    assert guard.claim(key, "u1") == ('new', None)
+    timer = threading.Timer(0.05, guard.complete, (key, "u1", "Logged oats", 60))
+    timer.start()
+    try:
+        assert guard.claim(key, "u1") == ('done', "Logged oats")
+    finally:
+        timer.cancel()
+
+
+def test_duplicate_of_a_stuck_turn_is_busy(guard):
+    key = guard.request_key(SESSION, "log oats", "r1")
+    assert guard.claim(key, "u1") == ('new', None)
+    assert guard.claim(key, "u1") == ('busy', None)
+
+
+def test_released_turn_runs_again(guard):
+    key = guard.request_key(SESSION, "log oats", "r1")
+    assert guard.claim(key, "u1") == ('new', None)
+    guard.release(key)
+    assert guard.claim(key, "u1") == ('new', None)
+
+
+def test_expired_reply_is_not_replayed(guard, monkeypatch):
+    key = guard.request_key(SESSION, "log oats")
+    assert guard.claim(key, "u1") == ('new', None)
+    guard.complete(key, "u1", "Logged oats", ttl=guard.DOUBLE_SUBMIT_SECONDS)
+    later = time.time() + guard.DOUBLE_SUBMIT_SECONDS + 1
+    monkeypatch.setattr(request_guard.time, 'time', lambda: later)
+    assert guard.claim(key, "u1") == ('new', None)
+
+
+def test_claim_fails_open_when_dynamodb_fails(monkeypatch):
+    class Broken(FakeDynamoDB):
+        def put_item(self, **kwargs):
+            raise RuntimeError("throttled")
+
+    monkeypatch.setattr(request_guard, 'IDEMPOTENCY_TABLE', 'idempotency')
+    monkeypatch.setattr(request_guard, '_dynamodb', Broken())
+    assert request_guard.claim("key", "u1") == ('new', None)
+
+
+def test_chat_turn_is_answered_once(guard, monkeypatch):
+    calls = []
+
+    def answer_chat(invoke_kwargs, on_delta=None):
+        calls.append(invoke_kwargs['inputText'])
+        return f"Logged {invoke_kwargs['inputText']}"
+
+    monkeypatch.setattr(agent, 'answer_chat', answer_chat)
+    body = {'request_id': 'r1'}
+    invoke_kwargs = {'sessionId': SESSION, 'inputText': 'oats',
+                     'sessionState': {'sessionAttributes': {'user_id': 'u1'}}}
+
+    error, reply, key = agent.admit_chat_turn(body, invoke_kwargs)
+    assert (error, reply) == (None, None)
+    assert agent.run_chat_turn(body, invoke_kwargs, key) == "Logged oats"
+
+    error, reply, _ = agent.admit_chat_turn(body, invoke_kwargs)
+    assert (error, reply) == (None, "Logged oats")
+    assert calls == ['oats']
+
+
+def test_failed_chat_turn_is_released(guard, monkeypatch):
+    def answer_chat(invoke_kwargs, on_delta=None):
+        raise RuntimeError("agent unavailable")
+
+    monkeypatch.setattr(agent, 'answer_chat', answer_chat)
+    body = {'request_id': 'r1'}
+    invoke_kwargs = {'sessionId': SESSION, 'inputText': 'oats',
+                     'sessionState': {'sessionAttributes': {'user_id': 'u1'}}}
+    _, _, key = agent.admit_chat_turn(body, invoke_kwargs)
+    with pytest.raises(RuntimeError):
+        agent.run_chat_turn(body, invoke_kwargs, key)
+    assert agent.admit_chat_turn(body, invoke_kwargs) == (None, None, key)
@@ -0,0 +1,130 @@
+"""The CalTracker rollup under meal inserts, edits and deletes.
+
+The first tests drive the tools through bench/fake_postgrest.py, which
+emulates the rollup triggers. The last one runs the real triggers
+(migration 0007) and is skipped unless TEST_DATABASE_URL names a scratch
+Postgres database, which it migrates and truncates.
+"""
+import os
+import sys
+from collections import defaultdict
+
+import pytest
+
+import meal_tools
+from conftest import OTHER_USER, USER
+
+MIGRATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "database")
+
+
+def _expected_totals(meals):
+    totals = defaultdict(lambda: [0.0] * len(meal_tools.MACRO_FIELDS))
+    for meal in meals:
+        day = meal_tools._parse_timestamp(meal["created_at"], "created_at").date().isoformat()
+        for i, field in enumerate(meal_tools.MACRO_FIELDS):
+            totals[(str(meal["user_id"]), day)][i] += float(meal.get(field) or 0)
+    return totals
+
+
+def _assert_rollup_matches(meals, rows):
+    expected = _expected_totals(meals)
+    stored = {(str(r["user_id"]), str(r["day"])): [float(r[f] or 0) for f in meal_tools.MACRO_FIELDS] for r in rows}
+    # Days whose meals are all gone keep a row of zeros
+    for key, values in stored.items():
+        assert values == pytest.approx(expected.get(key, [0.0] * len(values))), key
+    assert expected.keys() <= stored.keys()
+
+
+def test_add_modify_delete_keep_totals(fake_db):
+    fake_db.seed("Meals", [{"user_id": OTHER_USER, "meal_name": "Toast", "calories": 80}])
+    meal_tools.add_meal({"meal_name": "Oats", "calories": 300, "protein": 10, "carbs": 50, "fat": 5}, USER)
+    meal_tools.add_meal({"meal_name": "Egg", "calories": 70, "protein": 6}, USER)
+    _assert_rollup_matches(fake_db.tables["Meals"], fake_db.tables["CalTracker"])
+
+    oats = next(m for m in fake_db.tables["Meals"] if m["meal_name"] == "Oats")
+    meal_tools.modify_meal({"meal_id": oats["id"], "calories": 350, "fat": 7}, USER)
+    _assert_rollup_matches(fake_db.tables["Meals"], fake_db.tables["CalTracker"])
+
+    meal_tools.delete_meal({"meal_id": oats["id"]}, USER)
+    _assert_rollup_matches(fake_db.tables["Meals"], fake_db.tables["CalTracker"])
+
+
+def test_rename_leaves_the_day_alone(fake_db):
+    meal_tools.add_meal({"meal_name": "Oats", "calories": 300}, USER)
+    row = fake_db.tables["CalTracker"][0]
+    change_seq = row["change_seq"]
+    oats = fake_db.tables["Meals"][0]
+    meal_tools.modify_meal({"meal_id": oats["id"], "name": "Porridge"}, USER)
+    assert row["change_seq"] == change_seq
+
+
+def test_batch_touching_several_days(fake_db):
+    result = meal_tools.import_meals({"data": "meal_name,calories,protein,created_at\n"
+                                              "Rice,200,4,2024-05-01T12:00:00Z\n"
+                                              "Fish,250,30,2024-05-01T19:00:00Z\n"
+                                              "Soup,150,5,2024-05-02T08:00:00Z\n"}, USER)
+    assert result["imported"] == 3
+    _assert_rollup_matches(fake_db.tables["Meals"], fake_db.tables["CalTracker"])
+    # A new day's row is dated by its first meal, not by when it was written
+    first_day = next(r for r in fake_db.tables["CalTracker"] if r["day"] == "2024-05-01")
+    assert first_day["created_at"].startswith("2024-05-01T12:00")
+
+    ids = [m["id"] for m in fake_db.tables["Meals"]]
+    meal_tools.batch_meals({"operations": [{"op": "delete", "meal_id": ids[0]},
+                                           {"op": "modify", "meal_id": ids[2], "calories": 175}]}, USER)
+    _assert_rollup_matches(fake_db.tables["Meals"], fake_db.tables["CalTracker"])
+
+
+@pytest.fixture
+def postgres():
+    dsn = os.environ.get("TEST_DATABASE_URL")
+    if not dsn:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    psycopg = pytest.importorskip("psycopg")
+    sys.path.insert(0, MIGRATE_DIR)
+    import migrate
+
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        # Supabase provides auth.users; a plain local Postgres needs a stand-in for the foreign keys
+        conn.execute("CREATE SCHEMA IF NOT EXISTS auth")
+        conn.execute("CREATE TABLE IF NOT EXISTS auth.users (id UUID PRIMARY KEY)")
+    migrate.apply(dsn)
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("TRUNCATE Meals, CalTracker, MealTombstones")
+        conn.execute("INSERT INTO auth.users (id) VALUES (md5('test-user')::uuid), (md5('other-user')::uuid) "
+                     "ON CONFLICT DO NOTHING")
+        yield conn
+
+
+def test_triggers_under_insert_update_and_delete(postgres):
+    def check():
+        meals = [dict(zip(("user_id", "created_at") + meal_tools.MACRO_FIELDS, row)) for row in postgres.execute(
+            "SELECT user_id, created_at, calories, protein, carbs, fat FROM Meals").fetchall()]
+        for meal in meals:
+            meal["created_at"] = meal["created_at"].isoformat()
+        rows = [dict(zip(("user_id", "day", "created_at") + meal_tools.MACRO_FIELDS, row)) for row in postgres.execute(
+            "SELECT user_id, day, created_at, calories, protein, carbs, fat FROM CalTracker").fetchall()]
+        _assert_rollup_matches(meals, rows)
+        for row in rows:
+            assert row["created_at"].astimezone(meal_tools.timezone.utc).date() == row["day"]
+
+    # One statement across users and days
+    postgres.execute("""
+        INSERT INTO Meals (user_id, meal_name, calories, protein, carbs, fat, created_at) VALUES
+          (md5('test-user')::uuid, 'Oats', 300, 10, 50, 5, '2024-05-01T08:00:00Z'),
+          (md5('test-user')::uuid, 'Rice', 200, 4, NULL, NULL, '2024-05-01T12:00:00Z'),
+          (md5('test-user')::uuid, 'Soup', 150, 5, 20, 3, '2024-05-02T19:00:00Z'),
+          (md5('other-user')::uuid, 'Toast', 80, 3, 15, 1, '2024-05-01T09:00:00Z')""")
+    check()
+
+    postgres.execute("UPDATE Meals SET calories = calories + 50, fat = 9 WHERE meal_name IN ('Oats', 'Soup')")
+    check()
+    # Moving a meal to another day takes it off the old day and onto the new one
+    postgres.execute("UPDATE Meals SET created_at = '2024-05-03T07:00:00Z' WHERE meal_name = 'Rice'")
+    check()
+    seq = postgres.execute("SELECT change_seq FROM CalTracker WHERE day = '2024-05-02'").fetchone()[0]
+    postgres.execute("UPDATE Meals SET meal_name = 'Broth' WHERE meal_name = 'Soup'")
+    assert postgres.execute("SELECT change_seq FROM CalTracker WHERE day = '2024-05-02'").fetchone()[0] == seq
+
+    postgres.execute("DELETE FROM Meals WHERE meal_name IN ('Oats', 'Broth')")
+    check()
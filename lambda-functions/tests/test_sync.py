@@ -0,0 +1,107 @@
+"""syncMeals: replaying offline writes, tombstones and the change_seq delta."""
+import uuid
+
+import meal_tools
+from conftest import OTHER_USER, USER
+
+
+def _sync(operations=(), cursor=0, limit=None):
+    params = {"operations": list(operations), "cursor": cursor}
+    if limit is not None:
+        params["limit"] = limit
+    return meal_tools.sync_meals(params, USER)
+
+
+def _add(client_id, name="Oats", calories=300, ts="2024-05-01T08:00:00Z"):
+    return {"op": "add", "client_id": client_id, "client_ts": ts, "meal_name": name, "calories": calories}
+
+
+def test_replayed_add_is_not_inserted_twice(fake_db):
+    client_id = str(uuid.uuid4())
+    first = _sync([_add(client_id)])
+    assert [r["status"] for r in first["results"]] == ["applied"]
+    again = _sync([_add(client_id)], cursor=first["cursor"])
+    assert [r["status"] for r in again["results"]] == ["duplicate"]
+    assert len(fake_db.tables["Meals"]) == 1
+    assert again["changes"] == [] and again["deleted"] == []
+
+
+def test_delta_follows_change_seq(fake_db):
+    ids = [str(uuid.uuid4()) for _ in range(3)]
+    start = _sync()
+    assert start["cursor"] == "0" and start["changes"] == []
+
+    _sync([_add(cid, f"Meal {i}") for i, cid in enumerate(ids)])
+    fake_db.seed("Meals", [{"user_id": OTHER_USER, "meal_name": "Not mine", "calories": 1}])
+    delta = _sync(cursor=0)
+    assert [row["client_id"] for row in delta["changes"]] == ids
+    seqs = [row["change_seq"] for row in delta["changes"]]
+    assert seqs == sorted(seqs) and delta["cursor"] == str(seqs[-1])
+
+    # Only the modified meal comes back after the cursor, with its new change_seq
+    _sync([{"op": "modify", "client_id": ids[0], "client_ts": "2024-05-01T09:00:00Z", "calories": 320}])
+    later = _sync(cursor=delta["cursor"])
+    assert [(row["client_id"], row["calories"]) for row in later["changes"]] == [(ids[0], 320)]
+    assert int(later["changes"][0]["change_seq"]) > int(delta["cursor"])
+    assert _sync(cursor=later["cursor"])["changes"] == []
+
+
+def test_delete_leaves_a_tombstone_in_the_delta(fake_db):
+    ids = [str(uuid.uuid4()) for _ in range(2)]
+    added = _sync([_add(cid) for cid in ids])
+    meal_id = next(r["meal_id"] for r in added["results"] if r["client_id"] == ids[0])
+
+    removed = _sync([{"op": "delete", "client_id": ids[0], "client_ts": "2024-05-01T10:00:00Z"}],
+                    cursor=added["cursor"])
+    assert [r["status"] for r in removed["results"]] == ["applied"]
+    assert removed["changes"] == []
+    assert removed["deleted"] == [{"id": meal_id, "client_id": ids[0]}]
+    assert [t["meal_id"] for t in fake_db.tables["MealTombstones"]] == [meal_id]
+
+    # A device that syncs from scratch never sees the deleted meal
+    full = _sync()
+    assert [row["client_id"] for row in full["changes"]] == [ids[1]]
+    assert meal_id in [d["id"] for d in full["deleted"]]
+
+
+def test_writes_to_a_deleted_meal_are_reported(fake_db):
+    client_id = str(uuid.uuid4())
+    _sync([_add(client_id)])
+    _sync([{"op": "delete", "client_id": client_id, "client_ts": "2024-05-01T10:00:00Z"}])
+
+    # Another device still queued an edit, and replays its add, for the meal
+    late = _sync([{"op": "modify", "client_id": client_id, "client_ts": "2024-05-01T11:00:00Z", "calories": 1},
+                  _add(client_id, ts="2024-05-01T12:00:00Z")])
+    assert {r["status"] for r in late["results"]} == {"deleted"}
+    assert fake_db.tables["Meals"] == []
+    # Deleting it again is a no-op
+    again = _sync([{"op": "delete", "client_id": client_id}])
+    assert [r["status"] for r in again["results"]] == ["applied"]
+    assert len(fake_db.tables["MealTombstones"]) == 1
+
+
+def test_delta_pages_across_changes_and_tombstones(fake_db):
+    ids = [str(uuid.uuid4()) for _ in range(5)]
+    _sync([_add(cid, f"Meal {i}") for i, cid in enumerate(ids)])
+    _sync([{"op": "delete", "client_id": cid, "client_ts": "2024-05-01T10:00:00Z"} for cid in ids[:2]])
+
+    seen_changes, seen_deleted, cursor = [], [], 0
+    for _ in range(10):
+        page = _sync(cursor=cursor, limit=2)
+        assert len(page["changes"]) + len(page["deleted"]) <= 2
+        seen_changes += [row["client_id"] for row in page["changes"]]
+        seen_deleted += [d["client_id"] for d in page["deleted"]]
+        cursor = page["cursor"]
+        if not page["has_more"]:
+            break
+    assert seen_changes == ids[2:]
+    assert seen_deleted == ids[:2]
+
+
+def test_stale_write_loses_to_newer_server_change(fake_db):
+    client_id = str(uuid.uuid4())
+    _sync([_add(client_id, ts="2024-05-01T08:00:00Z")])
+    _sync([{"op": "modify", "client_id": client_id, "client_ts": "2024-05-01T12:00:00Z", "calories": 400}])
+    stale = _sync([{"op": "modify", "client_id": client_id, "client_ts": "2024-05-01T09:00:00Z", "calories": 100}])
+    assert [r["status"] for r in stale["results"]] == ["conflict"]
+    assert fake_db.tables["Meals"][0]["calories"] == 400
@@ -0,0 +1,148 @@
+"""Streaming CSV/NDJSON reading and writing for bulk meal import and export.
+
+Everything here works on iterators, so a file is never held in memory whole:
+`decode_lines` turns a stream of byte chunks into text lines, `read_csv` /
+`read_ndjson` turn lines into rows, `chunked` groups rows for batched
+inserts, and `write_csv` / `write_ndjson` turn rows back into text lines.
+meal_tools wires them to S3 and the database (import_meals / export_meals).
+"""
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+
+FORMATS = ("csv", "ndjson")
+# Header names other trackers' exports use for our columns
+COLUMN_ALIASES = {
+    "name": "meal_name", "meal": "meal_name", "food": "meal_name", "item": "meal_name",
+    "kcal": "calories", "cal": "calories", "energy": "calories",
+    "protein_g": "protein", "carbs_g": "carbs", "carbohydrates": "carbs", "carbohydrate": "carbs",
+    "fat_g": "fat", "total_fat": "fat",
+    "date": "created_at", "time": "created_at", "timestamp": "created_at", "logged_at": "created_at",
+}
+
+
+def format_for(name, requested=None):
+    """The file format: `requested` if given, else from the file extension (csv by default)."""
+    fmt = str(requested or "").strip().lower()
+    if fmt in ("json", "jsonl"):
+        fmt = "ndjson"
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Invalid format '{requested}', expected csv or ndjson")
+        return fmt
+    return "ndjson" if str(name or "").lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+
+def normalize_column(name):
+    key = str(name or "").strip().lower().replace(" ", "_").replace("-", "_")
+    return COLUMN_ALIASES.get(key, key)
+
+
+def decode_lines(chunks, encoding="utf-8-sig"):
+    """Yield the text lines (with their newline) of a stream of byte chunks.
+
+    Lines are split on "\\n" only, so "\\r\\n" endings and newlines inside
+    quoted CSV fields are left for the csv module to handle.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    for chunk in chunks:
+        text = pending + decoder.decode(chunk)
+        start = 0
+        while True:
+            end = text.find("\n", start)
+            if end < 0:
+                break
+            yield text[start:end + 1]
+            start = end + 1
+        pending = text[start:]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def read_csv(lines):
+    """Yield (line_number, row, error) for each record of a CSV file with a header row.
+
+    Header names are matched to meal columns case-insensitively, through
+    COLUMN_ALIASES. `error` is set (and `row` None) for a record that can't be read.
+    """
+    reader = csv.reader(lines)
+    try:
+        header = [normalize_column(name) for name in next(reader)]
+    except StopIteration:
+        return
+    while True:
+        try:
+            values = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            yield reader.line_num, None, f"Unreadable CSV: {str(e)}"
+            continue
+        if not any(v.strip() for v in values):
+            continue
+        if len(values) > len(header):
+            yield reader.line_num, None, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        yield reader.line_num, dict(zip(header, values)), None
+
+
+def read_ndjson(lines):
+    """Yield (line_number, row, error) for each JSON object line of an NDJSON file."""
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, "Expected a JSON object"
+            continue
+        yield line_number, {normalize_column(k): v for k, v in row.items()}, None
+
+
+def read_rows(lines, fmt):
+    return read_ndjson(lines) if fmt == "ndjson" else read_csv(lines)
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` consecutive items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_csv(rows, fields, header=True):
+    """Yield a header line (unless `header` is false) and then one CSV line per row (a dict), in `fields` order."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def line(values):
+        writer.writerow(values)
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    if header:
+        yield line(fields)
+    for row in rows:
+        yield line(["" if row.get(f) is None else row.get(f) for f in fields])
+
+
+def write_ndjson(rows, fields):
+    for row in rows:
+        yield json.dumps({f: row.get(f) for f in fields}, separators=(",", ":"), default=str) + "\n"
+
+
+def write_rows(rows, fields, fmt, header=True):
+    return write_ndjson(rows, fields) if fmt == "ndjson" else write_csv(rows, fields, header)
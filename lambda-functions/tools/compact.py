@@ -0,0 +1,124 @@
+"""Compact encoding for tool results.
+
+Everything a tool returns is pasted into the Bedrock agent's prompt, so its
+size is paid for in tokens and latency on every later step of the
+conversation. In compact mode results are sent as minified JSON with short
+keys, lists of records as columns plus rows (field names once instead of per
+record), floats rounded and timestamps cut to the minute.
+
+List tools also keep each response within a byte budget (RESPONSE_MAX_BYTES,
+about 4 bytes per token): they return as many records as fit and a
+continuation token for the rest, instead of one reply that crowds the prompt.
+
+The mode is RESPONSE_ENCODING ('text' or 'compact', default 'text'); a call
+can override it with a `format` parameter and the budget with `max_bytes`.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib encoder gives the same output, slower
+    orjson = None
+
+RESPONSE_ENCODING = os.environ.get('RESPONSE_ENCODING', 'text')
+RESPONSE_MAX_BYTES = int(os.environ.get('RESPONSE_MAX_BYTES', '12000'))
+# Smallest budget a caller may ask for; below this not even one record fits
+MIN_MAX_BYTES = 256
+
+# Short key for each long field name in tool results
+SHORT_KEYS = {
+    "meal_name": "n", "name": "n", "calories": "cal", "protein": "p", "carbs": "c", "fat": "f",
+    "created_at": "t", "score": "s", "match": "m", "meal_id": "id",
+    "candidates": "cands", "best_match": "best", "auto_act_performed": "acted", "message": "msg",
+    "suggestions": "sug", "times_logged": "cnt", "last_logged": "last", "results": "res", "status": "st", "operations": "ops",
+    "start_date": "from", "end_date": "to", "day": "d", "days_logged": "days", "per_day": "day",
+    "totals": "tot", "weekly": "wk", "week_of": "wk", "avg_daily_calories": "avg",
+    "rolling_7d_avg_calories": "avg7", "macro_calorie_ratio": "ratio",
+    "days_over_goal": "over", "calorie_goal": "goal",
+}
+TIMESTAMP_KEYS = frozenset(("created_at", "last_logged"))
+# Lists of records shorter than this keep one object per record
+MIN_COLUMNAR_ROWS = 2
+FLOAT_DIGITS = 2
+
+
+def wants_compact(params) -> bool:
+    return str(params.get("format") or RESPONSE_ENCODING).lower() == "compact"
+
+
+def max_bytes(params) -> int:
+    """The byte budget for this call: `max_bytes` if given (within limits), else RESPONSE_MAX_BYTES."""
+    try:
+        requested = int(params.get("max_bytes") or RESPONSE_MAX_BYTES)
+    except (TypeError, ValueError):
+        return RESPONSE_MAX_BYTES
+    return max(MIN_MAX_BYTES, min(requested, RESPONSE_MAX_BYTES))
+
+
+def dumps(obj) -> str:
+    """Minified JSON; non-ASCII is kept as UTF-8 rather than \\u escapes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str).decode()
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _short_timestamp(value):
+    # '2024-05-01T12:30:45.123456+00:00' -> '2024-05-01T12:30' (stored timestamps are UTC)
+    if isinstance(value, str) and len(value) > 16 and value[10:11] == "T" and value[4:5] == "-":
+        return value[:16]
+    return value
+
+
+def _value(key, value):
+    if isinstance(value, float):
+        value = round(value, FLOAT_DIGITS)
+        return int(value) if value.is_integer() else value
+    if key in TIMESTAMP_KEYS:
+        return _short_timestamp(value)
+    return encode(value)
+
+
+def columns(records, fields=None):
+    """{'cols': [...], 'rows': [[...], ...]} for a list of dicts; fields default to the first record's keys."""
+    fields = list(fields or (records[0] if records else ()))
+    return {
+        "cols": [SHORT_KEYS.get(f, f) for f in fields],
+        "rows": [[_value(f, r.get(f)) for f in fields] for r in records],
+    }
+
+
+def encode(result):
+    """Compact form of a tool result: short keys, columnar record lists, None values dropped."""
+    if isinstance(result, dict):
+        return {SHORT_KEYS.get(k, k): _value(k, v) for k, v in result.items() if v is not None}
+    if isinstance(result, list):
+        if len(result) >= MIN_COLUMNAR_ROWS and all(isinstance(r, dict) for r in result):
+            fields = list(result[0])
+            if all(len(r) == len(fields) and all(f in r for f in fields) for r in result):
+                return columns(result, fields)
+        return [encode(v) if isinstance(v, (dict, list)) else _value(None, v) for v in result]
+    return result
+
+
+def fit(count, render, budget):
+    """Render as many of `count` records as fit in `budget` bytes.
+
+    `render(k)` returns the response text for the first k records (including
+    any continuation token it needs). Returns (k, text) for the largest such
+    k; at least one record is always returned so paging makes progress.
+    """
+    text = render(count)
+    if count <= 1 or len(text.encode()) <= budget:
+        return count, text
+    lo, hi = 1, count - 1  # invariant: render(hi + 1) is over budget
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        candidate = render(mid)
+        if len(candidate.encode()) <= budget:
+            best = (mid, candidate)
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return best or (1, render(1))
@@ -1,10 +1,22 @@
+import base64
 import json
+import math
 import os
-from supabase import create_client
+import httpx
+from postgrest_client import PostgrestClient, PostgrestError
+import bulk_io
+import compact
+import tracing
 import traceback
 import re
+import time
 import difflib
+import hashlib
+import heapq
+import uuid
+from datetime import date, datetime, timedelta, timezone
 from types import SimpleNamespace
+from collections import OrderedDict
 '''
 Only needed if running locally
 from dotenv import load_dotenv
@@ -12,15 +24,51 @@ from dotenv import load_dotenv
 load_dotenv()
 '''
 
-# Initialize Supabase client
-supabase = create_client(
-    os.environ.get('DB_API_URL'),
-    os.environ.get('DB_API_KEY')
-)
+# Supabase (PostgREST) client, created on first use; its connection pool is
+# reused across warm invocations
+_supabase = None
+# Most requests one invocation sends to Supabase at the same time
+DB_MAX_CONCURRENCY = int(os.environ.get('DB_MAX_CONCURRENCY', '8'))
+
+
+def get_supabase():
+    global _supabase
+    if _supabase is None:
+        _supabase = PostgrestClient(
+            os.environ.get('DB_API_URL'),
+            os.environ.get('DB_API_KEY'),
+            max_concurrency=DB_MAX_CONCURRENCY
+        )
+    return _supabase
+
+
+# S3 client for bulk import/export files, created on first use; boto3 is only
+# imported then, so the other tools don't pay for it at cold start
+_s3 = None
+# Bucket holding users' import uploads and exports, under bulk/<user_id>/
+BULK_BUCKET = os.environ.get('BULK_BUCKET', '')
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        import boto3
+        _s3 = boto3.client("s3", region_name=os.environ.get("AWS_REGION", "us-east-2"))
+    return _s3
 
 def lambda_handler(event, context):
     """Main Lambda handler for Bedrock Agent tools"""
-    print(f'Event: {json.dumps(event, indent=2)}')
+    tracing.start("meal-tools", event.get("apiPath") or event.get("function"))
+    resp = None
+    try:
+        resp = _handle_tool_event(event)
+        return resp
+    finally:
+        tracing.finish(resp["response"]["httpStatusCode"] if resp else 500)
+
+
+def _handle_tool_event(event):
+    tracing.log_payload("event", event)
 
     # SECURITY: Extract user_id from session attributes (passed by Agent Lambda after token verification)
     session_attributes = event.get('sessionAttributes', {})
@@ -49,32 +97,73 @@ def lambda_handler(event, context):
             "modify_meal": "/modifyMeal",
             "get_meals": "/getMeals",
             "get_meal": "/getMeals",
+            "batch_meals": "/batchMeals",
+            "sync_meals": "/syncMeals",
+            "suggest_meals": "/suggestMeals",
+            "get_daily_totals": "/getDailyTotals",
+            "get_nutrition_stats": "/getNutritionStats",
+            "get_history": "/getHistory",
         }
         api_path = mapping.get(func_name, func_name)
 
     action_group = event.get("actionGroup")
     http_method = event.get("httpMethod", "POST")
-    # Normalize parameters coming from various Bedrock agent shapes
-    parameters = normalize_parameters(event)
-    print(f"Normalized parameters: {parameters}, user_id: {user_id}")
+    tracing.set_operation(api_path)
 
     try:
+        # Normalize parameters coming from various Bedrock agent shapes
+        with tracing.span("normalize_parameters"):
+            parameters = normalize_parameters(event)
+        tracing.log_payload("parameters", parameters)
+
         # Determine which tool to call based on apiPath - pass user_id for security
+        local_date = session_attributes.get("local_date")
         if api_path == "/findMealByName":
-            message = find_meal_by_name(parameters, user_id)
+            if parameters.get("action"):
+                message = find_meal_by_name(parameters, user_id)
+            else:
+                message = _cached_read(user_id, api_path, parameters, local_date,
+                                       lambda: find_meal_by_name(parameters, user_id))
         elif api_path == "/addMeal":
             message = add_meal(parameters, user_id)
         elif api_path == "/deleteMeal":
             message = delete_meal(parameters, user_id)
         elif api_path == "/modifyMeal":
             message = modify_meal(parameters, user_id)
+        elif api_path == "/suggestMeals":
+            message = _cached_read(user_id, api_path, parameters, local_date,
+                                   lambda: suggest_meals(parameters, user_id))
+        elif api_path == "/batchMeals":
+            message = batch_meals(parameters, user_id)
+        elif api_path == "/syncMeals":
+            message = sync_meals(parameters, user_id)
+        elif api_path == "/getDailyTotals":
+            # Not response-cached, like /getHistory: CalTracker follows every Meals
+            # write, including the app's and other containers', which the cache can't see
+            message = get_daily_totals(parameters, user_id, local_date)
+        elif api_path == "/getNutritionStats":
+            message = _cached_read(user_id, api_path, parameters, local_date,
+                                   lambda: get_nutrition_stats(parameters, user_id, local_date))
+        elif api_path == "/importMeals":
+            message = import_meals(parameters, user_id)
+        elif api_path == "/exportMeals":
+            message = export_meals(parameters, user_id, local_date)
+        elif api_path == "/getHistory":
+            # Not response-cached, like /getDailyTotals
+            message = get_history(parameters, user_id, local_date)
         elif api_path == "/getMeals":
-            message = get_meals(parameters, user_id)
+            # The agent's meals prefetch keeps its own copy for a TTL and asks for a
+            # fresh read, so the two caches' lifetimes don't add up
+            message = _cached_read(user_id, api_path, parameters, local_date,
+                                   lambda: get_meals(parameters, user_id, local_date),
+                                   refresh=str(session_attributes.get("refresh_cache", "")).lower() == "true")
         else:
             message = "Function not found"
 
+        if not isinstance(message, str) and compact.wants_compact(parameters):
+            message = compact.dumps(compact.encode(message))
         resp = create_response(message, api_path, action_group, http_method, status_code=200)
-        print("FINAL RESPONSE:", json.dumps(resp, indent=2))
+        tracing.log_payload("response", resp)
         return resp
 
     except Exception as e:
@@ -84,30 +173,81 @@ def lambda_handler(event, context):
         return create_response(f"Error: {str(e)}\n{tb}", api_path, action_group, http_method, status_code=500)
 
 
-def add_meal(params, user_id):
-    # Validate required parameters
+def _missing_add_fields(params):
     missing = []
     if not params.get("meal_name"):
         missing.append("meal_name")
     if params.get("calories") is None:
         missing.append("calories")
+    return missing
+
+
+def _meal_insert_payload(params, user_id):
+    # SECURITY: Always include user_id to ensure meals are associated with the authenticated user
+    return {
+        "meal_name": params.get("meal_name"),
+        "calories": params.get("calories"),
+        "protein": params.get("protein"),
+        "carbs": params.get("carbs"),
+        "fat": params.get("fat"),
+        "user_id": user_id
+    }
+
+
+def _meal_update_fields(params):
+    update_data = {}
+    if params.get("name") is not None:
+        update_data["meal_name"] = params.get("name")
+    if params.get("calories") is not None:
+        update_data["calories"] = params.get("calories")
+    if params.get("protein") is not None:
+        update_data["protein"] = params.get("protein")
+    if params.get("carbs") is not None:
+        update_data["carbs"] = params.get("carbs")
+    if params.get("fat") is not None:
+        update_data["fat"] = params.get("fat")
+    return update_data
+
+
+MACRO_FIELDS = ("calories", "protein", "carbs", "fat")
+
+
+def _as_number(v) -> float:
+    try:
+        return float(v) if v is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _meal_day(row) -> str:
+    """UTC day (YYYY-MM-DD) a meal row counts towards, matching the client's day buckets."""
+    created_at = row.get("created_at")
+    return str(created_at)[:10] if created_at else datetime.now(timezone.utc).date().isoformat()
+
+
+def add_meal(params, user_id):
+    # A name on its own re-logs a food from the user's catalog with its usual macros
+    from_catalog = None
+    if params.get("meal_name") and params.get("calories") is None:
+        params, from_catalog = _fill_from_catalog(params, user_id)
+
+    # Validate required parameters
+    missing = _missing_add_fields(params)
     if missing:
-        return f"Missing required parameters: {', '.join(missing)}"
+        hint = _suggestion_hint(params.get("meal_name"), user_id) if params.get("meal_name") else ""
+        return f"Missing required parameters: {', '.join(missing)}{hint}"
 
     try:
-        # SECURITY: Always include user_id to ensure meals are associated with the authenticated user
-        payload = {
-            "meal_name": params.get("meal_name"),
-            "calories": params.get("calories"),
-            "protein": params.get("protein"),
-            "carbs": params.get("carbs"),
-            "fat": params.get("fat"),
-            "user_id": user_id
-        }
-        response = supabase.table("Meals").insert(payload).execute()
+        payload = _meal_insert_payload(params, user_id)
+        response = get_supabase().table("Meals").insert(payload).execute()
         err = getattr(response, "error", None)
         if err:
             return f"DB error adding meal: {err}"
+        rows = getattr(response, "data", None) or [payload]
+        _invalidate_user_caches(user_id, added_rows=rows)
+        if from_catalog is not None:
+            return (f"Added {params.get('meal_name')} with {params.get('calories')} calories "
+                    f"(same macros as your last {from_catalog['name']})")
         return f"Added {params.get('meal_name')} with {params.get('calories')} calories"
     except Exception as e:
         tb = traceback.format_exc()
@@ -115,75 +255,112 @@ def add_meal(params, user_id):
         return f"Exception adding meal: {str(e)}"
 
 
+# Precompiled once per container; parameter parsing runs on every tool call.
+# A number with optional thousands separators and an optional unit suffix, e.g. "1,200 kcal"
+_NUMBER_RE = re.compile(r"([-+]?(?:[0-9][0-9,]*(?:\.[0-9]*)?|\.[0-9]+))\s*(?:k?cal|g)?", re.IGNORECASE)
+# <key>value</key> pairs
+_XML_TAG_RE = re.compile(r"<([a-zA-Z0-9_\-]+)>(.*?)</\1>", re.DOTALL)
+
+
+_NUMBER_START = frozenset("+-.0123456789")
+_UNITS = frozenset(("g", "cal", "kcal"))
+_UNIT_LETTERS = "gcalkGCALK"
+
+
 def _try_convert_value(v: str):
     """Try to convert numeric-looking strings to int/float, otherwise return stripped str."""
-    if isinstance(v, (int, float)):
-        return v
-    s = str(v).strip()
+    if v.__class__ is not str:
+        if isinstance(v, (int, float, list, dict)):
+            # already typed (e.g. from JSON); nested lists/objects are passed through untouched
+            return v
+        v = str(v)
+    s = v.strip()
+    # isdigit() alone also accepts digits int() can't parse, such as '²'
+    if s.isascii() and s.isdigit():
+        return int(s)
+    first = s[:1]
     # remove surrounding braces
-    if s.startswith("{") and s.endswith("}"):
+    if first == "{" and s[-1:] == "}":
         s = s[1:-1].strip()
-    # try stripping common unit suffixes like 'g', 'cal', 'kcal'
-    s = re.sub(r"(?i)\b([0-9,.]+)\s*(k?cal|cal|g)\b", r"\1", s)
-    s = s.replace(',', '')
-    # numeric int
-    if s.isdigit() or (s.startswith("-") and s[1:].isdigit()):
+        first = s[:1]
+    if first not in _NUMBER_START:
+        return s
+    # A whole number with a unit ("45g", "500 kcal") is the common case and
+    # doesn't need the regex
+    number = s.rstrip(_UNIT_LETTERS)
+    if number != s and s[len(number):].lower() in _UNITS:
+        number = number.rstrip()
+        if number.isascii() and number.isdigit():
+            return int(number)
+    # numbers, optionally with thousands separators and a 'g'/'cal'/'kcal' unit
+    m = _NUMBER_RE.fullmatch(s)
+    if m:
+        number = m.group(1).replace(",", "")
+        if number.lstrip("+-") not in ("", "."):
+            return float(number) if "." in number else int(number)
+    # Other forms float() reads, such as "1e3" or "+5"; ASCII only, as float() also takes other scripts' digits
+    if s.isascii():
         try:
-            return int(s)
-        except Exception:
-            pass
-    # numeric float
-    try:
-        f = float(s)
-        return f
-    except Exception:
-        pass
+            f = float(s.replace(",", ""))
+        except ValueError:
+            return s
+        if math.isfinite(f):
+            return f
     return s
 
 
 def _parse_key_values(s: str):
-    """Parse strings like "{carbs=30, protein=40, name=burrito}" into a dict."""
-    out = {}
+    """Parse strings like "{carbs=30, protein=40, name=burrito}" into a dict.
+
+    Dispatched on the string's first character: JSON objects, <tag>value</tag>
+    sequences, then a single split into key=value / key: value pairs.
+    """
     if not s:
-        return out
+        return {}
     s2 = s.strip()
-    # try JSON first
-    try:
-        if (s2.startswith('{') and s2.endswith('}')) or (s2.startswith('[') and s2.endswith(']')):
+    if not s2:
+        return {}
+    first = s2[0]
+
+    # only real JSON objects open with '{"'; Bedrock's "{key=value}" shape would
+    # otherwise pay for a failed json.loads on every call
+    if first == "{" and s2[-1] == "}" and s2[1:].lstrip()[:1] in ('"', "}"):
+        try:
             parsed = json.loads(s2)
             if isinstance(parsed, dict):
-                # convert values
                 return {k: _try_convert_value(v) for k, v in parsed.items()}
-    except Exception:
-        pass
-
-    # simple XML-like tags: <name>Chipotle Burrito</name><calories>50</calories>
-    if '<' in s2 and '</' in s2:
-        # find tags of form <key>value</key>
-        for m in re.finditer(r"<([a-zA-Z0-9_\-]+)>(.*?)</\1>", s2, flags=re.DOTALL):
-            key = m.group(1).strip()
-            val = m.group(2).strip()
-            out[key] = _try_convert_value(val)
+        except ValueError:
+            pass
+    elif first == "<":
+        out = {m.group(1): _try_convert_value(m.group(2)) for m in _XML_TAG_RE.finditer(s2)}
         if out:
             return out
 
-    # fallback: remove surrounding braces if present
-    if s2.startswith("{") and s2.endswith("}"):
+    # remove surrounding braces if present
+    if first == "{" and s2[-1] == "}":
         s2 = s2[1:-1]
-    # split by commas
-    parts = [p.strip() for p in s2.split(",") if p.strip()]
-    for part in parts:
-        if "=" in part:
-            k, v = part.split("=", 1)
-        elif ":" in part:
-            k, v = part.split(":", 1)
-        else:
-            # can't parse, continue
-            continue
-        key = k.strip()
-        val = _try_convert_value(v.strip())
-        out[key] = val
-    return out
+    # key=value / key: value pairs. A comma-separated piece without a separator
+    # continues the previous value, so "1,200" or "eggs, toast" survive intact.
+    raw = {}
+    key = None
+    for part in s2.split(","):
+        name, sep, value = part.partition("=")
+        if not sep:
+            name, sep, value = part.partition(":")
+        if sep and name:
+            key = name.strip()
+            raw[key] = value
+        elif key is not None:
+            raw[key] += "," + part
+    return {k: _try_convert_value(v) for k, v in raw.items() if k}
+
+
+def _parameters_value(props):
+    """Return the string value of the 'parameters' entry in a Bedrock properties list."""
+    for p in props:
+        if isinstance(p, dict) and p.get("name") == "parameters" and isinstance(p.get("value"), str):
+            return p["value"]
+    return None
 
 
 def normalize_parameters(event: dict):
@@ -201,44 +378,36 @@ def normalize_parameters(event: dict):
         return params
 
     # 2. parameters sent as a list (observed shape)
-    if isinstance(params, list) and len(params) > 0:
+    if params and isinstance(params, list):
         first = params[0]
-        # If first is a dict with 'value' field containing a key=value string
         if isinstance(first, dict):
-            # Attempt to read 'value' or 'properties' style
-            if "value" in first and isinstance(first["value"], str):
-                parsed = _parse_key_values(first["value"])
+            # a 'value' holding a key=value string, or nested 'properties'
+            value = first.get("value")
+            if not isinstance(value, str) and isinstance(first.get("properties"), list):
+                value = _parameters_value(first["properties"])
+            if isinstance(value, str):
+                parsed = _parse_key_values(value)
                 if parsed:
                     return parsed
-            # some agents put nested properties
-            if "properties" in first and isinstance(first["properties"], list):
-                # look for an entry with name 'parameters' or similar
-                for p in first["properties"]:
-                    if isinstance(p, dict) and p.get("name") == "parameters" and isinstance(p.get("value"), str):
-                        parsed = _parse_key_values(p.get("value"))
-                        if parsed:
-                            return parsed
+
     # 3. requestBody content
-    rb = event.get("requestBody") or {}
-    if isinstance(rb, dict):
-        content = rb.get("content") or {}
-        appjson = content.get("application/json") or {}
-        # some schemas put properties as a list
+    rb = event.get("requestBody")
+    content = rb.get("content") if isinstance(rb, dict) else None
+    appjson = content.get("application/json") if isinstance(content, dict) else None
+    if isinstance(appjson, dict):
         props = appjson.get("properties")
         if isinstance(props, list):
-            for p in props:
-                if isinstance(p, dict) and p.get("name") == "parameters":
-                    val = p.get("value")
-                    if isinstance(val, str):
-                        parsed = _parse_key_values(val)
-                        if parsed:
-                            return parsed
+            value = _parameters_value(props)
+            if value is not None:
+                parsed = _parse_key_values(value)
+                if parsed:
+                    return parsed
         # sometimes the body includes a 'parameters' key directly
-        if isinstance(appjson, dict) and isinstance(appjson.get("parameters"), dict):
-            return appjson.get("parameters")
+        if isinstance(appjson.get("parameters"), dict):
+            return appjson["parameters"]
 
     # 4. fallback: try to parse `inputText` for a simple list of key numbers
-    input_text = event.get("inputText") or ""
+    input_text = event.get("inputText")
     if input_text:
         # look for patterns like "name: burrito, calories: 500"
         parsed = _parse_key_values(input_text)
@@ -255,7 +424,7 @@ def delete_meal(params, user_id):
         return "Missing required parameter: meal_id"
     try:
         # SECURITY: Filter by user_id to ensure users can only delete their own meals
-        response = supabase.table("Meals").delete()\
+        response = get_supabase().table("Meals").delete()\
             .eq("id", meal_id)\
             .eq("user_id", user_id)\
             .execute()
@@ -266,6 +435,7 @@ def delete_meal(params, user_id):
         data = getattr(response, "data", None)
         if not data:
             return f"Meal with ID {meal_id} not found or you don't have permission to delete it"
+        _invalidate_user_caches(user_id, deleted_rows=data)
         return f"Deleted meal with ID {meal_id}"
     except Exception as e:
         tb = traceback.format_exc()
@@ -277,22 +447,12 @@ def modify_meal(params, user_id):
     meal_id = params.get("meal_id")
     if meal_id is None:
         return "Missing required parameter: meal_id"
-    update_data = {}
-    if params.get("name") is not None:
-        update_data["meal_name"] = params.get("name")
-    if params.get("calories") is not None:
-        update_data["calories"] = params.get("calories")
-    if params.get("protein") is not None:
-        update_data["protein"] = params.get("protein")
-    if params.get("carbs") is not None:
-        update_data["carbs"] = params.get("carbs")
-    if params.get("fat") is not None:
-        update_data["fat"] = params.get("fat")
+    update_data = _meal_update_fields(params)
     if not update_data:
         return "No fields provided to update"
     try:
         # SECURITY: Filter by user_id to ensure users can only modify their own meals
-        response = supabase.table("Meals").update(update_data)\
+        response = get_supabase().table("Meals").update(update_data)\
             .eq("id", meal_id)\
             .eq("user_id", user_id)\
             .execute()
@@ -303,6 +463,7 @@ def modify_meal(params, user_id):
         data = getattr(response, "data", None)
         if not data:
             return f"Meal with ID {meal_id} not found or you don't have permission to modify it"
+        _invalidate_user_caches(user_id, updated_rows=data)
         return f"Modified meal with ID {meal_id}"
     except Exception as e:
         tb = traceback.format_exc()
@@ -310,29 +471,1176 @@ def modify_meal(params, user_id):
         return f"Exception modifying meal: {str(e)}"
 
 
-def get_meals(params, user_id):
+BATCH_MAX_OPERATIONS = 50
+
+
+def batch_meals(params, user_id):
+    """Apply a list of add/modify/delete operations with as few round trips as possible.
+
+    `params['operations']` is a list of objects with an `op` of "add", "modify" or
+    "delete" plus that operation's usual parameters. Adds go out as one bulk insert,
+    modifies sharing the same field values as one update, and deletes as one delete.
+    Independent requests run concurrently; a meal both modified and deleted is
+    modified first. Returns per-item results in input order.
+    """
+    operations = params.get("operations")
+    if isinstance(operations, str):
+        try:
+            operations = json.loads(operations)
+        except ValueError:
+            operations = None
+    if not isinstance(operations, list) or not operations:
+        return {"results": [], "succeeded": 0, "failed": 0, "message": "Missing required parameter: operations"}
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return {"results": [], "succeeded": 0, "failed": 0,
+                "message": f"Too many operations (max {BATCH_MAX_OPERATIONS})"}
+
+    results = [None] * len(operations)
+    adds = []        # (index, payload)
+    modifies = {}    # canonical update fields -> (update_data, [(index, meal_id)])
+    deletes = []     # (index, meal_id)
+
+    def fail(i, op, message, meal_id=None):
+        results[i] = {"index": i, "op": op, "status": "error", "meal_id": meal_id, "message": message}
+
+    def ok(i, op, message, meal_id):
+        results[i] = {"index": i, "op": op, "status": "ok", "meal_id": meal_id, "message": message}
+
+    for i, item in enumerate(operations):
+        if not isinstance(item, dict):
+            fail(i, None, "Operation must be an object")
+            continue
+        item = {k: _try_convert_value(v) for k, v in item.items()}
+        op = str(item.get("op") or item.get("action") or "").lower()
+        if op == "add":
+            if item.get("meal_name") and item.get("calories") is None:
+                item, _ = _fill_from_catalog(item, user_id)
+            missing = _missing_add_fields(item)
+            if missing:
+                fail(i, op, f"Missing required parameters: {', '.join(missing)}")
+            else:
+                adds.append((i, _meal_insert_payload(item, user_id)))
+        elif op in ("modify", "delete"):
+            meal_id = item.get("meal_id")
+            if meal_id is None:
+                fail(i, op, "Missing required parameter: meal_id")
+            elif op == "delete":
+                deletes.append((i, meal_id))
+            else:
+                update_data = _meal_update_fields(item)
+                if not update_data:
+                    fail(i, op, "No fields provided to update", meal_id)
+                else:
+                    key = json.dumps(update_data, sort_keys=True, default=str)
+                    modifies.setdefault(key, (update_data, []))[1].append((i, meal_id))
+        else:
+            fail(i, op or None, "Unknown op; expected add, modify or delete")
+
+    db = get_supabase()
+    changed = False
+    # A write that raised may still have been applied, so its rows are unknown
+    rows_known = True
+    inserted_rows = []
+    updated_rows = []
+    deleted_rows = []
+
+    def rows_of(result, what):
+        """Rows from an execute_many result, raising what the query raised."""
+        if isinstance(result, Exception):
+            raise result
+        err = getattr(result, "error", None)
+        if err:
+            raise RuntimeError(f"DB error {what}: {err}")
+        return getattr(result, "data", None) or []
+
+    # The bulk insert, one update per group of identical field values and the
+    # delete don't depend on each other, so they go out together. A meal that
+    # is both modified and deleted is deleted afterwards, on its own.
+    groups = list(modifies.values())
+    modified_ids = {str(meal_id) for _, targets in groups for _, meal_id in targets}
+    delete_after = bool(modified_ids & {str(meal_id) for _, meal_id in deletes})
+    stage = []
+    if adds:
+        stage.append(db.table("Meals").insert([payload for _, payload in adds]))
+    # SECURITY: Filter by user_id to ensure users can only modify/delete their own meals
+    stage += [db.table("Meals").update(update_data).in_("id", [meal_id for _, meal_id in targets]).eq("user_id", user_id)
+              for update_data, targets in groups]
+    delete_query = None
+    if deletes:
+        delete_query = db.table("Meals").delete().in_("id", [meal_id for _, meal_id in deletes]).eq("user_id", user_id)
+        if not delete_after:
+            stage.append(delete_query)
+    stage_results = db.execute_many(stage)
+
+    if adds:
+        try:
+            inserted = rows_of(stage_results.pop(0), "adding meals")
+            changed = True
+            inserted_rows = inserted or [payload for _, payload in adds]
+            for n, (i, payload) in enumerate(adds):
+                # PostgREST returns inserted rows in request order
+                meal_id = inserted[n].get("id") if n < len(inserted) else None
+                ok(i, "add", f"Added {payload['meal_name']} with {payload['calories']} calories", meal_id)
+        except Exception as e:
+            print(traceback.format_exc())
+            rows_known = False
+            for i, _ in adds:
+                fail(i, "add", f"Exception adding meal: {str(e)}")
+
+    for (update_data, targets), result in zip(groups, stage_results):
+        try:
+            group_rows = rows_of(result, "modifying meals")
+            updated_rows += group_rows
+            updated = {str(r.get("id")) for r in group_rows}
+            changed = changed or bool(updated)
+            for i, meal_id in targets:
+                if str(meal_id) in updated:
+                    ok(i, "modify", f"Modified meal with ID {meal_id}", meal_id)
+                else:
+                    fail(i, "modify", f"Meal with ID {meal_id} not found or you don't have permission to modify it", meal_id)
+        except Exception as e:
+            print(traceback.format_exc())
+            rows_known = False
+            for i, meal_id in targets:
+                fail(i, "modify", f"Exception modifying meal: {str(e)}", meal_id)
+
+    if delete_query is not None:
+        result = db.execute_many([delete_query])[0] if delete_after else stage_results[len(groups)]
+        try:
+            deleted_rows = rows_of(result, "deleting meals")
+            deleted = {str(r.get("id")) for r in deleted_rows}
+            changed = changed or bool(deleted)
+            for i, meal_id in deletes:
+                if str(meal_id) in deleted:
+                    ok(i, "delete", f"Deleted meal with ID {meal_id}", meal_id)
+                else:
+                    fail(i, "delete", f"Meal with ID {meal_id} not found or you don't have permission to delete it", meal_id)
+        except Exception as e:
+            print(traceback.format_exc())
+            rows_known = False
+            for i, meal_id in deletes:
+                fail(i, "delete", f"Exception deleting meal: {str(e)}", meal_id)
+
+    if not rows_known:
+        _invalidate_user_caches(user_id)
+    elif changed:
+        _invalidate_user_caches(user_id, added_rows=inserted_rows, updated_rows=updated_rows, deleted_rows=deleted_rows)
+
+    succeeded = sum(1 for r in results if r["status"] == "ok")
+    failed = len(results) - succeeded
+    return {"results": results, "succeeded": succeeded, "failed": failed,
+            "message": f"{succeeded} of {len(results)} operations succeeded"}
+
+
+SYNC_MAX_OPERATIONS = 200
+SYNC_DEFAULT_LIMIT = 500
+SYNC_MAX_LIMIT = 1000
+SYNC_COLUMNS = "id, client_id, meal_name, calories, protein, carbs, fat, created_at, updated_at, change_seq"
+SYNC_FIELDS = ("meal_name",) + MACRO_FIELDS
+
+
+def _parse_timestamp(value, field):
+    """Parse an ISO 8601 timestamp into an aware UTC datetime, raising ValueError with the field name."""
+    try:
+        ts = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}', expected an ISO 8601 timestamp") from None
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def _parse_uuid(value, field):
+    try:
+        return str(uuid.UUID(str(value)))
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}', expected a UUID") from None
+
+
+def _collapse_sync_operations(operations):
+    """Fold queued operations into one effective write per meal.
 
+    Operations are keyed by `client_id` (or `meal_id` for meals created
+    elsewhere) and replayed in `client_ts` order: an add followed by modifies
+    becomes one add, several modifies merge, and a delete wins over anything
+    before it. Returns ({key: write}, [error results]).
+    """
+    writes = {}
+    errors = []
+    queued = []
+    for i, item in enumerate(operations):
+        if not isinstance(item, dict):
+            errors.append({"index": i, "status": "error", "message": "Operation must be an object"})
+            continue
+        item = {k: _try_convert_value(v) for k, v in item.items()}
+        op = str(item.get("op") or "").lower()
+        client_id = item.get("client_id") or None
+        meal_id = item.get("meal_id")
+        try:
+            # Both end up in PostgREST filters, so only well-formed ids are accepted
+            if client_id is not None:
+                client_id = _parse_uuid(client_id, "client_id")
+            if meal_id is not None and not (str(meal_id).isascii() and str(meal_id).isdigit()):
+                raise ValueError(f"Invalid meal_id '{meal_id}'")
+            if op not in ("add", "modify", "delete"):
+                raise ValueError("Unknown op; expected add, modify or delete")
+            if op == "add" and not client_id:
+                raise ValueError("Missing required parameter: client_id")
+            if not client_id and meal_id is None:
+                raise ValueError("Missing required parameter: client_id or meal_id")
+            ts = _parse_timestamp(item["client_ts"], "client_ts") if item.get("client_ts") \
+                else datetime.now(timezone.utc)
+            created_at = _parse_timestamp(item["created_at"], "created_at") if item.get("created_at") else None
+        except (TypeError, ValueError) as e:
+            errors.append({"index": i, "client_id": client_id, "meal_id": meal_id, "status": "error", "message": str(e)})
+            continue
+        if "name" in item and "meal_name" not in item:
+            item["meal_name"] = item["name"]
+        fields = {f: item[f] for f in SYNC_FIELDS if item.get(f) is not None}
+        queued.append((ts, i, op, client_id, meal_id, fields, created_at))
+
+    for ts, i, op, client_id, meal_id, fields, created_at in sorted(queued, key=lambda q: (q[0], q[1])):
+        key = ("client_id", client_id) if client_id else ("id", str(meal_id))
+        write = writes.get(key)
+        if op == "delete" or write is None or write["op"] == "delete":
+            indexes = write["indexes"] if write else []
+            write = writes[key] = {"op": op, "client_id": client_id, "meal_id": meal_id,
+                                   "fields": {}, "created_at": None, "indexes": indexes}
+        write["fields"].update(fields)
+        write["ts"] = ts
+        write["indexes"].append(i)
+        if meal_id is not None:
+            write["meal_id"] = meal_id
+        if created_at is not None:
+            write["created_at"] = created_at
+    return writes, errors
+
+
+def sync_meals(params, user_id):
+    """Apply a client's queued offline writes and return what changed since its cursor.
+
+    `params['operations']` holds add/modify/delete operations, each with the
+    client-generated `client_id` of the meal (or the `meal_id` of one created
+    elsewhere), `client_ts` (when the user made the change) and the meal's
+    fields. Replays are idempotent: an add whose client_id already exists is
+    not inserted twice. Conflicts are last-writer-wins on `client_ts` against
+    the row's `updated_at`, checked atomically in each write's filter.
+
+    The reply lists every meal changed, and the ids of those deleted, after
+    `params['cursor']` (a change sequence number; 0 or absent for a full
+    sync) plus the cursor to send next time. Needs the client_id/updated_at/
+    change_seq columns and MealTombstones table (migration 0003).
+    """
+    operations = params.get("operations") or []
+    if isinstance(operations, str):
+        try:
+            operations = json.loads(operations)
+        except ValueError:
+            operations = None
+    if not isinstance(operations, list):
+        return {"results": [], "message": "operations must be a list"}
+    if len(operations) > SYNC_MAX_OPERATIONS:
+        return {"results": [], "message": f"Too many operations (max {SYNC_MAX_OPERATIONS})"}
     try:
-        # SECURITY: Filter by user_id to only get the authenticated user's meals
-        response = supabase.table("Meals")\
-            .select("id, meal_name, calories, protein, carbs, fat, created_at")\
+        cursor = str(params.get("cursor") or 0).strip()
+        if not (cursor.isascii() and cursor.isdigit()):
+            raise ValueError(f"Invalid cursor '{cursor}'")
+        cursor = int(cursor)
+        limit = max(1, min(int(params.get("limit") or SYNC_DEFAULT_LIMIT), SYNC_MAX_LIMIT))
+    except (TypeError, ValueError) as e:
+        return {"results": [], "message": f"Invalid parameters: {str(e)}"}
+
+    writes, results = _collapse_sync_operations(operations)
+    db = get_supabase()
+    try:
+        if writes:
+            results += _apply_sync_writes(db, user_id, writes)
+        changes, deleted, next_cursor, has_more = _sync_delta(db, user_id, cursor, limit)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"results": results, "message": f"Exception syncing meals: {str(e)}"}
+
+    results.sort(key=lambda r: r.get("index", -1))
+    applied = sum(1 for r in results if r["status"] in ("applied", "duplicate"))
+    return {"results": results, "changes": changes, "deleted": deleted,
+            "cursor": str(next_cursor), "has_more": has_more,
+            "message": f"{applied} of {len(results)} changes synced; {len(changes) + len(deleted)} updates since cursor"}
+
+
+def _apply_sync_writes(db, user_id, writes):
+    """Resolve each collapsed write against the server's rows and apply the winners concurrently."""
+    client_ids = [cid for kind, cid in writes if kind == "client_id"]
+    meal_ids = [mid for kind, mid in writes if kind == "id"]
+    terms = []
+    if client_ids:
+        terms.append("client_id.in.(" + ",".join(client_ids) + ")")
+    if meal_ids:
+        terms.append("id.in.(" + ",".join(meal_ids) + ")")
+    # SECURITY: Filter by user_id so a client can only sync its own meals
+    current, tombstones = db.execute_many([
+        db.table("Meals").select(SYNC_COLUMNS).eq("user_id", user_id).or_(",".join(terms)),
+        db.table("MealTombstones").select("meal_id, client_id").eq("user_id", user_id).or_(
+            ",".join(t.replace("id.in", "meal_id.in") if t.startswith("id.") else t for t in terms)),
+    ])
+    for result in (current, tombstones):
+        if isinstance(result, Exception):
+            raise result
+    rows = {}
+    for row in current.data or []:
+        if row.get("client_id"):
+            rows[("client_id", str(row["client_id"]))] = row
+        rows[("id", str(row["id"]))] = row
+    gone = {("client_id", str(t["client_id"])) for t in tombstones.data or [] if t.get("client_id")}
+    gone |= {("id", str(t["meal_id"])) for t in tombstones.data or []}
+
+    results = []
+
+    def result(write, status, message, meal_id=None):
+        for i in write["indexes"]:
+            results.append({"index": i, "client_id": write["client_id"], "status": status,
+                            "meal_id": meal_id if meal_id is not None else write["meal_id"], "message": message})
+
+    inserts = []   # (write, payload)
+    queries = []   # (write, kind, old row, query)
+    for key, write in writes.items():
+        row = rows.get(key)
+        ts = write["ts"].isoformat()
+        if row is None:
+            if write["op"] == "delete":
+                # Deletes are idempotent: the meal is gone either way
+                result(write, "applied", "Meal was already deleted")
+            elif key in gone:
+                result(write, "deleted", "Meal has since been deleted")
+            elif write["op"] == "add":
+                missing = _missing_add_fields(write["fields"])
+                if missing:
+                    result(write, "error", f"Missing required parameters: {', '.join(missing)}")
+                    continue
+                payload = {**_meal_insert_payload(write["fields"], user_id),
+                           "client_id": write["client_id"], "updated_at": ts,
+                           "created_at": (write["created_at"] or write["ts"]).isoformat()}
+                inserts.append((write, payload))
+            else:
+                result(write, "not_found", "Meal not found or you don't have permission to change it")
+            continue
+
+        if write["op"] == "add" and all(row.get(f) == v for f, v in write["fields"].items()):
+            result(write, "duplicate", "Meal already synced", row["id"])
+            continue
+        if write["ts"] < _parse_timestamp(row["updated_at"], "updated_at"):
+            result(write, "conflict", "Meal was changed more recently on the server", row["id"])
+            continue
+        # The updated_at filter makes last-writer-wins atomic against concurrent writers
+        if write["op"] == "delete":
+            query = db.table("Meals").delete().eq("id", row["id"]).eq("user_id", user_id).lte("updated_at", ts)
+        else:
+            query = db.table("Meals").update({**write["fields"], "updated_at": ts})\
+                .eq("id", row["id"]).eq("user_id", user_id).lte("updated_at", ts)
+        queries.append((write, write["op"], row, query))
+
+    stage = [query for _, _, _, query in queries]
+    if inserts:
+        # A concurrent sync of the same add loses the race quietly instead of failing the batch
+        stage.append(db.table("Meals").upsert([payload for _, payload in inserts],
+                                               on_conflict="user_id,client_id", ignore_duplicates=True))
+    outcomes = db.execute_many(stage)
+
+    added_rows, updated_rows, deleted_rows = [], [], []
+    # A write that raised may still have been applied, so its rows are unknown
+    rows_known = True
+    for (write, op, old, _), outcome in zip(queries, outcomes):
+        if isinstance(outcome, Exception):
+            print("".join(traceback.format_exception(outcome)))
+            rows_known = False
+            result(write, "error", f"Exception syncing meal: {str(outcome)}", old["id"])
+            continue
+        if not outcome.data:
+            result(write, "conflict", "Meal was changed more recently on the server", old["id"])
+            continue
+        (deleted_rows if op == "delete" else updated_rows).extend(outcome.data)
+        result(write, "applied", f"{'Deleted' if op == 'delete' else 'Updated'} meal with ID {old['id']}", old["id"])
+    if inserts:
+        outcome = outcomes[-1]
+        if isinstance(outcome, Exception):
+            print("".join(traceback.format_exception(outcome)))
+            rows_known = False
+            for write, _ in inserts:
+                result(write, "error", f"Exception adding meal: {str(outcome)}")
+        else:
+            inserted = {str(r.get("client_id")): r for r in outcome.data or []}
+            for write, payload in inserts:
+                row = inserted.get(write["client_id"])
+                if row is None:
+                    result(write, "duplicate", "Meal already synced")
+                    continue
+                added_rows.append(row)
+                result(write, "applied", f"Added {payload['meal_name']} with {payload['calories']} calories", row["id"])
+
+    if not rows_known:
+        _invalidate_user_caches(user_id)
+    elif added_rows or updated_rows or deleted_rows:
+        _invalidate_user_caches(user_id, added_rows=added_rows, updated_rows=updated_rows, deleted_rows=deleted_rows)
+    return results
+
+
+def _sync_delta(db, user_id, cursor, limit):
+    """Meals changed and ids deleted after `cursor`, oldest first, at most `limit` in total.
+
+    Returns (changes, deleted, next_cursor, has_more).
+    """
+    # SECURITY: Filter by user_id so the delta only holds the user's own meals
+    changed, removed = db.execute_many([
+        db.table("Meals").select(SYNC_COLUMNS).eq("user_id", user_id)
+        .gt("change_seq", cursor).order("change_seq").limit(limit + 1),
+        db.table("MealTombstones").select("meal_id, client_id, change_seq").eq("user_id", user_id)
+        .gt("change_seq", cursor).order("change_seq").limit(limit + 1),
+    ])
+    for result in (changed, removed):
+        if isinstance(result, Exception):
+            raise result
+    # Each list holds its own first limit + 1, so the merged first `limit` are the oldest overall
+    merged = heapq.merge(((int(r["change_seq"]), 0, r) for r in changed.data or []),
+                         ((int(t["change_seq"]), 1, t) for t in removed.data or []))
+    entries = list(merged)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    changes = [row for _, kind, row in entries if kind == 0]
+    deleted = [{"id": t["meal_id"], "client_id": t.get("client_id")} for _, kind, t in entries if kind == 1]
+    next_cursor = entries[-1][0] if entries else cursor
+    return changes, deleted, next_cursor, has_more
+
+
+GET_MEALS_DEFAULT_LIMIT = 50
+GET_MEALS_MAX_LIMIT = 200
+
+
+def _parse_date(value, field):
+    """Parse a YYYY-MM-DD string (or date) into a date, raising ValueError with the field name."""
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        raise ValueError(f"Invalid {field} '{value}', expected YYYY-MM-DD") from None
+
+
+def _day_bounds(start_day: date, end_day: date):
+    """Return [start, end) ISO timestamps (UTC) covering start_day through end_day inclusive."""
+    start = datetime(start_day.year, start_day.month, start_day.day, tzinfo=timezone.utc)
+    end = datetime(end_day.year, end_day.month, end_day.day, tzinfo=timezone.utc) + timedelta(days=1)
+    return start.isoformat(), end.isoformat()
+
+
+def _encode_cursor(row) -> str:
+    return f"{row['created_at']}|{row['id']}"
+
+
+def _decode_cursor(cursor: str):
+    """(created_at, id) of a cursor; the timestamp is re-serialized, as it is pasted into a PostgREST filter."""
+    created_at, sep, meal_id = str(cursor).rpartition("|")
+    meal_id = meal_id.strip()
+    if not sep or not meal_id.isascii() or not meal_id.isdigit():
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    try:
+        created_at = _parse_timestamp(created_at, "cursor")
+    except ValueError:
+        raise ValueError(f"Invalid cursor '{cursor}'") from None
+    return created_at.isoformat(), int(meal_id)
+
+
+def _format_meal_line(meal) -> str:
+    return (f"ID: {meal['id']} - {meal['meal_name']}: {meal['calories']} cal, {meal['protein']}g protein, "
+            f"{meal['carbs']}g carbs, {meal['fat']}g fat")
+
+
+MEAL_COLUMNS = "id, meal_name, calories, protein, carbs, fat, created_at"
+MEAL_FIELDS = tuple(c.strip() for c in MEAL_COLUMNS.split(","))
+
+
+def _fetch_meals_page(user_id, start_ts, end_ts, columns, limit, after=None):
+    """One keyset page of the user's meals in [start_ts, end_ts), ordered by (created_at, id).
+
+    `after` is the (created_at, id) of the last row of the previous page.
+    """
+    # SECURITY: Filter by user_id to only get the authenticated user's meals
+    query = get_supabase().table("Meals")\
+        .select(columns)\
+        .eq("user_id", user_id)\
+        .gte("created_at", start_ts)\
+        .lt("created_at", end_ts)
+    if after:
+        last_created_at, last_id = after
+        query = query.or_(
+            f'created_at.gt."{last_created_at}",'
+            f'and(created_at.eq."{last_created_at}",id.gt.{last_id})'
+        )
+    response = query.order("created_at").order("id").limit(limit).execute()
+    return getattr(response, "data", None) or []
+
+
+def _iter_meals(user_id, start_ts, end_ts, columns=MEAL_COLUMNS, page_size=1000, after=None):
+    """Yield every meal in [start_ts, end_ts) by walking keyset pages; `columns` must include id and created_at.
+
+    `after` is a (created_at, id) keyset position to start past.
+    """
+    while True:
+        page = _fetch_meals_page(user_id, start_ts, end_ts, columns, page_size, after=after)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = (page[-1]["created_at"], page[-1]["id"])
+
+
+def get_meals(params, user_id, local_date=None):
+    """Return the user's meals for a date range, one page at a time.
+
+    Optional params: `start_date`/`end_date` (YYYY-MM-DD, inclusive; default is the caller's
+    `local_date`, falling back to today in UTC), `limit` (default 50, max 200) and `cursor`
+    (returned by a previous call to fetch the next page). Rows are ordered by
+    (created_at, id) so the cursor is a stable keyset position. A page is also cut
+    short, with a cursor for the rest, if it would exceed the response byte budget.
+    """
+    try:
+        default_day = local_date or datetime.now(timezone.utc).date().isoformat()
+        start_day = _parse_date(params.get("start_date") or default_day, "start_date")
+        end_day = _parse_date(params.get("end_date") or start_day, "end_date")
+        if end_day < start_day:
+            return "end_date must not be before start_date"
+        limit = int(params.get("limit") or GET_MEALS_DEFAULT_LIMIT)
+        limit = max(1, min(limit, GET_MEALS_MAX_LIMIT))
+        cursor = _decode_cursor(params["cursor"]) if params.get("cursor") else None
+    except (TypeError, ValueError) as e:
+        return f"Invalid parameters: {str(e)}"
+
+    start_ts, end_ts = _day_bounds(start_day, end_day)
+    try:
+        # Fetch one extra row to know whether another page exists
+        data = _fetch_meals_page(user_id, start_ts, end_ts, MEAL_COLUMNS, limit + 1, after=cursor)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return f"Exception retrieving meals: {str(e)}"
+
+    if start_day == end_day:
+        label = "today" if start_day.isoformat() == default_day else start_day.isoformat()
+    else:
+        label = f"{start_day.isoformat()} to {end_day.isoformat()}"
+    if not data:
+        return f"No meals found for {label}"
+
+    page = data[:limit]
+    more = len(data) > limit
+
+    if compact.wants_compact(params):
+        def render(k):
+            body = {"range": label, **compact.columns(page[:k], MEAL_FIELDS)}
+            if more or k < len(page):
+                body["next"] = {"start_date": start_day.isoformat(), "end_date": end_day.isoformat(),
+                                "cursor": _encode_cursor(page[k - 1])}
+            return compact.dumps(body)
+    else:
+        lines = [_format_meal_line(meal) for meal in page]
+
+        def render(k):
+            text = f"Meals for {label}:\n" + "\n".join(lines[:k]) + "\n"
+            if more or k < len(page):
+                text += f"More meals available; call again with cursor={_encode_cursor(page[k - 1])}\n"
+            return text
+
+    _, text = compact.fit(len(page), render, compact.max_bytes(params))
+    return text
+
+
+def get_daily_totals(params, user_id, local_date=None):
+    """Return the user's CalTracker rollup for a day or a range of days (inclusive).
+
+    Ranges too long for the response byte budget return the first days and the
+    start_date to continue from.
+    """
+    try:
+        default_day = local_date or datetime.now(timezone.utc).date().isoformat()
+        start_day = _parse_date(params.get("start_date") or default_day, "start_date")
+        end_day = _parse_date(params.get("end_date") or start_day, "end_date")
+        if end_day < start_day:
+            return "end_date must not be before start_date"
+    except (TypeError, ValueError) as e:
+        return f"Invalid parameters: {str(e)}"
+
+    try:
+        # SECURITY: Filter by user_id to only read the authenticated user's totals
+        response = get_supabase().table("CalTracker")\
+            .select("day, calories, protein, carbs, fat")\
             .eq("user_id", user_id)\
+            .gte("day", start_day.isoformat())\
+            .lte("day", end_day.isoformat())\
+            .order("day")\
             .execute()
-
         data = getattr(response, "data", None)
-        if not data:
-            return "No meals found for today"
     except Exception as e:
         tb = traceback.format_exc()
         print(tb)
-        return f"Exception retrieving meals: {str(e)}"
+        return f"Exception retrieving daily totals: {str(e)}"
 
-    text = "Today's meals:\n"
-    for meal in data:
-        text += f"{meal['meal_name']}: {meal['calories']} cal, {meal['protein']}g protein, {meal['carbs']}g carbs, {meal['fat']}g fat\n"
+    if not data:
+        if start_day == end_day:
+            return f"No meals logged for {start_day.isoformat()}"
+        return f"No meals logged from {start_day.isoformat()} to {end_day.isoformat()}"
+
+    if compact.wants_compact(params):
+        def render(k):
+            body = compact.columns(data[:k], ("day",) + MACRO_FIELDS)
+            if k < len(data):
+                body["next"] = {"start_date": data[k]["day"], "end_date": end_day.isoformat()}
+            return compact.dumps(body)
+    else:
+        lines = [f"{row['day']}: {row['calories']} cal, {row['protein']}g protein, "
+                 f"{row['carbs']}g carbs, {row['fat']}g fat" for row in data]
+
+        def render(k):
+            text = "Daily totals:\n" + "\n".join(lines[:k]) + "\n"
+            if k < len(data):
+                text += f"More days available; call again with start_date={data[k]['day']} and end_date={end_day.isoformat()}\n"
+            return text
+
+    _, text = compact.fit(len(data), render, compact.max_bytes(params))
     return text
 
 
+NUTRITION_STATS_DEFAULT_DAYS = 30
+NUTRITION_STATS_MAX_DAYS = 366
+
+
+def get_nutrition_stats(params, user_id, local_date=None):
+    """Summarize the user's nutrition over a date window in a few vectorized passes.
+
+    Optional params: `start_date`/`end_date` (YYYY-MM-DD, inclusive; default is the 30 days
+    ending on the caller's `local_date`) and `calorie_goal` (report the days above it).
+    Meals are pulled once into column arrays; per-day and per-week totals come from
+    np.bincount, so the cost is one scan of the window instead of the agent reading
+    every meal. Averages and percentiles are over days with at least one meal logged.
+    """
+    # numpy is only needed by this tool; importing it here keeps it off every cold start
+    import numpy as np
+
+    try:
+        end_day = _parse_date(params.get("end_date") or local_date
+                              or datetime.now(timezone.utc).date().isoformat(), "end_date")
+        start_day = _parse_date(params.get("start_date")
+                                or end_day - timedelta(days=NUTRITION_STATS_DEFAULT_DAYS - 1), "start_date")
+        if end_day < start_day:
+            return {"message": "end_date must not be before start_date"}
+        n_days = (end_day - start_day).days + 1
+        if n_days > NUTRITION_STATS_MAX_DAYS:
+            return {"message": f"Date range too long (max {NUTRITION_STATS_MAX_DAYS} days)"}
+        goal = params.get("calorie_goal")
+        goal = float(goal) if goal not in (None, "") else None
+    except (TypeError, ValueError) as e:
+        return {"message": f"Invalid parameters: {str(e)}"}
+
+    start_ts, end_ts = _day_bounds(start_day, end_day)
+    start_ordinal = start_day.toordinal()
+    day_idx, columns = [], ([], [], [], [])
+    try:
+        for row in _iter_meals(user_id, start_ts, end_ts, "id, calories, protein, carbs, fat, created_at"):
+            day_idx.append(date.fromisoformat(_meal_day(row)).toordinal() - start_ordinal)
+            for col, field in zip(columns, MACRO_FIELDS):
+                col.append(_as_number(row.get(field)))
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"message": f"Exception retrieving meals: {str(e)}"}
+
+    if not day_idx:
+        return {"message": f"No meals logged from {start_day.isoformat()} to {end_day.isoformat()}",
+                "meals": 0}
+
+    with tracing.span("nutrition_stats"):
+        idx = np.asarray(day_idx, dtype=np.int64)
+        macros = np.asarray(columns, dtype=np.float64)  # shape (4, n_meals)
+        # (4, n_days) totals per day
+        daily = np.stack([np.bincount(idx, weights=m, minlength=n_days) for m in macros])
+        logged = np.bincount(idx, minlength=n_days) > 0
+        logged_daily = daily[:, logged]
+
+        def summary(values):
+            p50, p90 = np.percentile(values, [50, 90])
+            return {"mean": round(float(values.mean()), 1), "p50": round(float(p50), 1),
+                    "p90": round(float(p90), 1), "min": round(float(values.min()), 1),
+                    "max": round(float(values.max()), 1)}
+
+        per_day = {field: summary(logged_daily[i]) for i, field in enumerate(MACRO_FIELDS)}
+
+        # Weeks start on Monday
+        week_idx = (np.arange(n_days) + start_day.weekday()) // 7
+        n_weeks = int(week_idx[-1]) + 1
+        weekly = np.stack([np.bincount(week_idx, weights=d, minlength=n_weeks) for d in daily])
+        weekly_logged = np.bincount(week_idx, weights=logged, minlength=n_weeks)
+        first_monday = start_day - timedelta(days=start_day.weekday())
+        weeks = [
+            {"week_of": (first_monday + timedelta(weeks=w)).isoformat(),
+             "calories": round(float(weekly[0, w]), 1),
+             "avg_daily_calories": round(float(weekly[0, w] / weekly_logged[w]), 1) if weekly_logged[w] else None,
+             "days_logged": int(weekly_logged[w])}
+            for w in range(n_weeks)
+        ]
+
+        # Average daily calories over the window's last 7 days (unlogged days count as 0)
+        last_week = daily[0, -7:]
+        rolling = last_week.sum() / last_week.size
+
+        # Share of calories from each macro (4/4/9 kcal per gram)
+        energy = macros[1:].sum(axis=1) * np.array([4.0, 4.0, 9.0])
+        energy_total = energy.sum()
+        ratios = {field: round(float(e / energy_total), 3) if energy_total else None
+                  for field, e in zip(MACRO_FIELDS[1:], energy)}
+
+        result = {
+            "start_date": start_day.isoformat(),
+            "end_date": end_day.isoformat(),
+            "meals": int(idx.size),
+            "days_logged": int(logged.sum()),
+            "totals": {field: round(float(macros[i].sum()), 1) for i, field in enumerate(MACRO_FIELDS)},
+            "per_day": per_day,
+            "weekly": weeks,
+            "rolling_7d_avg_calories": round(float(rolling), 1),
+            "macro_calorie_ratio": ratios,
+        }
+        if goal is not None:
+            over = np.flatnonzero(daily[0] > goal)
+            result["calorie_goal"] = goal
+            result["days_over_goal"] = [(start_day + timedelta(days=int(d))).isoformat() for d in over]
+    result["message"] = f"Nutrition stats for {result['days_logged']} logged days"
+    return result
+
+
+HISTORY_DEFAULT_DAYS = 30
+HISTORY_MAX_DAYS = 731
+HISTORY_GRANULARITIES = ("day", "week", "month")
+
+
+def _bucket_start(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())  # weeks start on Monday
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _bucket_end(start: date, granularity: str) -> date:
+    if granularity == "week":
+        return start + timedelta(days=6)
+    if granularity == "month":
+        next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return next_month - timedelta(days=1)
+    return start
+
+
+def _history_buckets(rows, granularity):
+    """Sum CalTracker rows into day/week/month buckets, oldest first."""
+    buckets = {}
+    for row in rows:
+        start = _bucket_start(date.fromisoformat(str(row["day"])[:10]), granularity)
+        bucket = buckets.get(start)
+        if bucket is None:
+            bucket = buckets[start] = {"start": start.isoformat(), **{f: 0.0 for f in MACRO_FIELDS}, "days_logged": 0}
+        for field in MACRO_FIELDS:
+            bucket[field] += _as_number(row.get(field))
+        bucket["days_logged"] += 1
+    for bucket in buckets.values():
+        for field in MACRO_FIELDS:
+            bucket[field] = round(bucket[field], 1)
+    return [buckets[start] for start in sorted(buckets)]
+
+
+def get_history(params, user_id, local_date=None):
+    """Daily totals over a window, optionally downsampled, with conditional refreshes.
+
+    Optional params: `start_date`/`end_date` (YYYY-MM-DD, inclusive; default is the 30 days
+    ending on the caller's `local_date`, at most 731 days), `granularity` ("day", "week"
+    starting Monday, or "month"; buckets are summed server-side) and `cursor`.
+
+    Every reply carries a `cursor` naming the window and the newest CalTracker
+    change_seq it reflects. Sending it back returns only the buckets whose days
+    changed since (`full: false`), or `changed: false` and no buckets when none did,
+    so a refresh with nothing new costs one indexed lookup and a few bytes. A cursor
+    for a different window or granularity is ignored and the full window returned.
+    """
+    try:
+        end_day = _parse_date(params.get("end_date") or local_date
+                              or datetime.now(timezone.utc).date().isoformat(), "end_date")
+        start_day = _parse_date(params.get("start_date")
+                                or end_day - timedelta(days=HISTORY_DEFAULT_DAYS - 1), "start_date")
+        if end_day < start_day:
+            return {"message": "end_date must not be before start_date"}
+        if (end_day - start_day).days + 1 > HISTORY_MAX_DAYS:
+            return {"message": f"Date range too long (max {HISTORY_MAX_DAYS} days)"}
+        granularity = str(params.get("granularity") or "day").lower()
+        if granularity not in HISTORY_GRANULARITIES:
+            return {"message": f"Invalid granularity '{granularity}', expected day, week or month"}
+    except (TypeError, ValueError) as e:
+        return {"message": f"Invalid parameters: {str(e)}"}
+
+    window = f"{granularity}:{start_day.isoformat()}:{end_day.isoformat()}"
+    cursor_window, _, cursor_seq = str(params.get("cursor") or "").rpartition(":")
+    since = int(cursor_seq) if cursor_window == window and cursor_seq.isascii() and cursor_seq.isdigit() else None
+
+    def history_query(columns, first_day, last_day):
+        # SECURITY: Filter by user_id to only read the authenticated user's totals
+        return get_supabase().table("CalTracker")\
+            .select(columns)\
+            .eq("user_id", user_id)\
+            .gte("day", first_day.isoformat())\
+            .lte("day", last_day.isoformat())
+
+    columns = "day, calories, protein, carbs, fat, change_seq"
+    try:
+        if since is None:
+            rows = history_query(columns, start_day, end_day).order("day").execute().data or []
+            version = max((int(r["change_seq"]) for r in rows if r.get("change_seq") is not None), default=0)
+        else:
+            changed = history_query(columns, start_day, end_day).gt("change_seq", since).order("day").execute().data or []
+            if not changed:
+                return {"granularity": granularity, "start_date": start_day.isoformat(), "end_date": end_day.isoformat(),
+                        "changed": False, "full": False, "buckets": [], "cursor": f"{window}:{since}",
+                        "message": "No changes since cursor"}
+            version = max(since, *(int(r["change_seq"]) for r in changed))
+            if granularity == "day":
+                rows = changed
+            else:
+                # A changed day changes its whole bucket, so re-read the buckets it falls in
+                touched = {_bucket_start(date.fromisoformat(str(r["day"])[:10]), granularity) for r in changed}
+                first_day = max(start_day, min(touched))
+                last_day = min(end_day, _bucket_end(max(touched), granularity))
+                rows = [r for r in history_query(columns, first_day, last_day).order("day").execute().data or []
+                        if _bucket_start(date.fromisoformat(str(r["day"])[:10]), granularity) in touched]
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"message": f"Exception retrieving history: {str(e)}"}
+
+    buckets = _history_buckets(rows, granularity)
+    return {"granularity": granularity, "start_date": start_day.isoformat(), "end_date": end_day.isoformat(),
+            "changed": True, "full": since is None, "buckets": buckets, "cursor": f"{window}:{version}",
+            "message": f"{len(buckets)} {granularity} buckets" + ("" if since is None else " changed since cursor")}
+
+
+BULK_URL_TTL_SECONDS = 3600
+_BULK_FILE_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._\-]{0,127}$")
+IMPORT_CHUNK_ROWS = 500
+IMPORT_CHUNK_ATTEMPTS = 3
+IMPORT_RETRY_BACKOFF_SECONDS = 0.5
+# One call stops after this much work, under API Gateway's 29 s; the caller continues with
+# start_line (imports) or continuation (exports)
+IMPORT_TIME_BUDGET_SECONDS = float(os.environ.get('IMPORT_TIME_BUDGET_SECONDS', '20'))
+IMPORT_MAX_ERRORS = 20
+IMPORT_READ_BYTES = 64 * 1024
+# Imported rows get client_id uuid5(IMPORT_NAMESPACE, "<user_id>:<source>:<line>")
+IMPORT_NAMESPACE = uuid.UUID("9a764f46-3804-4072-801c-aef7c3a5317a")
+EXPORT_FIELDS = ("meal_name",) + MACRO_FIELDS + ("created_at",)
+EXPORT_EARLIEST = date(1970, 1, 1)
+EXPORT_LATEST = date(9999, 12, 30)
+EXPORT_PART_BYTES = 8 * 1024 * 1024
+EXPORT_CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _bulk_key(user_id, name):
+    """S3 key of a user's bulk file; `name` is a plain file name, never a path."""
+    name = str(name).strip()
+    if not _BULK_FILE_RE.match(name):
+        raise ValueError(f"Invalid file '{name}'")
+    # SECURITY: each user's files live under their own prefix, so a file name can't reach another user's
+    return f"bulk/{user_id}/{name}"
+
+
+def _bulk_file_name(kind, fmt):
+    return f"{kind}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.{fmt}"
+
+
+def _import_upload_url(params, user_id):
+    if not BULK_BUCKET:
+        return {"done": False, "message": "File uploads are not configured (BULK_BUCKET); send the rows as data"}
+    fmt = bulk_io.format_for(params.get("file_name"), params.get("format"))
+    name = _bulk_file_name("import", fmt)
+    url = get_s3().generate_presigned_url(
+        "put_object", Params={"Bucket": BULK_BUCKET, "Key": _bulk_key(user_id, name)},
+        ExpiresIn=BULK_URL_TTL_SECONDS)
+    return {"done": False, "file": name, "upload_url": url,
+            "message": f"Upload the file with an HTTP PUT to upload_url, then import it with file={name}"}
+
+
+def _s3_chunks(body):
+    try:
+        yield from body.iter_chunks(IMPORT_READ_BYTES)
+    finally:
+        body.close()
+
+
+def _import_source(params, user_id):
+    """(source, byte chunks) of the file to import: inline `data`, or `file` in the bulk bucket.
+
+    `source` names the file in the client_ids of its rows.
+    """
+    data = params.get("data")
+    if data is not None:
+        data = str(data).encode("utf-8")
+        return "data:" + hashlib.sha256(data).hexdigest()[:32], [data]
+    if not BULK_BUCKET:
+        raise ValueError("File imports are not configured (BULK_BUCKET); send the rows as data")
+    name = str(params.get("file")).strip()
+    body = get_s3().get_object(Bucket=BULK_BUCKET, Key=_bulk_key(user_id, name))["Body"]
+    return "file:" + name, _s3_chunks(body)
+
+
+def _import_payload(row, user_id, client_id):
+    """Validate one imported row into a Meals insert, raising ValueError."""
+    params = {"meal_name": str(row.get("meal_name") or "").strip()}
+    for field in MACRO_FIELDS:
+        value = row.get(field)
+        value = _try_convert_value(value) if value is not None else None
+        if value == "":
+            value = None
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))
+                                  or not 0 <= value < float("inf")):
+            raise ValueError(f"Invalid {field} '{row.get(field)}', expected a non-negative number")
+        params[field] = value
+    missing = _missing_add_fields(params)
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    payload = {**_meal_insert_payload(params, user_id), "client_id": client_id}
+    created_at = row.get("created_at")
+    if created_at is not None and str(created_at).strip():
+        payload["created_at"] = _parse_timestamp(created_at, "created_at").isoformat()
+    return payload
+
+
+def _import_rows(records, user_id, source, start_line, stats, errors):
+    """Yield (line, payload) for the valid records from start_line on, counting and noting the invalid ones."""
+    for line, row, error in records:
+        if line < start_line:
+            continue
+        stats["rows"] += 1
+        if error is None:
+            client_id = str(uuid.uuid5(IMPORT_NAMESPACE, f"{user_id}:{source}:{line}"))
+            try:
+                payload = _import_payload(row, user_id, client_id)
+            except ValueError as e:
+                error = str(e)
+            else:
+                yield line, payload
+                continue
+        stats["invalid"] += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"line": line, "error": error})
+
+
+def _insert_import_chunk(db, payloads):
+    """Insert one chunk of imported meals, retrying transient failures; returns the rows inserted.
+
+    Rows whose client_id is already there (imported before, or by an attempt
+    that failed after writing) are skipped, which makes the retries safe.
+    """
+    for attempt in range(IMPORT_CHUNK_ATTEMPTS):
+        try:
+            response = db.table("Meals").upsert(payloads, on_conflict="user_id,client_id",
+                                                ignore_duplicates=True).execute()
+            return getattr(response, "data", None) or []
+        except (PostgrestError, httpx.HTTPError) as e:
+            status = getattr(e, "status_code", None)
+            transient = status is None or status >= 500 or status == 429
+            if not transient or attempt == IMPORT_CHUNK_ATTEMPTS - 1:
+                raise
+            print(f"Import chunk failed (attempt {attempt + 1}), retrying: {str(e)}")
+            time.sleep(IMPORT_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+
+
+def import_meals(params, user_id):
+    """Import meal history from a CSV or NDJSON file, streamed row by row.
+
+    The file is `file`, uploaded to the bulk bucket with the upload_url this
+    returns when called with neither `file` nor `data`, or the inline `data`.
+    `format` is csv or ndjson (default from the file name, else csv). Rows
+    need meal_name and calories; protein, carbs, fat and created_at (an ISO
+    date or timestamp; default now) are optional, and the header names other
+    trackers use for them are recognized.
+
+    Rows are validated and inserted IMPORT_CHUNK_ROWS at a time, so memory
+    stays flat however long the file is. Each row's client_id comes from the
+    file and its line, so a retried chunk or a re-run of the same file skips
+    the rows already imported. A call that runs past IMPORT_TIME_BUDGET_SECONDS
+    stops with `done: false` and the `next_line` to send back as `start_line`.
+    """
+    started = time.monotonic()
+    try:
+        start_line = max(1, int(params.get("start_line") or 1))
+        if params.get("data") is None and not params.get("file"):
+            return _import_upload_url(params, user_id)
+        fmt = bulk_io.format_for(params.get("file"), params.get("format"))
+        source, chunks = _import_source(params, user_id)
+    except (TypeError, ValueError) as e:
+        return {"done": False, "message": f"Invalid parameters: {str(e)}"}
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"done": False, "message": f"Exception reading import file: {str(e)}"}
+
+    stats = {"rows": 0, "imported": 0, "duplicates": 0, "invalid": 0}
+    errors = []
+    next_line = start_line
+    failure = None
+    db = get_supabase()
+    records = bulk_io.read_rows(bulk_io.decode_lines(chunks), fmt)
+    try:
+        for chunk in bulk_io.chunked(_import_rows(records, user_id, source, start_line, stats, errors),
+                                     IMPORT_CHUNK_ROWS):
+            inserted = _insert_import_chunk(db, [payload for _, payload in chunk])
+            stats["imported"] += len(inserted)
+            stats["duplicates"] += len(chunk) - len(inserted)
+            next_line = chunk[-1][0] + 1
+            if time.monotonic() - started > IMPORT_TIME_BUDGET_SECONDS:
+                break
+        else:
+            next_line = None
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        failure = str(e)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        if stats["imported"]:
+            _invalidate_user_caches(user_id)
+    tracing.set_property("import_rows", stats["rows"])
+
+    message = (f"Imported {stats['imported']} meals from {stats['rows']} rows "
+               f"({stats['duplicates']} already imported, {stats['invalid']} invalid)")
+    if failure is not None:
+        message = f"Exception importing meals at line {next_line}: {failure}. {message}"
+    if next_line is not None:
+        message += f"; continue with start_line={next_line}"
+    return {"done": next_line is None, "next_line": next_line, **stats, "errors": errors, "message": message}
+
+
+def _encode_export_state(state) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+
+def _decode_export_state(token: str):
+    """The export a continuation token resumes: file, upload, part, rows, keyset position and filters."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(str(token).encode()))
+        after = state["after"]
+        if after is not None:
+            after = _decode_cursor(after)
+        state = {"file": str(state["file"]), "upload_id": str(state["upload_id"]), "part": int(state["part"]),
+                 "rows": int(state["rows"]), "after": after, "format": bulk_io.format_for(None, state["format"]),
+                 "start": _parse_date(state["start"], "start"), "end": _parse_date(state["end"], "end")}
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ValueError("Invalid continuation") from None
+    if state["part"] < 2:
+        raise ValueError("Invalid continuation")
+    return state
+
+
+def _uploaded_parts(s3, key, upload_id):
+    """[{PartNumber, ETag}] of every part uploaded so far, by earlier calls too."""
+    parts, marker = [], 0
+    while True:
+        response = s3.list_parts(Bucket=BULK_BUCKET, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        parts += [{"PartNumber": p["PartNumber"], "ETag": p["ETag"]} for p in response.get("Parts", [])]
+        if not response.get("IsTruncated"):
+            return parts
+        marker = response["NextPartNumberMarker"]
+
+
+def export_meals(params, user_id, local_date=None):
+    """Export the user's meals as a CSV or NDJSON file and return a download URL for it.
+
+    Optional params: `format` (csv, the default, or ndjson) and `start_date`/
+    `end_date` (YYYY-MM-DD, inclusive; default is the whole history). Meals
+    are read in keyset pages and uploaded in EXPORT_PART_BYTES multipart
+    parts as they are encoded, so memory stays flat. The columns are the ones
+    import_meals reads, so an export can be imported again.
+
+    A call that runs past IMPORT_TIME_BUDGET_SECONDS stops after a part with
+    `done: false` and a `continuation` to send back, which resumes the same
+    file from the next meal. A failed call aborts the upload.
+    """
+    if not BULK_BUCKET:
+        return {"message": "Exports are not configured (BULK_BUCKET)"}
+    started = time.monotonic()
+    try:
+        if params.get("continuation"):
+            state = _decode_export_state(params["continuation"])
+            fmt, start_day, end_day = state["format"], state["start"], state["end"]
+        else:
+            fmt = bulk_io.format_for(None, params.get("format"))
+            start_day = _parse_date(params.get("start_date") or EXPORT_EARLIEST, "start_date")
+            end_day = _parse_date(params.get("end_date") or EXPORT_LATEST, "end_date")
+            if end_day < start_day:
+                return {"message": "end_date must not be before start_date"}
+            state = {"file": _bulk_file_name("export", fmt), "upload_id": None, "part": 1, "rows": 0, "after": None}
+        key = _bulk_key(user_id, state["file"])
+    except (TypeError, ValueError) as e:
+        return {"message": f"Invalid parameters: {str(e)}"}
+
+    upload_id, part, after = state["upload_id"], state["part"], state["after"]
+    exported = state["rows"]
+
+    def tracked(rows):
+        # Counted as each row is handed to the writer, so `after` is the last row in the buffer
+        nonlocal exported, after
+        for row in rows:
+            exported += 1
+            after = (row["created_at"], row["id"])
+            yield row
+
+    start_ts, end_ts = _day_bounds(start_day, end_day)
+    s3 = get_s3()
+    buffer = bytearray()
+    try:
+        rows = tracked(_iter_meals(user_id, start_ts, end_ts, after=after))
+        for line in bulk_io.write_rows(rows, EXPORT_FIELDS, fmt, header=upload_id is None):
+            buffer += line.encode("utf-8")
+            if len(buffer) < EXPORT_PART_BYTES:
+                continue
+            if upload_id is None:
+                upload_id = s3.create_multipart_upload(Bucket=BULK_BUCKET, Key=key,
+                                                       ContentType=EXPORT_CONTENT_TYPES[fmt])["UploadId"]
+            s3.upload_part(Bucket=BULK_BUCKET, Key=key, UploadId=upload_id, PartNumber=part, Body=bytes(buffer))
+            part += 1
+            buffer.clear()
+            if time.monotonic() - started > IMPORT_TIME_BUDGET_SECONDS:
+                tracing.set_property("export_rows", exported)
+                continuation = _encode_export_state({
+                    "file": state["file"], "upload_id": upload_id, "part": part, "rows": exported,
+                    "after": _encode_cursor({"created_at": after[0], "id": after[1]}), "format": fmt,
+                    "start": start_day.isoformat(), "end": end_day.isoformat()})
+                return {"done": False, "file": state["file"], "format": fmt, "rows": exported,
+                        "continuation": continuation,
+                        "message": f"Exported {exported} meals so far; continue with continuation={continuation}"}
+
+        if upload_id is None:
+            s3.put_object(Bucket=BULK_BUCKET, Key=key, Body=bytes(buffer), ContentType=EXPORT_CONTENT_TYPES[fmt])
+        else:
+            if buffer:
+                s3.upload_part(Bucket=BULK_BUCKET, Key=key, UploadId=upload_id, PartNumber=part, Body=bytes(buffer))
+            s3.complete_multipart_upload(Bucket=BULK_BUCKET, Key=key, UploadId=upload_id,
+                                         MultipartUpload={"Parts": _uploaded_parts(s3, key, upload_id)})
+        url = s3.generate_presigned_url("get_object", Params={"Bucket": BULK_BUCKET, "Key": key},
+                                        ExpiresIn=BULK_URL_TTL_SECONDS)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        if upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=BULK_BUCKET, Key=key, UploadId=upload_id)
+            except Exception as abort_error:
+                print(f"Failed to abort export upload {upload_id}: {str(abort_error)}")
+        return {"message": f"Exception exporting meals: {str(e)}"}
+    tracing.set_property("export_rows", exported)
+    return {"done": True, "file": state["file"], "url": url, "format": fmt, "rows": exported,
+            "message": f"Exported {exported} meals"}
+
+
 def _normalize_text(s: str) -> str:
     s = (s or "").lower()
     s = re.sub(r"[\W_]+", " ", s)  # remove punctuation
@@ -348,12 +1656,468 @@ def _token_jaccard(a: str, b: str) -> float:
     union = ta.union(tb)
     return len(inter) / len(union) if union else 0.0
 
+
+# Per-user fuzzy-match index kept warm across invocations in this container.
+# Writes through this Lambda update it in place; the TTL bounds staleness from
+# writes made elsewhere (e.g. the app inserting into Supabase directly). Only
+# the user's most recent MEAL_INDEX_MAX_ROWS meals are indexed, so a rebuild
+# costs the same for every user however long their history.
+MEAL_INDEX_TTL_SECONDS = 60
+MEAL_INDEX_MAX_ROWS = 2000
+MEAL_INDEX_SHORTLIST = 12
+# Users whose index (and catalog) a container keeps; a 2000-meal user's pair
+# takes about 3 MB, so the default stays well inside the 512 MB function
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '64'))
+_meal_indexes = OrderedDict()
+
+
+def _user_cache_get(cache, user_id):
+    """The user's entry in a per-user LRU cache if still fresh; an expired one is dropped."""
+    entry = cache.get(user_id)
+    if entry is None:
+        return None
+    if not entry.is_fresh():
+        del cache[user_id]
+        return None
+    cache.move_to_end(user_id)
+    return entry
+
+
+def _user_cache_put(cache, user_id, entry):
+    """Store the user's entry, evicting expired entries and then the least recently used."""
+    cache[user_id] = entry
+    cache.move_to_end(user_id)
+    while True:
+        oldest = next(iter(cache))
+        if oldest == user_id or (len(cache) <= USER_CACHE_SIZE and cache[oldest].is_fresh()):
+            break
+        del cache[oldest]
+
+
+def _char_ngrams(s: str, n: int = 3) -> set:
+    padded = f" {s} "
+    return {padded[i:i + n] for i in range(max(len(padded) - n + 1, 1))}
+
+
+def _created_at_key(row):
+    return str(row.get("created_at") or "")
+
+
+class _MealNameIndex:
+    """Pre-normalized meal names, token sets and character trigram postings for one user.
+
+    Users re-log the same foods, so rows are grouped by normalized name and all
+    matching work is done once per distinct name rather than once per row.
+    """
+
+    def __init__(self, rows):
+        self.built_at = time.monotonic()
+        self.rows = {}  # meal id -> row
+        self.names = []
+        self.name_rows = []  # meal ids per name, newest first
+        self.tokens = []
+        self.gram_counts = []
+        self.postings = {}
+        self._name_ids = {}
+        self._row_names = {}  # meal id -> name id
+        # Rows arrive newest first, so appending keeps name_rows in order
+        for r in rows:
+            self._insert(r)
+
+    def _insert(self, row):
+        norm = _normalize_text(row.get("meal_name"))
+        name_id = self._name_ids.get(norm)
+        if name_id is None:
+            name_id = self._name_ids[norm] = len(self.names)
+            self.names.append(norm)
+            self.name_rows.append([])
+            self.tokens.append(set(norm.split()))
+            grams = _char_ngrams(norm)
+            self.gram_counts.append(len(grams))
+            for g in grams:
+                self.postings.setdefault(g, []).append(name_id)
+        meal_id = row["id"]
+        self.rows[meal_id] = row
+        self._row_names[meal_id] = name_id
+        self.name_rows[name_id].append(meal_id)
+        return name_id
+
+    def add(self, row):
+        """Index a new or changed meal, replacing the row with the same id."""
+        self.remove(row["id"])
+        name_id = self._insert(row)
+        self.name_rows[name_id].sort(key=lambda i: _created_at_key(self.rows[i]), reverse=True)
+
+    def remove(self, meal_id):
+        name_id = self._row_names.pop(meal_id, None)
+        if name_id is not None:
+            del self.rows[meal_id]
+            self.name_rows[name_id].remove(meal_id)
+
+    def newest_first(self):
+        return sorted(self.rows.values(), key=_created_at_key, reverse=True)
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.built_at < MEAL_INDEX_TTL_SECONDS
+
+    def shortlist(self, target: str, limit: int = MEAL_INDEX_SHORTLIST):
+        """Return ids of the distinct names sharing the most trigrams/tokens with `target`."""
+        grams = _char_ngrams(target)
+        shared = {}
+        for g in grams:
+            for i in self.postings.get(g, ()):
+                shared[i] = shared.get(i, 0) + 1
+        target_tokens = set(target.split())
+        scored = []
+        for i, count in shared.items():
+            if not self.name_rows[i]:
+                continue  # every meal with this name was deleted or renamed
+            dice = 2.0 * count / (len(grams) + self.gram_counts[i])
+            if target_tokens & self.tokens[i]:
+                dice += 1.0  # a whole-word hit always makes the shortlist
+            scored.append((dice, i))
+        scored.sort(reverse=True)
+        return [i for _, i in scored[:limit]]
+
+
+def _get_meal_index(user_id):
+    """Return a fresh _MealNameIndex for the user, rebuilding it from Supabase if needed."""
+    index = _user_cache_get(_meal_indexes, user_id)
+    if index is not None:
+        return index
+    # SECURITY: Filter by user_id to only index the authenticated user's meals
+    response = get_supabase().table("Meals")\
+        .select(MEAL_COLUMNS)\
+        .eq("user_id", user_id)\
+        .order("created_at", desc=True)\
+        .limit(MEAL_INDEX_MAX_ROWS)\
+        .execute()
+    with tracing.span("index_build"):
+        index = _MealNameIndex(getattr(response, "data", []) or [])
+    _user_cache_put(_meal_indexes, user_id, index)
+    return index
+
+
+# Per-user food catalog: one entry per distinct (normalized) meal name with the
+# macros from its most recent log and how often it was logged. Adds through this
+# Lambda update it in place, so it can outlive the fuzzy-match index; the TTL
+# only bounds how long foods first logged from the app take to show up.
+FOOD_CATALOG_TTL_SECONDS = 900
+FOOD_PREFIX_MAX_LEN = 12
+SUGGEST_DEFAULT_LIMIT = 5
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_MIN_FUZZY_SCORE = 0.3
+_food_catalogs = OrderedDict()
+
+
+class _FoodCatalog:
+    """Distinct foods for one user with a token-prefix index and trigram postings.
+
+    Prefix lookups are dictionary hits, so autocomplete is microseconds; the
+    trigram postings catch typos when no name starts with what was typed.
+    """
+
+    def __init__(self, rows):
+        self.built_at = time.monotonic()
+        self.entries = []
+        self.norms = []
+        self.recency = []  # larger is more recently logged
+        self.ids = {}
+        self.prefixes = {}
+        self.postings = {}
+        self.gram_counts = []
+        self._clock = 0
+        self._by_frequency = None
+        # Oldest first, so each entry ends up with its newest macros
+        for row in reversed(rows):
+            self.add(row)
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.built_at < FOOD_CATALOG_TTL_SECONDS
+
+    def add(self, row):
+        """Record one logged meal."""
+        norm = _normalize_text(row.get("meal_name"))
+        if not norm:
+            return
+        entry_id = self.ids.get(norm)
+        if entry_id is None:
+            entry_id = self.ids[norm] = len(self.entries)
+            self.entries.append({"name": row.get("meal_name"), "times_logged": 0, "last_logged": None})
+            self.norms.append(norm)
+            self.recency.append(0)
+            for token in norm.split():
+                for k in range(1, min(len(token), FOOD_PREFIX_MAX_LEN) + 1):
+                    self.prefixes.setdefault(token[:k], set()).add(entry_id)
+            grams = _char_ngrams(norm)
+            self.gram_counts.append(len(grams))
+            for g in grams:
+                self.postings.setdefault(g, []).append(entry_id)
+        entry = self.entries[entry_id]
+        entry["times_logged"] += 1
+        self._by_frequency = None
+        created_at = row.get("created_at")
+        if created_at is None or entry["last_logged"] is None or str(created_at) >= entry["last_logged"]:
+            entry["name"] = row.get("meal_name")
+            for field in MACRO_FIELDS:
+                entry[field] = row.get(field)
+            entry["last_logged"] = str(created_at) if created_at is not None else entry["last_logged"]
+            self._clock += 1
+            self.recency[entry_id] = self._clock
+
+    def get(self, name):
+        """Return the entry whose normalized name equals `name`'s, or None."""
+        entry_id = self.ids.get(_normalize_text(name))
+        return self.entries[entry_id] if entry_id is not None else None
+
+    def _rank(self, entry_id):
+        return (-self.entries[entry_id]["times_logged"], -self.recency[entry_id])
+
+    def suggest(self, query, limit=SUGGEST_DEFAULT_LIMIT):
+        """Return [(entry, match)] for foods matching `query`, most logged first.
+
+        Every word of the query must start a word of the name ("chick bre" finds
+        "Chicken Breast"); an exact name match ranks first. With no prefix match
+        the closest names by trigram overlap are returned instead.
+        """
+        target = _normalize_text(query)
+        tokens = target.split()
+        if not tokens:
+            if self._by_frequency is None:
+                self._by_frequency = sorted(range(len(self.entries)), key=self._rank)
+            return [(self.entries[i], "frequent") for i in self._by_frequency[:limit]]
+
+        matched = None
+        for token in tokens:
+            ids = self.prefixes.get(token[:FOOD_PREFIX_MAX_LEN], ())
+            if len(token) > FOOD_PREFIX_MAX_LEN:
+                ids = {i for i in ids if any(t.startswith(token) for t in self.norms[i].split())}
+            matched = set(ids) if matched is None else matched & ids
+            if not matched:
+                break
+        if matched:
+            ranked = heapq.nsmallest(limit, matched, key=lambda i: (self.norms[i] != target,) + self._rank(i))
+            return [(self.entries[i], "exact" if self.norms[i] == target else "prefix") for i in ranked]
+
+        grams = _char_ngrams(target)
+        shared = {}
+        for g in grams:
+            for i in self.postings.get(g, ()):
+                shared[i] = shared.get(i, 0) + 1
+        scored = []
+        for i, count in shared.items():
+            dice = 2.0 * count / (len(grams) + self.gram_counts[i])
+            if dice >= SUGGEST_MIN_FUZZY_SCORE:
+                scored.append((-dice,) + self._rank(i) + (i,))
+        return [(self.entries[t[-1]], "fuzzy") for t in heapq.nsmallest(limit, scored)]
+
+
+def _get_food_catalog(user_id):
+    """Return a fresh _FoodCatalog for the user, building it from the meal index's rows if needed."""
+    catalog = _user_cache_get(_food_catalogs, user_id)
+    if catalog is not None:
+        return catalog
+    rows = _get_meal_index(user_id).newest_first()
+    with tracing.span("catalog_build"):
+        catalog = _FoodCatalog(rows)
+    _user_cache_put(_food_catalogs, user_id, catalog)
+    return catalog
+
+
+# Read-only tool results, keyed on (user, path, normalized params, local date,
+# meal-state version). Every write through this Lambda bumps the user's version,
+# so a cached answer is never served after a change made here; the TTL bounds
+# staleness from writes made in the app.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '512'))
+RESPONSE_CACHE_TTL_SECONDS = 60
+_response_cache = OrderedDict()
+_response_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_state_versions = {}
+
+
+def _is_error_result(result) -> bool:
+    message = result.get("message") if isinstance(result, dict) else result
+    return isinstance(message, str) and message.startswith(("Exception", "DB error"))
+
+
+def _cached_read(user_id, api_path, params, local_date, compute, refresh=False):
+    """Return `compute()`'s result for this read, reusing an earlier identical one if still valid.
+
+    With `refresh` the read always runs, and its result replaces the cached one.
+    """
+    key = (user_id, api_path, json.dumps(params, sort_keys=True, default=str), local_date,
+           _state_versions.get(user_id, 0))
+    entry = None if refresh else _response_cache.get(key)
+    if entry is not None and time.monotonic() - entry[0] < RESPONSE_CACHE_TTL_SECONDS:
+        _response_cache.move_to_end(key)
+        _response_cache_stats["hits"] += 1
+        tracing.set_property("response_cache", "hit")
+        return entry[1]
+
+    _response_cache_stats["misses"] += 1
+    tracing.set_property("response_cache", "miss")
+    result = compute()
+    # Failed reads are retried next time rather than replayed
+    if not _is_error_result(result):
+        _response_cache[key] = (time.monotonic(), result)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+            _response_cache_stats["evictions"] += 1
+    tracing.set_property("response_cache_hits", _response_cache_stats["hits"])
+    tracing.set_property("response_cache_misses", _response_cache_stats["misses"])
+    return result
+
+
+def _invalidate_user_caches(user_id, added_rows=None, updated_rows=None, deleted_rows=None):
+    """Bring warm per-user state up to date after this Lambda changes the user's meals.
+
+    Bumps the user's meal-state version, which retires their cached read
+    results. Pass the rows the change inserted, updated and deleted, as the
+    database returned them: the fuzzy-match index applies them in place, and
+    the food catalog absorbs inserts (any update or delete drops it; it is
+    rebuilt from the index without a query). Called with none of them, for a
+    change that can't be described row by row, both are dropped.
+    """
+    _state_versions[user_id] = _state_versions.get(user_id, 0) + 1
+    changes = (list(added_rows or ()), list(updated_rows or ()), list(deleted_rows or ()))
+    described = not (added_rows is None and updated_rows is None and deleted_rows is None)
+    if not described or any("id" not in row for rows in changes for row in rows):
+        _meal_indexes.pop(user_id, None)
+        _food_catalogs.pop(user_id, None)
+        return
+
+    index = _meal_indexes.get(user_id)
+    if index is not None:
+        for row in changes[0] + changes[1]:
+            index.add(row)
+        # After the updates: a batch may modify a meal and then delete it
+        for row in changes[2]:
+            index.remove(row["id"])
+    catalog = _food_catalogs.get(user_id)
+    if catalog is not None:
+        if updated_rows or deleted_rows:
+            del _food_catalogs[user_id]
+        else:
+            for row in added_rows:
+                catalog.add(row)
+
+
+def _fill_from_catalog(params, user_id):
+    """Fill a name-only add from the user's catalog.
+
+    Returns (params, entry), with missing macros copied from the last time the
+    user logged this food, or (params, None) if it isn't in the catalog.
+    """
+    try:
+        entry = _get_food_catalog(user_id).get(params.get("meal_name"))
+    except Exception:
+        print(traceback.format_exc())
+        return params, None
+    if entry is None or entry.get("calories") is None:
+        return params, None
+    filled = dict(params)
+    for field in MACRO_FIELDS:
+        if filled.get(field) is None:
+            filled[field] = entry.get(field)
+    return filled, entry
+
+
+def _suggestion_hint(name, user_id):
+    """'. Did you mean: ...?' for a name-only add that isn't in the catalog, or ''."""
+    catalog = _food_catalogs.get(user_id)
+    if catalog is None:
+        return ""
+    names = [entry["name"] for entry, _ in catalog.suggest(name, 3)]
+    return f". Did you mean: {', '.join(names)}?" if names else ""
+
+def _score_candidates(index, name, provided_cal=None, window=None):
+    """Return the candidates for one name against a _MealNameIndex, best first.
+
+    `window` is a (start, end) pair of datetimes; only meals logged in [start, end) are candidates.
+    """
+    target = _normalize_text(name)
+    target_tokens = set(target.split())
+    candidates = []
+
+    shortlist = index.shortlist(target)
+    if len(shortlist) < 5:
+        # Keep returning up to five candidates for clarification, like a full scan would
+        seen = set(shortlist)
+        shortlist += [i for i in range(len(index.names)) if i not in seen and index.name_rows[i]][:5 - len(shortlist)]
+
+    for name_id in shortlist:
+        norm = index.names[name_id]
+        seq_ratio = difflib.SequenceMatcher(None, target, norm).ratio()
+        union = target_tokens | index.tokens[name_id]
+        jacc = len(target_tokens & index.tokens[name_id]) / len(union) if union else 0.0
+        name_score = max(seq_ratio, jacc)
+
+        # Rows are newest first; at most five per name can reach the top five
+        row_scores = []
+        for meal_id in index.name_rows[name_id]:
+            r = index.rows[meal_id]
+            if window is not None and not window[0] <= _parse_timestamp(r.get("created_at"), "created_at") < window[1]:
+                continue
+            score = name_score
+            # bonus if calories specified and matches
+            try:
+                if provided_cal is not None and r.get("calories") is not None:
+                    if int(r.get("calories")) == int(provided_cal):
+                        score = min(1.0, score + 0.1)
+            except Exception:
+                pass
+            row_scores.append((score, r))
+            if provided_cal is None and len(row_scores) == 5:
+                break
+        row_scores.sort(key=lambda x: x[0], reverse=True)
+
+        for score, r in row_scores[:5]:
+            candidates.append({
+                "id": r.get("id"),
+                "name": r.get("meal_name") or "",
+                "calories": r.get("calories"),
+                "created_at": r.get("created_at"),
+                "score": round(float(score), 3)
+            })
+
+    candidates.sort(key=lambda x: x["score"], reverse=True)
+    return candidates
+
+
+def _parse_names(names):
+    if isinstance(names, str):
+        try:
+            parsed = json.loads(names)
+        except ValueError:
+            parsed = names.split(",")
+        names = parsed if isinstance(parsed, list) else [names]
+    if not isinstance(names, list):
+        return []
+    return [str(n).strip() for n in names if str(n).strip()]
+
+
+def _match_window(params):
+    """(start, end) datetimes of the optional `date` param (YYYY-MM-DD), or None to match any day."""
+    if not params.get("date"):
+        return None
+    day = _parse_date(params["date"], "date")
+    return tuple(datetime.fromisoformat(ts) for ts in _day_bounds(day, day))
+
+
 def find_meal_by_name(params, user_id):
-    """Find today's meals that best match `params['name']`.
+    """Find the user's meals that best match `params['name']`.
 
-    Returns structured candidates with scores. If `action` and `auto_confirm_threshold`
-    are provided and best match meets threshold, performs the action.
+    Returns structured candidates with scores, the most recent first among equal
+    scores; `date` (YYYY-MM-DD) limits them to meals logged that day. If `action`
+    and `auto_confirm_threshold` are provided and best match meets threshold,
+    performs the action.
+    With `params['names']` (a list) every name is matched and the actions on
+    all confident matches are applied together; see _find_meals_by_names.
     """
+    if params.get("names") and not params.get("name"):
+        return _find_meals_by_names(params, user_id)
+
     name = params.get("name")
     if not name:
         return {"candidates": [], "best_match": None, "auto_act_performed": False, "message": "Missing 'name' parameter"}
@@ -361,52 +2125,25 @@ def find_meal_by_name(params, user_id):
     action = params.get("action")  # 'modify'|'delete'|None
     threshold = float(params.get("auto_confirm_threshold", 0.85))
     update_fields = params.get("update_fields") or {}
+    try:
+        window = _match_window(params)
+    except ValueError as e:
+        return {"candidates": [], "best_match": None, "auto_act_performed": False,
+                "message": f"Invalid parameters: {str(e)}"}
 
     try:
-        # SECURITY: Filter by user_id to only search the authenticated user's meals
-        response = supabase.table("Meals")\
-            .select("id, meal_name, calories, protein, carbs, fat, created_at")\
-            .eq("user_id", user_id)\
-            .execute()
-        rows = getattr(response, "data", []) or []
+        index = _get_meal_index(user_id)
     except Exception as e:
-        import traceback
         tb = traceback.format_exc()
         print(tb)
         return {"candidates": [], "best_match": None, "auto_act_performed": False, "message": f"DB error: {str(e)}"}
 
-    if not rows:
+    if not index.rows:
         return {"candidates": [], "best_match": None, "auto_act_performed": False, "message": "No meals found today"}
 
-    target = _normalize_text(name)
-    candidates = []
-
-    for r in rows:
-        mname = r.get("meal_name") or ""
-        norm = _normalize_text(mname)
-
-        seq_ratio = difflib.SequenceMatcher(None, target, norm).ratio()
-        jacc = _token_jaccard(target, norm)
-        score = max(seq_ratio, jacc)
-
-        # bonus if calories specified and matches
-        try:
-            provided_cal = params.get("calories")
-            if provided_cal is not None and r.get("calories") is not None:
-                if int(r.get("calories")) == int(provided_cal):
-                    score = min(1.0, score + 0.1)
-        except Exception:
-            pass
-
-        candidates.append({
-            "id": r.get("id"),
-            "name": mname,
-            "calories": r.get("calories"),
-            "created_at": r.get("created_at"),
-            "score": round(float(score), 3)
-        })
-
-    candidates.sort(key=lambda x: x["score"], reverse=True)
+    scoring_started = time.perf_counter()
+    candidates = _score_candidates(index, name, params.get("calories"), window)
+    tracing.record("fuzzy_scoring", (time.perf_counter() - scoring_started) * 1000)
     best_candidate = candidates[0] if candidates else None
     best_score = float(best_candidate.get("score", 0.0)) if best_candidate else 0.0
 
@@ -425,6 +2162,93 @@ def find_meal_by_name(params, user_id):
     return {"candidates": candidates[:5], "best_match": best_candidate, "auto_act_performed": False, "message": "Candidates returned"}
 
 
+def _find_meals_by_names(params, user_id):
+    """Match several names at once, e.g. "delete the burrito and the salad".
+
+    All names are scored against one read of the user's meals, and the action
+    for every confident match goes through batch_meals, so the writes are
+    grouped and sent concurrently instead of one find-then-act per name.
+    """
+    names = _parse_names(params.get("names"))
+    if not names:
+        return {"results": [], "message": "Missing 'names' parameter"}
+    if len(names) > BATCH_MAX_OPERATIONS:
+        return {"results": [], "message": f"Too many names (max {BATCH_MAX_OPERATIONS})"}
+
+    action = params.get("action")
+    threshold = float(params.get("auto_confirm_threshold", 0.85))
+    update_fields = params.get("update_fields") or {}
+    try:
+        window = _match_window(params)
+    except ValueError as e:
+        return {"results": [], "message": f"Invalid parameters: {str(e)}"}
+
+    try:
+        index = _get_meal_index(user_id)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"results": [], "message": f"DB error: {str(e)}"}
+
+    scoring_started = time.perf_counter()
+    results = []
+    operations = []
+    acting = []  # results whose best match is in `operations`, in the same order
+    matched_ids = set()
+    for name in names:
+        candidates = _score_candidates(index, name, window=window) if index.rows else []
+        best = candidates[0] if candidates else None
+        result = {"name": name, "candidates": candidates[:5], "best_match": best,
+                  "auto_act_performed": False, "message": "Candidates returned" if candidates else "No meals found"}
+        results.append(result)
+        if action in ("delete", "modify") and best and best["score"] >= threshold:
+            if best["id"] in matched_ids:
+                result["message"] = f"Meal with ID {best['id']} already matched another name"
+                continue
+            matched_ids.add(best["id"])
+            operations.append({**(update_fields if action == "modify" else {}), "op": action, "meal_id": best["id"]})
+            acting.append(result)
+    tracing.record("fuzzy_scoring", (time.perf_counter() - scoring_started) * 1000)
+
+    if operations:
+        batch = batch_meals({"operations": operations}, user_id)
+        for result, outcome in zip(acting, batch["results"]):
+            result["auto_act_performed"] = outcome["status"] == "ok"
+            result["message"] = outcome["message"]
+
+    acted = sum(1 for r in results if r["auto_act_performed"])
+    message = f"Acted on {acted} of {len(names)} names" if action else f"Candidates returned for {len(names)} names"
+    return {"results": results, "message": message}
+
+
+def suggest_meals(params, user_id):
+    """Autocomplete `params['query']` against foods the user has logged before.
+
+    Each suggestion carries the macros from the food's most recent log, so the
+    agent can pass them straight to /addMeal without estimating nutrition.
+    """
+    query = params.get("query") or params.get("name") or params.get("prefix") or ""
+    try:
+        limit = int(params.get("limit") or SUGGEST_DEFAULT_LIMIT)
+    except (TypeError, ValueError):
+        return {"suggestions": [], "message": "limit must be a number"}
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+
+    try:
+        catalog = _get_food_catalog(user_id)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(tb)
+        return {"suggestions": [], "message": f"DB error: {str(e)}"}
+
+    lookup_started = time.perf_counter()
+    suggestions = [dict(entry, match=match) for entry, match in catalog.suggest(str(query), limit)]
+    tracing.record("catalog_lookup", (time.perf_counter() - lookup_started) * 1000)
+    if not suggestions:
+        return {"suggestions": [], "message": f"No logged foods match '{query}'"}
+    return {"suggestions": suggestions, "message": f"{len(suggestions)} suggestions"}
+
+
 def create_response(message, api_path, action_group, http_method, status_code=200):
     """Return the exact format Bedrock expects"""
     return {
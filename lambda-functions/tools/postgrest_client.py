@@ -0,0 +1,241 @@
+"""Minimal PostgREST client for the tools Lambda.
+
+Covers the subset of the supabase-py query builder that meal_tools uses
+(select/insert/update/upsert/delete, eq/gte/gt/lt/lte/in_/or_ filters,
+order/limit) on top of a single httpx client. The client keeps an
+HTTP/2 keep-alive connection pool open across warm invocations, so
+back-to-back queries such as a select followed by a mutation reuse one TLS
+connection instead of paying a handshake each. Independent queries can be
+sent concurrently with `execute_many`, multiplexed over the same pool.
+
+Unlike supabase-py there is no auth/storage/realtime stack to import. Point
+`base_url` at any PostgREST-compatible server, e.g. a local stand-in for tests.
+"""
+import json
+
+import httpx
+
+import tracing
+
+
+class PostgrestError(Exception):
+    """Raised for non-2xx PostgREST responses."""
+
+    def __init__(self, message, status_code=None, code=None, details=None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.code = code
+        self.details = details
+
+
+class APIResponse:
+    """Result of `execute()`; mirrors the `data`/`error` attributes of supabase-py responses."""
+
+    __slots__ = ("data", "error", "status_code")
+
+    def __init__(self, data, status_code):
+        self.data = data
+        self.error = None
+        self.status_code = status_code
+
+
+def _format(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _quote(value) -> str:
+    """Format a value inside in.(...) lists, quoting PostgREST reserved characters."""
+    s = _format(value)
+    if any(c in s for c in ',.:()" '):
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return s
+
+
+def _api_response(resp) -> APIResponse:
+    """Decode an httpx response, raising PostgrestError for failures."""
+    try:
+        data = resp.json() if resp.content else None
+    except ValueError:
+        data = None
+        if resp.status_code < 400:
+            raise PostgrestError("PostgREST returned a non-JSON response", status_code=resp.status_code)
+    if resp.status_code >= 400:
+        err = data if isinstance(data, dict) else {}
+        raise PostgrestError(
+            err.get("message") or f"PostgREST request failed with HTTP {resp.status_code}",
+            status_code=resp.status_code,
+            code=err.get("code"),
+            details=err.get("details"),
+        )
+    return APIResponse(data, resp.status_code)
+
+
+class QueryBuilder:
+    def __init__(self, client, table):
+        self._client = client
+        self._table = table
+        self._method = "GET"
+        self._params = []
+        self._json = None
+        self._prefer = []
+        self._order = []
+
+    # -- operations ---------------------------------------------------------
+
+    def select(self, columns="*"):
+        self._method = "GET"
+        self._params.append(("select", "".join(str(columns).split())))
+        return self
+
+    def insert(self, rows):
+        self._method = "POST"
+        self._json = rows
+        self._prefer.append("return=representation")
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self._method = "POST"
+        self._json = rows
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        self._prefer += ["return=representation", f"resolution={resolution}"]
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def update(self, values):
+        self._method = "PATCH"
+        self._json = values
+        self._prefer.append("return=representation")
+        return self
+
+    def delete(self):
+        self._method = "DELETE"
+        self._prefer.append("return=representation")
+        return self
+
+    # -- filters --------------------------------------------------------------
+
+    def _filter(self, column, op, value):
+        self._params.append((column, f"{op}.{value}"))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", _format(value))
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", _format(value))
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", _format(value))
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", _format(value))
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", _format(value))
+
+    def in_(self, column, values):
+        return self._filter(column, "in", "(" + ",".join(_quote(v) for v in values) + ")")
+
+    def or_(self, filters):
+        self._params.append(("or", f"({filters})"))
+        return self
+
+    def order(self, column, desc=False):
+        self._order.append(f"{column}.{'desc' if desc else 'asc'}")
+        return self
+
+    def limit(self, count):
+        self._params.append(("limit", str(int(count))))
+        return self
+
+    # -- execution ------------------------------------------------------------
+
+    def request_args(self):
+        """(method, path, params, body, prefer) for PostgrestClient.request."""
+        params = list(self._params)
+        if self._order:
+            params.append(("order", ",".join(self._order)))
+        return self._method, f"/rest/v1/{self._table}", params, self._json, self._prefer
+
+    def execute(self) -> APIResponse:
+        return self._client.request(*self.request_args())
+
+
+def _encode(body, prefer):
+    headers = {"Prefer": ",".join(prefer)} if prefer else None
+    content = json.dumps(body, default=str) if body is not None else None
+    if content is not None:
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+    return headers, content
+
+
+def _execute_or_error(query):
+    try:
+        return query.execute()
+    except Exception as e:
+        return e
+
+
+class PostgrestClient:
+    """PostgREST client with a persistent connection pool; create once per container.
+
+    Queries run on one synchronous httpx client. `execute_many` sends
+    independent queries concurrently from a small thread pool, created on
+    first use and kept for later warm invocations, through that same client,
+    so a fan-out of N queries costs about one round trip and shares the warm
+    connection instead of opening another.
+    """
+
+    def __init__(self, base_url, api_key, timeout=10.0, http2=True, max_concurrency=8):
+        self._max_concurrency = max_concurrency
+        self._http = httpx.Client(
+            base_url=str(base_url).rstrip("/"),
+            http2=http2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=300),
+            headers={
+                "apikey": api_key or "",
+                "Authorization": f"Bearer {api_key or ''}",
+                "Accept": "application/json",
+            },
+        )
+        self._executor = None
+
+    def table(self, name) -> QueryBuilder:
+        return QueryBuilder(self, name)
+
+    def request(self, method, path, params, body, prefer) -> APIResponse:
+        headers, content = _encode(body, prefer)
+        # one span per table and verb, e.g. "db.GET.Meals"
+        with tracing.span(f"db.{method}.{path.rsplit('/', 1)[-1]}"):
+            resp = self._http.request(method, path, params=params, content=content, headers=headers)
+        return _api_response(resp)
+
+    def execute_many(self, queries):
+        """Execute independent queries concurrently; returns their results in order.
+
+        Each result is an APIResponse or the exception that query raised. A
+        single query runs on the calling thread, which is cheaper than a hop
+        to the pool.
+        """
+        if len(queries) <= 1:
+            return [_execute_or_error(query) for query in queries]
+
+        # The pool is only needed once a request fans out; importing it here
+        # keeps it off the cold start
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self._max_concurrency, thread_name_prefix="postgrest")
+        return list(self._executor.map(_execute_or_error, queries))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        self._http.close()
@@ -5,6 +5,30 @@ variable "supabase_jwt_secret" {
   sensitive   = true
 }
 
+variable "supabase_jwks_url" {
+  description = "Supabase JWKS URL for RS256/ES256 access tokens (<project url>/auth/v1/.well-known/jwks.json); leave empty for HS256 only"
+  type        = string
+  default     = ""
+}
+
+# Shared by all agent Lambda containers: duplicate chat requests, per-user rate limits
+# and asynchronous jobs (items are told apart by their key prefix)
+resource "aws_dynamodb_table" "agent_requests" {
+  name         = "cal-tracker-agent-requests"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
 # IAM Role for Agent Lambda
 resource "aws_iam_role" "agent_lambda_role" {
   name = "bedrock-agent-lambda-role"
@@ -37,6 +61,24 @@ resource "aws_iam_role_policy" "agent_lambda_bedrock_policy" {
         ]
         Resource = "*"
       },
+      {
+        # Prefetching today's meals reads them through the tools Lambda
+        Effect   = "Allow"
+        Action   = ["lambda:InvokeFunction"]
+        Resource = aws_lambda_function.tools.arn
+      },
+      {
+        # Asynchronous turns run in an asynchronous invocation of this Lambda
+        Effect   = "Allow"
+        Action   = ["lambda:InvokeFunction"]
+        Resource = aws_lambda_function.agent.arn
+      },
+      {
+        # Idempotency records, per-user rate limit buckets and asynchronous jobs
+        Effect   = "Allow"
+        Action   = ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:DeleteItem"]
+        Resource = aws_dynamodb_table.agent_requests.arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -72,8 +114,15 @@ resource "aws_lambda_function" "agent" {
   environment {
     variables = {
       JWT_SECRET             = var.supabase_jwt_secret
+      JWT_JWKS_URL           = var.supabase_jwks_url
       BEDROCK_AGENT_ID       = aws_bedrockagent_agent.CalTrackerAgent.id
       BEDROCK_AGENT_ALIAS_ID = "TSTALIASID"  # Default alias, update if using custom alias
+      PREFETCH_MEALS         = "true"
+      FAST_PATH_ROUTER       = "true"
+      IDEMPOTENCY_TABLE      = aws_dynamodb_table.agent_requests.name
+      JOBS_TABLE             = aws_dynamodb_table.agent_requests.name
+      DUPLICATE_WAIT_SECONDS = "20"  # under API Gateway's 29s timeout
+      TOOLS_FUNCTION_NAME    = aws_lambda_function.tools.function_name
     }
   }
 
@@ -83,6 +132,12 @@ resource "aws_lambda_function" "agent" {
   ]
 }
 
+# A failed job is reported through its record; retrying it would run the turn again
+resource "aws_lambda_function_event_invoke_config" "agent_jobs" {
+  function_name          = aws_lambda_function.agent.function_name
+  maximum_retry_attempts = 0
+}
+
 # API Gateway REST API
 resource "aws_api_gateway_rest_api" "agent_api" {
   name        = "cal-tracker-agent-api"
@@ -101,6 +156,126 @@ resource "aws_api_gateway_resource" "agent_resource" {
   path_part   = "agent"
 }
 
+# API Gateway Resource for offline meal sync (same Lambda, routed on the resource path)
+resource "aws_api_gateway_resource" "sync_resource" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  parent_id   = aws_api_gateway_rest_api.agent_api.root_resource_id
+  path_part   = "sync"
+}
+
+resource "aws_api_gateway_method" "sync_method" {
+  rest_api_id   = aws_api_gateway_rest_api.agent_api.id
+  resource_id   = aws_api_gateway_resource.sync_resource.id
+  http_method   = "POST"
+  authorization = "NONE"  # Token verification happens in Lambda
+}
+
+resource "aws_api_gateway_integration" "sync_integration" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  resource_id = aws_api_gateway_resource.sync_resource.id
+  http_method = aws_api_gateway_method.sync_method.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.agent.invoke_arn
+}
+
+# API Gateway Resource for calorie history (GET, conditional on If-None-Match)
+resource "aws_api_gateway_resource" "history_resource" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  parent_id   = aws_api_gateway_rest_api.agent_api.root_resource_id
+  path_part   = "history"
+}
+
+resource "aws_api_gateway_method" "history_method" {
+  rest_api_id   = aws_api_gateway_rest_api.agent_api.id
+  resource_id   = aws_api_gateway_resource.history_resource.id
+  http_method   = "GET"
+  authorization = "NONE"  # Token verification happens in Lambda
+}
+
+resource "aws_api_gateway_integration" "history_integration" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  resource_id = aws_api_gateway_resource.history_resource.id
+  http_method = aws_api_gateway_method.history_method.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.agent.invoke_arn
+}
+
+# API Gateway Resource for polling asynchronous agent turns (GET)
+resource "aws_api_gateway_resource" "jobs_resource" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  parent_id   = aws_api_gateway_rest_api.agent_api.root_resource_id
+  path_part   = "jobs"
+}
+
+resource "aws_api_gateway_method" "jobs_method" {
+  rest_api_id   = aws_api_gateway_rest_api.agent_api.id
+  resource_id   = aws_api_gateway_resource.jobs_resource.id
+  http_method   = "GET"
+  authorization = "NONE"  # Token verification happens in Lambda
+}
+
+resource "aws_api_gateway_integration" "jobs_integration" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  resource_id = aws_api_gateway_resource.jobs_resource.id
+  http_method = aws_api_gateway_method.jobs_method.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.agent.invoke_arn
+}
+
+# API Gateway Resource for importing meal history files (POST)
+resource "aws_api_gateway_resource" "import_resource" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  parent_id   = aws_api_gateway_rest_api.agent_api.root_resource_id
+  path_part   = "import"
+}
+
+resource "aws_api_gateway_method" "import_method" {
+  rest_api_id   = aws_api_gateway_rest_api.agent_api.id
+  resource_id   = aws_api_gateway_resource.import_resource.id
+  http_method   = "POST"
+  authorization = "NONE"  # Token verification happens in Lambda
+}
+
+resource "aws_api_gateway_integration" "import_integration" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  resource_id = aws_api_gateway_resource.import_resource.id
+  http_method = aws_api_gateway_method.import_method.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.agent.invoke_arn
+}
+
+# API Gateway Resource for exporting meal history files (GET)
+resource "aws_api_gateway_resource" "export_resource" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  parent_id   = aws_api_gateway_rest_api.agent_api.root_resource_id
+  path_part   = "export"
+}
+
+resource "aws_api_gateway_method" "export_method" {
+  rest_api_id   = aws_api_gateway_rest_api.agent_api.id
+  resource_id   = aws_api_gateway_resource.export_resource.id
+  http_method   = "GET"
+  authorization = "NONE"  # Token verification happens in Lambda
+}
+
+resource "aws_api_gateway_integration" "export_integration" {
+  rest_api_id = aws_api_gateway_rest_api.agent_api.id
+  resource_id = aws_api_gateway_resource.export_resource.id
+  http_method = aws_api_gateway_method.export_method.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.agent.invoke_arn
+}
+
 # API Gateway Method (POST)
 resource "aws_api_gateway_method" "agent_method" {
   rest_api_id   = aws_api_gateway_rest_api.agent_api.id
@@ -183,6 +358,16 @@ resource "aws_api_gateway_deployment" "agent_deployment" {
   depends_on = [
     aws_api_gateway_method.agent_method,
     aws_api_gateway_integration.agent_integration,
+    aws_api_gateway_method.sync_method,
+    aws_api_gateway_integration.sync_integration,
+    aws_api_gateway_method.history_method,
+    aws_api_gateway_integration.history_integration,
+    aws_api_gateway_method.jobs_method,
+    aws_api_gateway_integration.jobs_integration,
+    aws_api_gateway_method.import_method,
+    aws_api_gateway_integration.import_integration,
+    aws_api_gateway_method.export_method,
+    aws_api_gateway_integration.export_integration,
     aws_api_gateway_method.agent_options,
     aws_api_gateway_integration.agent_options_integration,
     aws_api_gateway_method_response.agent_options_200,
@@ -196,6 +381,16 @@ resource "aws_api_gateway_deployment" "agent_deployment" {
     redeployment = sha1(jsonencode([
       aws_api_gateway_method.agent_method.id,
       aws_api_gateway_integration.agent_integration.id,
+      aws_api_gateway_method.sync_method.id,
+      aws_api_gateway_integration.sync_integration.id,
+      aws_api_gateway_method.history_method.id,
+      aws_api_gateway_integration.history_integration.id,
+      aws_api_gateway_method.jobs_method.id,
+      aws_api_gateway_integration.jobs_integration.id,
+      aws_api_gateway_method.import_method.id,
+      aws_api_gateway_integration.import_integration.id,
+      aws_api_gateway_method.export_method.id,
+      aws_api_gateway_integration.export_integration.id,
       aws_api_gateway_method.agent_options.id,
       aws_api_gateway_integration.agent_options_integration.id
     ]))
@@ -219,6 +414,31 @@ output "api_gateway_url" {
   value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/agent"
 }
 
+output "sync_url" {
+  description = "URL of the offline meal sync endpoint"
+  value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/sync"
+}
+
+output "history_url" {
+  description = "URL of the calorie history endpoint"
+  value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/history"
+}
+
+output "jobs_url" {
+  description = "URL for polling asynchronous agent turns"
+  value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/jobs"
+}
+
+output "import_url" {
+  description = "URL of the meal history import endpoint"
+  value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/import"
+}
+
+output "export_url" {
+  description = "URL of the meal history export endpoint"
+  value       = "${aws_api_gateway_stage.agent_stage.invoke_url}/export"
+}
+
 output "api_gateway_id" {
   description = "ID of the API Gateway"
   value       = aws_api_gateway_rest_api.agent_api.id
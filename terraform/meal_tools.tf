@@ -43,6 +43,51 @@ resource "aws_iam_role_policy_attachment" "tools_lambda_logs" {
   policy_arn = "arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
 }
 
+# Bulk import uploads and exports, under bulk/<user_id>/; presigned URLs move
+# the files, so they never pass through API Gateway
+resource "aws_s3_bucket" "bulk" {
+  bucket_prefix = "caltracker-bulk-"
+}
+
+resource "aws_s3_bucket_public_access_block" "bulk" {
+  bucket                  = aws_s3_bucket.bulk.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "bulk" {
+  bucket = aws_s3_bucket.bulk.id
+
+  rule {
+    id     = "expire-bulk-files"
+    status = "Enabled"
+    filter {
+      prefix = "bulk/"
+    }
+    expiration {
+      days = 7
+    }
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
+
+resource "aws_iam_role_policy" "tools_lambda_bulk" {
+  role = aws_iam_role.tools_lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [{
+      Effect   = "Allow"
+      Action   = ["s3:GetObject", "s3:PutObject", "s3:AbortMultipartUpload", "s3:ListMultipartUploadParts"]
+      Resource = "${aws_s3_bucket.bulk.arn}/bulk/*"
+    }]
+  })
+}
+
 resource "aws_iam_role" "bedrock_agent_role" {
   name = "bedrock-agent-role"
 
@@ -88,8 +133,9 @@ resource "aws_lambda_function" "tools" {
 
   environment {
     variables = {
-      DB_API_URL = var.db_api_url
-      DB_API_KEY = var.db_api_key
+      DB_API_URL  = var.db_api_url
+      DB_API_KEY  = var.db_api_key
+      BULK_BUCKET = aws_s3_bucket.bulk.id
     }
   }
 }
@@ -116,6 +162,12 @@ You will assist in lookup for calorie count, protein content, fat content,
 and carb content.
 You will also be able to add, edit, and remove meals
 from their daily meal tracker.
+When the user logs a food they have logged before, call addMeal with just
+the meal name to reuse their saved nutrition instead of estimating it.
+Some tools reply with compact JSON: lists of records are given as `cols`
+(field names) and `rows` (one array of values per record).
+The today_meals session attribute, when present, already lists the user's
+meals for today; use it instead of calling getMeals for today.
 EOF
 
   agent_resource_role_arn = aws_iam_role.bedrock_agent_role.arn